@@ -7,9 +7,14 @@ import time
 import struct
 import numpy as np
 import psycopg2
+import clip_client
 import config
+import embedding_codec
+import events
 
 # Lazy-loaded models
+_clip_sidecar = None  # True/False once the CLIP sidecar was tried
+_clip_tag_vectors = None
 _clip_model = None
 _clip_preprocess = None
 _clip_tokenizer = None
@@ -17,6 +22,10 @@ _clip_text_features = None
 _yolo_model = None
 _face_app = None
 
+# Stored embedding formats (embedding_codec.py), read once per run
+_formats = {}  # kind -> (codec, Projection or None)
+_projections = {}  # projection id -> Projection
+
 
 def get_db():
     return psycopg2.connect(
@@ -65,17 +74,50 @@ def get_clip():
     return _clip_model, _clip_preprocess, _clip_text_features
 
 
-def analyze_clip(img_pil):
-    """Return (tags, embedding). tags = list of (tag, score) above threshold. embedding = numpy float32 array."""
+def use_clip_sidecar():
+    """Whether CLIP runs in the shared sidecar; decided once per run, the local model otherwise."""
+    global _clip_sidecar
+    if _clip_sidecar is None:
+        try:
+            clip_client.stats()
+            _clip_sidecar = True
+            print("  CLIP: using the sidecar")
+        except clip_client.SidecarUnavailable as e:
+            _clip_sidecar = False
+            print(f"  CLIP sidecar unavailable ({e}), loading the model")
+    return _clip_sidecar
+
+
+def clip_tag_vectors():
+    """Normalised text embeddings of config.CLIP_TAGS, as a numpy matrix."""
+    global _clip_tag_vectors
+    if _clip_tag_vectors is None:
+        if use_clip_sidecar():
+            _clip_tag_vectors = clip_client.encode_texts(config.CLIP_TAGS)
+        else:
+            _clip_tag_vectors = get_clip()[2].cpu().numpy().astype(np.float32)
+    return _clip_tag_vectors
+
+
+def clip_image_embedding(img_pil):
+    """Normalised CLIP embedding of an image (numpy float32)."""
+    if use_clip_sidecar():
+        return clip_client.encode_images([img_pil])[0].copy()
+
     import torch
 
-    model, preprocess, text_features = get_clip()
+    model, preprocess, _ = get_clip()
     image = preprocess(img_pil).unsqueeze(0)
-
     with torch.no_grad():
-        image_features = model.encode_image(image)
-        image_features /= image_features.norm(dim=-1, keepdim=True)
-        similarity = (image_features @ text_features.T).squeeze(0)
+        features = model.encode_image(image)
+        features /= features.norm(dim=-1, keepdim=True)
+    return features.squeeze(0).cpu().numpy().astype(np.float32)
+
+
+def analyze_clip(img_pil):
+    """Return (tags, embedding). tags = list of (tag, score) above threshold. embedding = numpy float32 array."""
+    embedding = clip_image_embedding(img_pil)
+    similarity = clip_tag_vectors() @ embedding
 
     results = []
     for tag, score in zip(config.CLIP_TAGS, similarity.tolist()):
@@ -83,8 +125,6 @@ def analyze_clip(img_pil):
             results.append((tag, round(score, 3)))
 
     results.sort(key=lambda x: x[1], reverse=True)
-
-    embedding = image_features.squeeze(0).cpu().numpy().astype(np.float32)
     return results[:10], embedding
 
 
@@ -153,9 +193,41 @@ def analyze_faces(img_np):
     return results
 
 
-def embedding_to_bytes(embedding):
-    """Convert numpy float32 array to bytes."""
-    return embedding.astype(np.float32).tobytes()
+def embedding_to_bytes(conn, embedding, kind):
+    """Encode an embedding ("clip" or "face") in the active format of its kind."""
+    if kind not in _formats:
+        cur = conn.cursor()
+        _formats[kind] = embedding_codec.active_format(cur, kind)
+        cur.close()
+        codec, projection = _formats[kind]
+        if codec != "float32" or projection is not None:
+            print(f"  {kind} embeddings stored as {codec}"
+                  + (f", PCA {projection.dims} dims" if projection is not None else ""))
+    codec, projection = _formats[kind]
+    return embedding_codec.encode(embedding, codec, projection)
+
+
+def get_projection(conn, projection_id):
+    if projection_id not in _projections:
+        cur = conn.cursor()
+        _projections[projection_id] = embedding_codec.load_projection(cur, projection_id)
+        cur.close()
+    return _projections[projection_id]
+
+
+def vector_literal(embedding):
+    """pgvector text input of an embedding: '[0.1,0.2,...]'."""
+    return "[" + ",".join(f"{x:.7g}" for x in embedding.astype(np.float32)) + "]"
+
+
+def store_vector(cur, table, column, row_id, embedding):
+    """Mirror a bytea embedding into its pgvector column (sql/002_pgvector.sql) when enabled."""
+    if config.EMBEDDING_STORAGE != "pgvector":
+        return
+    cur.execute(
+        f"UPDATE {table} SET {column} = %s::vector WHERE id = %s",
+        (vector_literal(embedding), row_id),
+    )
 
 
 def find_matching_face(conn, embedding, threshold=None):
@@ -163,23 +235,43 @@ def find_matching_face(conn, embedding, threshold=None):
     if threshold is None:
         threshold = config.FACE_SIMILARITY_THRESHOLD
 
+    if config.EMBEDDING_STORAGE == "pgvector":
+        # Nearest face by the HNSW index on faces.embedding_vector
+        vec = vector_literal(embedding)
+        cur = conn.cursor()
+        cur.execute(
+            """SELECT id, 1 - (embedding_vector <=> %s::vector) FROM faces
+               WHERE embedding_vector IS NOT NULL
+               ORDER BY embedding_vector <=> %s::vector LIMIT 1""",
+            (vec, vec),
+        )
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row and row[1] >= threshold else None
+
     cur = conn.cursor()
-    cur.execute("SELECT id, embedding FROM faces")
+    cur.execute("SELECT id, embedding FROM faces WHERE embedding IS NOT NULL")
     rows = cur.fetchall()
     cur.close()
 
     if not rows:
         return None
 
-    query_norm = embedding / np.linalg.norm(embedding)
+    # Query in the space of each stored vector (full size, or a PCA projection)
+    queries = {0: embedding / np.linalg.norm(embedding)}
 
     best_id = None
     best_score = -1
 
     for face_id, emb_bytes in rows:
-        stored = np.frombuffer(emb_bytes, dtype=np.float32)
+        stored, projection_id = embedding_codec.decode(emb_bytes)
+        if projection_id not in queries:
+            projected = get_projection(conn, projection_id).apply(embedding)
+            queries[projection_id] = projected / np.linalg.norm(projected)
+        if len(stored) != len(queries[projection_id]):
+            continue
         stored_norm = stored / np.linalg.norm(stored)
-        score = float(np.dot(query_norm, stored_norm))
+        score = float(np.dot(queries[projection_id], stored_norm))
         if score > best_score:
             best_score = score
             best_id = face_id
@@ -225,16 +317,20 @@ def process_clip_batch(conn, batch_size=50):
                     (photo_id, tag_fr, score),
                 )
 
-            emb_bytes = embedding_to_bytes(embedding)
+            emb_bytes = embedding_to_bytes(conn, embedding, "clip")
             cur.execute(
                 "UPDATE photos SET clip_analyzed = TRUE, clip_embedding = %s, updated_at = NOW() WHERE id = %s",
                 (psycopg2.Binary(emb_bytes), photo_id),
             )
+            store_vector(cur, "photos", "clip_vector", photo_id, embedding)
             processed += 1
         except Exception as e:
             print(f"\n  CLIP error {relpath}: {e}", file=sys.stderr)
             cur.execute("UPDATE photos SET clip_analyzed = TRUE WHERE id = %s", (photo_id,))
 
+    if processed:
+        events.notify(cur, "embeddings")
+        events.notify(cur, "tags")
     conn.commit()
     cur.close()
     return processed
@@ -283,6 +379,8 @@ def process_yolo_batch(conn, batch_size=50):
             print(f"\n  YOLO error {relpath}: {e}", file=sys.stderr)
             cur.execute("UPDATE photos SET yolo_analyzed = TRUE WHERE id = %s", (photo_id,))
 
+    if processed:
+        events.notify(cur, "tags")
     conn.commit()
     cur.close()
     return processed
@@ -304,6 +402,7 @@ def process_faces_batch(conn, batch_size=20):
         return 0
 
     processed = 0
+    face_ids = set()
     for photo_id, relpath in rows:
         fullpath = os.path.join(config.PHOTOS_ROOT, relpath)
         if not os.path.exists(fullpath):
@@ -315,7 +414,7 @@ def process_faces_batch(conn, batch_size=20):
             faces = analyze_faces(img_np)
 
             for face_data in faces:
-                emb_bytes = embedding_to_bytes(face_data["embedding"])
+                emb_bytes = embedding_to_bytes(conn, face_data["embedding"], "face")
 
                 # Try to match existing face
                 face_id = find_matching_face(conn, face_data["embedding"])
@@ -328,7 +427,9 @@ def process_faces_batch(conn, batch_size=20):
                         (psycopg2.Binary(emb_bytes), face_data["age"], face_data["gender"]),
                     )
                     face_id = cur.fetchone()[0]
+                    store_vector(cur, "faces", "embedding_vector", face_id, face_data["embedding"])
 
+                face_ids.add(face_id)
                 bbox = face_data["bbox"]
                 cur.execute(
                     """INSERT INTO photo_faces (photo_id, face_id, bbox_x1, bbox_y1, bbox_x2, bbox_y2, confidence)
@@ -345,6 +446,8 @@ def process_faces_batch(conn, batch_size=20):
             print(f"\n  Face error {relpath}: {e}", file=sys.stderr)
             cur.execute("UPDATE photos SET face_analyzed = TRUE WHERE id = %s", (photo_id,))
 
+    if face_ids:
+        events.notify(cur, "faces", face_ids=sorted(face_ids))
     conn.commit()
     cur.close()
     return processed
@@ -4,12 +4,12 @@
 import os
 import sys
 import time
-import numpy as np
 import psycopg2
 import config
+import events
 
 # Re-use model loading from analyze_photos
-from analyze_photos import load_image, get_clip, embedding_to_bytes
+from analyze_photos import load_image, clip_image_embedding, embedding_to_bytes, store_vector
 
 
 def get_db():
@@ -23,17 +23,8 @@ def get_db():
 
 
 def compute_embedding(img_pil):
-    """Compute CLIP embedding for an image (without tag matching)."""
-    import torch
-
-    model, preprocess, _ = get_clip()
-    image = preprocess(img_pil).unsqueeze(0)
-
-    with torch.no_grad():
-        features = model.encode_image(image)
-        features /= features.norm(dim=-1, keepdim=True)
-
-    return features.squeeze(0).cpu().numpy().astype(np.float32)
+    """Compute CLIP embedding for an image (without tag matching), through the sidecar when it runs."""
+    return clip_image_embedding(img_pil)
 
 
 def main():
@@ -86,12 +77,14 @@ def main():
             try:
                 img_pil, _ = load_image(fullpath)
                 embedding = compute_embedding(img_pil)
-                emb_bytes = embedding_to_bytes(embedding)
+                emb_bytes = embedding_to_bytes(conn, embedding, "clip")
 
+                # updated_at moves the dashboard's CLIP index watermark
                 cur.execute(
-                    "UPDATE photos SET clip_embedding = %s WHERE id = %s",
+                    "UPDATE photos SET clip_embedding = %s, updated_at = NOW() WHERE id = %s",
                     (psycopg2.Binary(emb_bytes), photo_id),
                 )
+                store_vector(cur, "photos", "clip_vector", photo_id, embedding)
                 processed += 1
             except Exception as e:
                 print(f"\n  Error {relpath}: {e}", file=sys.stderr)
@@ -101,6 +94,7 @@ def main():
                 )
                 errors += 1
 
+        events.notify(cur, "embeddings")
         conn.commit()
 
         elapsed = time.time() - start
@@ -1,6 +1,8 @@
 import os
 
 PHOTOS_ROOT = "/u01/photos/icloud-shared"
+# Touched after a scan that added or changed photos; the dashboard drops its path cache
+RESCAN_STAMP = "/u01/photos/.rescan"
 
 PG_HOST = os.environ.get("PG_HOST", "192.168.0.64")
 PG_PORT = int(os.environ.get("PG_PORT", "5432"))
@@ -34,6 +36,15 @@ CLIP_TAGS = [
     "beach", "sea", "boat", "car", "panorama", "night sky",
 ]
 CLIP_THRESHOLD = 0.20  # minimum similarity score to keep a tag
+# Shared CLIP inference service (dashboard/clip_sidecar.py); the model is loaded here when unreachable
+CLIP_SIDECAR_SOCKET = os.environ.get("CLIP_SIDECAR_SOCKET", "/run/freerando/clip.sock") or None
+CLIP_SIDECAR_TIMEOUT = 60
+CLIP_SIDECAR_RETRY = 30  # seconds the sidecar is skipped after a failure
+# "pgvector": also fill photos.clip_vector / faces.embedding_vector (sql/002_pgvector.sql)
+# and match faces in PostgreSQL; "bytea": bytea columns only, faces matched in Python
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "bytea")
+# Cache invalidation events for the dashboard (events.py); None = no NOTIFY
+EVENT_CHANNEL = os.environ.get("EVENT_CHANNEL", "freerando_events") or None
 
 # YOLO settings
 YOLO_MODEL = "yolo11n.pt"
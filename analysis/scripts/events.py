@@ -0,0 +1,15 @@
+"""Cache invalidation events for the dashboard workers (dashboard/services/events.py).
+
+PostgreSQL delivers a NOTIFY when the writer's transaction commits; the topics
+and their data are listed in the dashboard module.
+"""
+
+import json
+import config
+
+
+def notify(cur, topic, **data):
+    """Queue an event on the writer's transaction (sent on commit)."""
+    if not config.EVENT_CHANNEL:
+        return
+    cur.execute("SELECT pg_notify(%s, %s)", (config.EVENT_CHANNEL, json.dumps(dict(data, topic=topic))))
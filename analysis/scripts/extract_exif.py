@@ -8,6 +8,7 @@ import subprocess
 import json
 import psycopg2
 import config
+import events
 
 
 def get_db():
@@ -21,9 +22,13 @@ def get_db():
 
 
 def scan_photos(conn):
-    """Insert new photos into the database."""
+    """Insert new photos into the database and refresh size/mtime of changed ones.
+
+    Returns the number of new photos.
+    """
     cur = conn.cursor()
     count = 0
+    changed = 0
     for dirpath, _dirs, files in os.walk(config.PHOTOS_ROOT):
         for fname in files:
             ext = os.path.splitext(fname)[1].upper()
@@ -40,17 +45,41 @@ def scan_photos(conn):
             cur.execute(
                 """INSERT INTO photos (filepath, filename, extension, filesize, file_modified)
                    VALUES (%s, %s, %s, %s, to_timestamp(%s))
-                   ON CONFLICT (filepath) DO NOTHING""",
+                   ON CONFLICT (filepath) DO UPDATE
+                   SET filesize = EXCLUDED.filesize, file_modified = EXCLUDED.file_modified
+                   WHERE photos.filesize IS DISTINCT FROM EXCLUDED.filesize
+                      OR photos.file_modified IS DISTINCT FROM EXCLUDED.file_modified
+                   RETURNING (xmax = 0)""",
                 (relpath, fname, ext, stat.st_size, stat.st_mtime),
             )
-            if cur.rowcount > 0:
-                count += 1
-
+            row = cur.fetchone()
+            if row is not None:
+                if row[0]:
+                    count += 1
+                else:
+                    changed += 1
+
+    if count or changed:
+        events.notify(cur, "photos")
     conn.commit()
     cur.close()
+    if changed:
+        print(f"  {changed} photos changed on disk")
+    if count or changed:
+        touch_rescan_stamp()
     return count
 
 
+def touch_rescan_stamp():
+    """Tell the dashboard its photo path cache is out of date."""
+    try:
+        with open(config.RESCAN_STAMP, "a"):
+            pass
+        os.utime(config.RESCAN_STAMP)
+    except OSError as e:
+        print(f"  Cannot touch {config.RESCAN_STAMP}: {e}", file=sys.stderr)
+
+
 def extract_exif_batch(conn, batch_size=100):
     """Extract EXIF from photos not yet processed."""
     cur = conn.cursor()
@@ -131,6 +160,9 @@ def extract_exif_batch(conn, batch_size=100):
             )
         processed += 1
 
+    if processed:
+        # New dates, cameras and GPS for the dashboard's search filters
+        events.notify(cur, "photos")
     conn.commit()
     cur.close()
     return processed
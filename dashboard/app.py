@@ -1,10 +1,25 @@
 import os
-from flask import Flask, jsonify, render_template, redirect, request, send_file, abort
-from collectors import system, docker_status, icloud_sync, postgres_status, analysis_status
-from services import photo_service, thumbnail_service, face_service, tag_service, album_service, clip_search_service
+from urllib.parse import quote
+from flask import Flask, Response, jsonify, render_template, redirect, request, send_file, abort
+from collectors import system, docker_status, icloud_sync, postgres_status, analysis_status, thumbnail_cache
+from services import (photo_service, photo_resolver, render_coordinator, thumbnail_service, thumbnail_manifest,
+                      face_service, tag_service, album_service, clip_search_service, events, filter_facets)
 import config
 
 app = Flask(__name__)
+app.config["USE_X_SENDFILE"] = config.MEDIA_OFFLOAD == "x-sendfile"
+# Cache invalidation from the other workers and the analysis scripts (one listener per worker)
+events.start()
+
+
+@app.errorhandler(render_coordinator.RenderBusy)
+def render_busy(e):
+    # Tiles that could not be rendered in time: the browser retries (see common.js)
+    response = jsonify({"error": "render queue full"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
 
 # --- Page routes ---
@@ -59,6 +74,11 @@ def api_analysis():
     return jsonify(analysis_status.collect())
 
 
+@app.route("/api/thumbnails")
+def api_thumbnails():
+    return jsonify(thumbnail_cache.collect())
+
+
 @app.route("/api/all")
 def api_all():
     return jsonify({
@@ -67,34 +87,41 @@ def api_all():
         "photos": icloud_sync.collect(),
         "postgres": postgres_status.collect(),
         "analysis": analysis_status.collect(),
+        "thumbnails": thumbnail_cache.collect(),
     })
 
 
 # --- Explorer API ---
 @app.route("/api/explorer/photos")
 def api_explorer_photos():
-    photos, total = photo_service.search_photos(
-        tag=request.args.get("tag"),
-        source=request.args.get("source"),
-        date_from=request.args.get("date_from"),
-        date_to=request.args.get("date_to"),
-        camera=request.args.get("camera"),
-        face_id=request.args.get("face_id", type=int),
-        q=request.args.get("q"),
-        has_gps=request.args.get("has_gps", "0") == "1",
-        sort=request.args.get("sort", "date_taken"),
-        order=request.args.get("order", "desc"),
-        page=request.args.get("page", 1, type=int),
-        per_page=request.args.get("per_page", 50, type=int),
-    )
+    try:
+        photos, total, next_cursor, approximate = photo_service.search_photos(
+            tag=request.args.get("tag"),
+            source=request.args.get("source"),
+            date_from=request.args.get("date_from"),
+            date_to=request.args.get("date_to"),
+            camera=request.args.get("camera"),
+            face_id=request.args.get("face_id", type=int),
+            q=request.args.get("q"),
+            has_gps=request.args.get("has_gps", "0") == "1",
+            sort=request.args.get("sort", "date_taken"),
+            order=request.args.get("order", "desc"),
+            page=request.args.get("page", 1, type=int),
+            per_page=request.args.get("per_page", 50, type=int),
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     per_page = min(request.args.get("per_page", 50, type=int), 200)
     page = request.args.get("page", 1, type=int)
     return jsonify({
         "photos": photos,
         "total": total,
+        "approximate": approximate,
         "page": page,
         "per_page": per_page,
         "pages": (total + per_page - 1) // per_page if per_page > 0 else 0,
+        "next_cursor": next_cursor,
     })
 
 
@@ -106,31 +133,92 @@ def api_explorer_photo_detail(photo_id):
     return jsonify(photo)
 
 
+def _send_media(path, mimetype, etag=True, root=None, accel_prefix=None):
+    """send_file with validators, conditional requests and Range support.
+
+    With MEDIA_OFFLOAD = "x-accel" the body is left to nginx through X-Accel-Redirect
+    (accel_prefix is the internal location mapped to root); with "x-sendfile" Flask's
+    USE_X_SENDFILE does the same for Apache/lighttpd.
+    """
+    if config.MEDIA_OFFLOAD == "x-accel" and accel_prefix:
+        st = os.stat(path)
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = accel_prefix + "/" + quote(os.path.relpath(path, root))
+        response.set_etag(etag if isinstance(etag, str) else f"{int(st.st_mtime)}-{st.st_size}")
+        response.last_modified = st.st_mtime
+        return response.make_conditional(request)
+    return send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+
+
+def _send_thumbnail(thumb, mimetype, etag):
+    """Response for a cached thumbnail: a file path, or a memoryview from the pack store."""
+    if isinstance(thumb, str):
+        return _send_media(thumb, mimetype, etag=etag,
+                           root=config.THUMBNAIL_DIR, accel_prefix=config.MEDIA_ACCEL_THUMBNAILS)
+    # WSGI servers only take bytes (gunicorn rejects a memoryview once the headers are sent):
+    # one copy of a thumbnail-sized slice out of the mmap
+    response = Response([bytes(thumb)], mimetype=mimetype, direct_passthrough=True)
+    response.content_length = len(thumb)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 @app.route("/api/explorer/photo/<int:photo_id>/thumb")
 def api_explorer_photo_thumb(photo_id):
     size = request.args.get("size", 300, type=int)
     if size not in (300, 1200):
         size = 300
+    fmt = thumbnail_service.negotiate_format(request.headers.get("Accept"))
 
     # Check cache first
-    cached = thumbnail_service.get_thumbnail_path(photo_id, size)
-    if cached:
-        return send_file(cached, mimetype="image/jpeg")
-
-    # Need filepath from DB
-    photo = photo_service.get_photo_detail(photo_id)
-    if not photo:
-        abort(404)
-
-    path = thumbnail_service.generate_thumbnail(photo["filepath"], photo_id, size)
-    if not path:
-        abort(404)
-    return send_file(path, mimetype="image/jpeg")
+    version = request.args.get("v")
+    thumb = thumbnail_service.get_cached(photo_id, size, fmt)
+    rendered = thumbnail_manifest.thumb_version(photo_id, size, fmt) if thumb is not None else None
+    if version and rendered not in (None, version):
+        # Rendered from another version of the original than the URL names: stale if the original changed
+        photo = photo_resolver.resolve(photo_id)
+        if photo and rendered != photo["version"]:
+            thumb = None
+    thumbnail_manifest.note_thumb_access(photo_id, size, fmt, hit=thumb is not None)
+    if thumb is None:
+        # Need filepath from DB
+        photo = photo_resolver.resolve(photo_id)
+        if not photo:
+            abort(404)
+
+        thumb = render_coordinator.run(
+            f"thumb-{photo_id}-{size}-{fmt}",
+            lambda: thumbnail_service.get_cached(photo_id, size, fmt, photo["version"]),
+            lambda: thumbnail_service.generate_thumbnail(photo["filepath"], photo_id, size, fmt, photo["version"]),
+        )
+        if thumb is None:
+            abort(404)
+        rendered = thumbnail_manifest.thumb_version(photo_id, size, fmt)
+
+    # Versioned URLs (?v=, from search results) never change content: cached for good, but only
+    # when the thumbnail is known to come from that version of the original
+    etag = f"{photo_id}-{size}-{fmt}-{rendered or _thumb_stamp(thumb)}"
+    response = _send_thumbnail(thumb, thumbnail_service.mimetype(fmt), etag)
+    if version and rendered == version:
+        response.headers["Cache-Control"] = f"public, max-age={config.MEDIA_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = "public, max-age=3600"
+    # The body depends on Accept: caches must keep one copy per format
+    response.vary.add("Accept")
+    return response
+
+
+def _thumb_stamp(thumb):
+    """Validator part for unversioned thumbnail URLs: changes when the thumbnail is re-rendered."""
+    if isinstance(thumb, str):
+        st = os.stat(thumb)
+        return f"{int(st.st_mtime):x}{st.st_size:x}"
+    return f"p{len(thumb):x}"
 
 
 @app.route("/api/explorer/photo/<int:photo_id>/full")
 def api_explorer_photo_full(photo_id):
-    photo = photo_service.get_photo_detail(photo_id)
+    photo = photo_resolver.resolve(photo_id)
     if not photo:
         abort(404)
 
@@ -138,13 +226,19 @@ def api_explorer_photo_full(photo_id):
     if not os.path.exists(fullpath):
         abort(404)
 
-    ext = photo.get("extension", "").lower()
+    ext = (photo["extension"] or "").lower()
     mimetypes = {
         ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
         ".png": "image/png", ".heic": "image/heic",
         ".gif": "image/gif",
     }
-    return send_file(fullpath, mimetype=mimetypes.get(ext, "application/octet-stream"))
+    response = _send_media(
+        fullpath, mimetypes.get(ext, "application/octet-stream"),
+        etag=f"{photo_id}-{photo['version']}",
+        root=config.PHOTOS_ROOT, accel_prefix=config.MEDIA_ACCEL_PHOTOS,
+    )
+    response.headers["Cache-Control"] = "private, max-age=86400"
+    return response
 
 
 @app.route("/api/explorer/photos/geo")
@@ -158,7 +252,44 @@ def api_explorer_photos_geo():
 
 @app.route("/api/explorer/filters")
 def api_explorer_filters():
-    return jsonify(photo_service.get_filters())
+    filters, version = filter_facets.get_filters()
+    response = jsonify(filters)
+    response.set_etag(version)
+    response.headers["Cache-Control"] = "no-cache"  # revalidated on each page load, 304 until it changes
+    return response.make_conditional(request)
+
+
+def _clip_filters():
+    """photo_service.search_photos filters from the query string (filename stands for its q)."""
+    return {
+        "tag": request.args.get("tag"),
+        "source": request.args.get("source"),
+        "date_from": request.args.get("date_from"),
+        "date_to": request.args.get("date_to"),
+        "camera": request.args.get("camera"),
+        "face_id": request.args.get("face_id", type=int),
+        "filename": request.args.get("filename"),
+        "has_gps": request.args.get("has_gps", "0") == "1",
+    }
+
+
+def _clip_page(results, total, page, per_page):
+    """JSON body for a page of [{"photo_id", "score"}] results, enriched with photo data."""
+    photo_map = photo_service.get_photo_cards([r["photo_id"] for r in results])
+    enriched = []
+    for r in results:
+        photo = photo_map.get(r["photo_id"])
+        if photo:
+            photo["clip_score"] = r["score"]
+            enriched.append(photo)
+    body = {"photos": enriched, "total": total, "page": page, "per_page": per_page}
+    if total is not None:
+        body["pages"] = (total + per_page - 1) // per_page
+        body["has_more"] = page * per_page < total
+    else:
+        # Approximate index: the total is unknown, a full page means there may be more
+        body["has_more"] = len(results) == per_page
+    return body
 
 
 @app.route("/api/explorer/search/clip")
@@ -166,41 +297,56 @@ def api_clip_search():
     q = request.args.get("q", "").strip()
     if not q:
         return jsonify({"error": "q parameter required"}), 400
-    limit = request.args.get("limit", 50, type=int)
-    limit = min(limit, 200)
-    results = clip_search_service.search_by_text(q, limit=limit)
-    # Enrich with photo data
-    if results:
-        photo_ids = [r["photo_id"] for r in results]
-        from services.db import db_cursor
-        with db_cursor() as cur:
-            cur.execute("""
-                SELECT id, filename, filepath, date_taken, camera_model,
-                       width, height, latitude, longitude
-                FROM photos WHERE id = ANY(%s)
-            """, (photo_ids,))
-            photo_map = {}
-            for row in cur.fetchall():
-                p = {
-                    "id": row[0], "filename": row[1], "filepath": row[2],
-                    "date_taken": str(row[3]) if row[3] else None,
-                    "camera_model": row[4],
-                    "width": row[5], "height": row[6],
-                    "latitude": float(row[7]) if row[7] else None,
-                    "longitude": float(row[8]) if row[8] else None,
-                    "thumb_url": f"/api/explorer/photo/{row[0]}/thumb",
-                }
-                photo_map[row[0]] = p
-
-        enriched = []
-        for r in results:
-            photo = photo_map.get(r["photo_id"])
-            if photo:
-                photo["clip_score"] = r["score"]
-                enriched.append(photo)
-        return jsonify({"photos": enriched, "total": len(enriched), "query": q})
-
-    return jsonify({"photos": [], "total": 0, "query": q})
+    per_page = min(request.args.get("per_page", request.args.get("limit", 50, type=int), type=int), 200)
+    page = max(request.args.get("page", 1, type=int), 1)
+    try:
+        results, total = clip_search_service.search_by_text(
+            q, limit=per_page, filters=_clip_filters(), offset=(page - 1) * per_page,
+            negatives=request.args.get("not", "").split(","))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    body = _clip_page(results, total, page, per_page)
+    body["query"] = q
+    return jsonify(body)
+
+
+def _similar(photo_ids):
+    per_page = min(request.args.get("per_page", 50, type=int), 200)
+    page = max(request.args.get("page", 1, type=int), 1)
+    min_score = request.args.get("min_score", clip_search_service.SIMILAR_MIN_SCORE, type=float)
+    try:
+        results, total = clip_search_service.search_similar(
+            photo_ids, limit=per_page, min_score=min_score,
+            filters=_clip_filters(), offset=(page - 1) * per_page)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if results is None:
+        return jsonify({"error": "no CLIP embedding for these photos"}), 404
+    body = _clip_page(results, total, page, per_page)
+    body["photo_ids"] = photo_ids
+    return jsonify(body)
+
+
+@app.route("/api/explorer/photo/<int:photo_id>/similar")
+def api_photo_similar(photo_id):
+    return _similar([photo_id])
+
+
+@app.route("/api/explorer/photos/similar")
+def api_photos_similar():
+    """Batch variant: ?ids=1,2,3 searched as one combined query."""
+    try:
+        photo_ids = [int(i) for i in request.args.get("ids", "").split(",") if i.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be comma-separated photo ids"}), 400
+    if not photo_ids or len(photo_ids) > 100:
+        return jsonify({"error": "ids parameter required (1 to 100 photo ids)"}), 400
+    return _similar(photo_ids)
+
+
+@app.route("/api/explorer/search/clip/stats")
+def api_clip_search_stats():
+    return jsonify(clip_search_service.get_search_stats())
 
 
 # --- Tags API ---
@@ -265,11 +411,15 @@ def api_faces():
 
 @app.route("/api/faces/<int:face_id>/photos")
 def api_face_photos(face_id):
-    return jsonify(face_service.get_face_photos(
-        face_id,
-        page=request.args.get("page", 1, type=int),
-        per_page=request.args.get("per_page", 50, type=int),
-    ))
+    try:
+        return jsonify(face_service.get_face_photos(
+            face_id,
+            page=request.args.get("page", 1, type=int),
+            per_page=request.args.get("per_page", 50, type=int),
+            cursor=request.args.get("cursor"),
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 
 @app.route("/api/faces/<int:face_id>/crop")
@@ -279,16 +429,24 @@ def api_face_crop(face_id):
         abort(404)
 
     # Check cache
-    cached = thumbnail_service.get_face_crop_path(face_id)
-    if cached:
-        return send_file(cached, mimetype="image/jpeg")
-
-    path = thumbnail_service.generate_face_crop(
-        info["filepath"], face_id, info["photo_id"], info["bbox"]
-    )
+    path = thumbnail_service.get_face_crop_path(face_id, info["photo_id"])
+    thumbnail_manifest.note_face_access(face_id, info["photo_id"], hit=path is not None)
     if not path:
-        abort(404)
-    return send_file(path, mimetype="image/jpeg")
+        path = render_coordinator.run(
+            f"face-{face_id}-{info['photo_id']}",
+            lambda: thumbnail_service.get_face_crop_path(face_id, info["photo_id"]),
+            lambda: thumbnail_service.generate_face_crop(
+                info["filepath"], face_id, info["photo_id"], info["bbox"]
+            ),
+        )
+        if not path:
+            abort(404)
+
+    # The URL is stable across merges and representative changes: revalidate daily
+    response = _send_media(path, "image/jpeg", root=config.THUMBNAIL_DIR,
+                           accel_prefix=config.MEDIA_ACCEL_THUMBNAILS)
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return response
 
 
 @app.route("/api/faces/<int:face_id>/label", methods=["PUT"])
@@ -414,11 +572,15 @@ def api_delete_album(album_id):
 
 @app.route("/api/albums/<int:album_id>/photos")
 def api_album_photos(album_id):
-    return jsonify(album_service.get_album_photos(
-        album_id,
-        page=request.args.get("page", 1, type=int),
-        per_page=request.args.get("per_page", 50, type=int),
-    ))
+    try:
+        return jsonify(album_service.get_album_photos(
+            album_id,
+            page=request.args.get("page", 1, type=int),
+            per_page=request.args.get("per_page", 50, type=int),
+            cursor=request.args.get("cursor"),
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 
 @app.route("/api/albums/<int:album_id>/photos", methods=["POST"])
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Benchmark CLIP search scoring: per-photo dict + np.stack + argsort vs memory-mapped matrix + argpartition,
+and the optional ANN index (recall@limit against the exact top results).
+
+Uses synthetic normalised embeddings (no database, no model), written to a
+temporary index directory. They are drawn around cluster centres, like real
+photo embeddings, so the IVF buckets mean something. Each mode runs in its own
+process so RSS is measured in isolation. "anon" is RSS minus file-backed pages:
+the memory each worker pays for itself, while a mapped index sits in the page
+cache shared by all workers.
+
+    python bench_clip_search.py --sizes 50000,500000 --queries 20
+    python bench_clip_search.py --sizes 500000 --skip-legacy --ann ivf --nprobe 16,32,64
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+import psutil
+import config
+from services import clip_ann, clip_search_service
+
+DIM = 512
+CLUSTER_SIZE = 5000  # synthetic photos per cluster centre
+NOISE = 0.08  # per-dimension spread around the centre
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _centres(n):
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((max(1, n // CLUSTER_SIZE), DIM), dtype=np.float32)
+    return centres / np.linalg.norm(centres, axis=1, keepdims=True)
+
+
+def _around(rng, centres, count):
+    """count normalised vectors, each near a random centre."""
+    block = centres[rng.integers(0, len(centres), count)]
+    block = block + rng.standard_normal((count, DIM), dtype=np.float32) * NOISE
+    return block / np.linalg.norm(block, axis=1, keepdims=True)
+
+
+def _write_index(directory, n, dtype):
+    """Write a synthetic index generation straight into CLIP_INDEX_DIR layout."""
+    rng = np.random.default_rng(0)
+    centres = _centres(n)
+    ids = np.arange(1, n + 1, dtype=np.int64)
+    matrix = np.lib.format.open_memmap(os.path.join(directory, "embeddings-bench.npy"),
+                                       mode="w+", dtype=dtype, shape=(n, DIM))
+    for start in range(0, n, 50000):
+        matrix[start:start + min(50000, n - start)] = _around(rng, centres, min(50000, n - start))
+    matrix.flush()
+    del matrix
+    np.save(os.path.join(directory, "ids-bench.npy"), ids)
+    config.CLIP_INDEX_DIR = directory
+    columns = {"dates": np.full(n, "2024-01-01", dtype="datetime64[s]"),
+               "gps": np.ones(n, dtype=bool), "cameras": np.zeros(n, dtype=np.int32)}
+    clip_search_service._write_meta({
+        "format": clip_search_service.INDEX_FORMAT, "generation": "bench",
+        "embeddings": "embeddings-bench.npy", "ids": "ids-bench.npy",
+        "columns": clip_search_service._save_columns("", "bench", columns), "cameras": ["bench"],
+        "count": n, "dim": DIM, "dtype": np.dtype(dtype).name,
+        "built_at": time.time(), "build_seconds": 0,
+    })
+
+
+def _queries(n, count):
+    return _around(np.random.default_rng(1), _centres(n), count)
+
+
+def _run_legacy(directory, queries, limit):
+    """Previous implementation: dict of per-photo arrays, matrix rebuilt on every query."""
+    ids = np.load(os.path.join(directory, "ids-bench.npy"))
+    matrix = np.load(os.path.join(directory, "embeddings-bench.npy")).astype(np.float32)
+    embeddings = {int(pid): matrix[i].copy() for i, pid in enumerate(ids)}
+    del matrix, ids
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        photo_ids = list(embeddings.keys())
+        emb_matrix = np.stack([embeddings[pid] for pid in photo_ids])
+        scores = emb_matrix @ q
+        top = np.argsort(scores)[::-1][:limit]
+        [photo_ids[i] for i in top]
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def _run_mmap(directory, queries, limit):
+    config.CLIP_INDEX_DIR = directory
+    index = clip_search_service._load_index()
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        scores = clip_search_service.score_all(index["matrix"], q)
+        top = clip_search_service.top_k(scores, limit)
+        [int(index["ids"][i]) for i in top]
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def _build_ann(directory, backend):
+    """Build the ANN index of the synthetic generation and record it in meta.json."""
+    config.CLIP_INDEX_DIR = directory
+    meta = clip_search_service._read_meta()
+    meta["ann"] = clip_ann.build(backend, clip_search_service._map(meta["embeddings"]), meta["generation"])
+    clip_search_service._write_meta(meta)
+    return meta["ann"]["build_seconds"]
+
+
+def _run_ann(directory, queries, limit):
+    config.CLIP_INDEX_DIR = directory
+    index = clip_search_service._load_index()
+    latencies, found = [], 0
+    for q in queries:
+        t0 = time.perf_counter()
+        positions, _scores = index["ann"].search(q, limit)
+        [int(index["ids"][p]) for p in positions]
+        latencies.append((time.perf_counter() - t0) * 1000)
+        exact = clip_search_service.top_k(clip_search_service.score_all(index["matrix"], q), limit)
+        found += len(np.intersect1d(exact, positions))
+    return latencies, found / (limit * len(queries))
+
+
+def _child(mode, directory, n, n_queries, limit, backend=None, nprobe=None):
+    queries = _queries(n, n_queries)
+    recall = 1.0
+    if mode == "legacy":
+        latencies = _run_legacy(directory, queries, limit)
+    elif mode == "mmap":
+        latencies = _run_mmap(directory, queries, limit)
+    else:
+        config.CLIP_ANN_BACKEND, config.CLIP_ANN_NPROBE = backend, nprobe
+        latencies, recall = _run_ann(directory, queries, limit)
+    mem = psutil.Process().memory_info()
+    return latencies, recall, mem.rss, mem.rss - mem.shared
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="50000,500000", help="comma-separated photo counts")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--dtype", default="float32", choices=("float32", "float16"))
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="only run the mapped index (the legacy dict needs ~3x the matrix in RAM)")
+    parser.add_argument("--ann", choices=clip_ann.available_backends(),
+                        help="also benchmark this ANN backend")
+    parser.add_argument("--nprobe", default=str(config.CLIP_ANN_NPROBE),
+                        help="comma-separated CLIP_ANN_NPROBE values to try with --ann")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    mb = 1024 * 1024
+    print(f"=== CLIP search scoring ({args.queries} queries, top {args.limit}, {args.dtype}) ===")
+    print(f"  {'photos':>8} {'mode':12} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7} {'RSS MB':>8} {'anon MB':>8}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory(prefix="clip-bench-") as tmp:
+            _write_index(tmp, n, args.dtype)
+            runs = [("mmap", None)] if args.skip_legacy else [("legacy", None), ("mmap", None)]
+            if args.ann:
+                with ctx.Pool(1) as pool:
+                    seconds = pool.apply(_build_ann, (tmp, args.ann))
+                print(f"  {n:8d} {args.ann} index built in {seconds}s")
+                runs += [("ann", int(p)) for p in args.nprobe.split(",")]
+            for mode, nprobe in runs:
+                with ctx.Pool(1) as pool:
+                    latencies, recall, rss, anon = pool.apply(
+                        _child, (mode, tmp, n, args.queries, args.limit, args.ann, nprobe))
+                label = f"{args.ann}/{nprobe}" if nprobe else mode
+                print(
+                    f"  {n:8d} {label:12} {statistics.median(latencies):8.1f} "
+                    f"{_percentile(latencies, 95):8.1f} {recall:7.3f} {rss / mb:8.0f} {anon / mb:8.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Benchmark explorer page latency: LIMIT/OFFSET vs keyset cursor, from page 1 to deep pages.
+
+Runs against the configured PostgreSQL database, on the whole library (no
+filter), for every sort of photo_service.search_photos. Only the page query is
+timed: the COUNT and the tag/face lookups of search_photos cost the same either
+way. The cursor of page N is taken from the last row of page N-1 beforehand.
+Run it after sql/004_pagination_indexes.sql, and once before to compare.
+
+    python bench_explorer_pagination.py --pages 1,10,100,1000 --per-page 60 --repeat 5
+"""
+
+import argparse
+import statistics
+import time
+from services import db, pagination
+
+SORTS = ("date_taken", "filename", "filesize", "id")
+SELECT = "SELECT p.id, p.filename, p.filepath, p.date_taken, p.filesize FROM photos p"
+
+
+def offset_page(cur, sort, order, page, per_page):
+    nulls = "NULLS LAST" if order == "desc" else "NULLS FIRST"
+    cur.execute(f"""
+        {SELECT}
+        WHERE TRUE
+        ORDER BY p.{sort} {order} {nulls}, p.id {order}
+        LIMIT %s OFFSET %s
+    """, (per_page, (page - 1) * per_page))
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def cursor_page(cur, sort, order, after, per_page):
+    return pagination.fetch_page(cur, SELECT, "TRUE", [], f"p.{sort}", "p.id", order, after, per_page)[0]
+
+
+def _timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default="1,10,100,1000", help="comma-separated page numbers")
+    parser.add_argument("--per-page", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measure (median shown)")
+    parser.add_argument("--sorts", default=",".join(SORTS))
+    parser.add_argument("--order", default="desc", choices=("asc", "desc"))
+    args = parser.parse_args()
+
+    conn = db.get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM photos")
+            total = cur.fetchone()[0]
+            print(f"=== Explorer pages ({total} photos, {args.per_page} per page, {args.order}, "
+                  f"median of {args.repeat}) ===")
+            print(f"  {'sort':10} {'page':>6} {'offset ms':>10} {'cursor ms':>10} {'same rows':>10}")
+            for sort in args.sorts.split(","):
+                for page in (int(p) for p in args.pages.split(",")):
+                    if (page - 1) * args.per_page >= total:
+                        print(f"  {sort:10} {page:6d} {'beyond the last page':>32}")
+                        continue
+                    after = None
+                    if page > 1:
+                        last = offset_page(cur, sort, args.order, page - 1, args.per_page)[-1]
+                        after = (last[sort], last["id"])
+                    offset_ms, by_offset = _timed(
+                        lambda: offset_page(cur, sort, args.order, page, args.per_page), args.repeat)
+                    cursor_ms, by_cursor = _timed(
+                        lambda: cursor_page(cur, sort, args.order, after, args.per_page), args.repeat)
+                    same = [r["id"] for r in by_offset] == [r["id"] for r in by_cursor]
+                    print(f"  {sort:10} {page:6d} {offset_ms:10.1f} {cursor_ms:10.1f} {'yes' if same else 'NO':>10}")
+        conn.rollback()
+    finally:
+        db.put_conn(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Benchmark on-demand thumbnail latency: fast path (embedded preview / reduced decode) vs full decode.
+
+Renders a random sample of photos per format into a temporary cache directory,
+so the real thumbnail cache and its manifest are left untouched.
+
+    python bench_thumbnails.py --samples 30 --size 300
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+import psycopg2
+import config
+from services import thumbnail_service
+
+
+def get_db():
+    return psycopg2.connect(
+        host=config.PG_HOST, port=config.PG_PORT,
+        dbname=config.PG_DATABASE, user=config.PG_USER,
+        password=config.PG_PASSWORD,
+    )
+
+
+def sample_photos(extensions, samples):
+    conn = get_db()
+    cur = conn.cursor()
+    sample = {}
+    for ext in extensions:
+        cur.execute("""
+            SELECT id, filepath FROM photos
+            WHERE extension = %s ORDER BY random() LIMIT %s
+        """, (ext, samples))
+        sample[ext] = cur.fetchall()
+    cur.close()
+    conn.close()
+    return sample
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def bench(photos, size, fast):
+    """Return (latencies in ms, {decode path: count}) for rendering each photo once."""
+    latencies = []
+    decodes = {}
+    for photo_id, filepath in photos:
+        t0 = time.perf_counter()
+        result = thumbnail_service.render_photo(filepath, photo_id, thumbs=[(size, "jpeg")], fast=fast)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if (size, "jpeg") not in result["thumbs"]:
+            continue
+        latencies.append(elapsed)
+        decodes[result["decode"]] = decodes.get(result["decode"], 0) + 1
+    return latencies, decodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=30, help="photos per format (default 30)")
+    parser.add_argument("--size", type=int, default=300, choices=(300, 1200))
+    parser.add_argument("--formats", default=".HEIC,.JPG,.JPEG,.PNG",
+                        help="comma-separated extensions as stored in photos.extension")
+    args = parser.parse_args()
+
+    sample = sample_photos(args.formats.split(","), args.samples)
+
+    print(f"=== On-demand thumbnail latency ({args.size}px, {args.samples} photos/format) ===")
+    print(f"  {'format':6} {'mode':5} {'n':>4} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}  decode paths")
+    for ext, photos in sample.items():
+        if not photos:
+            continue
+        for fast in (False, True):
+            # Fresh cache directory per run so nothing is served from a previous render
+            with tempfile.TemporaryDirectory(prefix="thumb-bench-") as tmp:
+                config.THUMBNAIL_DIR = tmp
+                latencies, decodes = bench(photos, args.size, fast)
+            if not latencies:
+                print(f"  {ext:6} {'fast' if fast else 'full':5} no photo rendered")
+                continue
+            print(
+                f"  {ext:6} {'fast' if fast else 'full':5} {len(latencies):4d} "
+                f"{statistics.median(latencies):8.1f} {_percentile(latencies, 95):8.1f} "
+                f"{statistics.mean(latencies):8.1f}  "
+                + " ".join(f"{k}={v}" for k, v in sorted(decodes.items()))
+            )
+
+
+if __name__ == "__main__":
+    main()
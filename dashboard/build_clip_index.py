@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Rebuild the memory-mapped CLIP search index from photos.clip_embedding.
+
+    python build_clip_index.py [--dtype float16]
+    python build_clip_index.py --refresh      only fetch rows changed since the last run
+    python build_clip_index.py --retrain      recompute the ANN centroids (CLIP_ANN_BACKEND=ivf)
+    python build_clip_index.py --warm-text    encode the tag vocabulary into the shared text cache
+
+The dashboard workers pick up the new generation within a few seconds. With
+EMBEDDING_STORAGE=pgvector only --warm-text does anything: the index is not used.
+"""
+
+import argparse
+import time
+import config
+from services import clip_search_service
+from services.db import db_cursor
+
+
+def tag_vocabulary():
+    """Likely queries: every tag in photo_tags and their French translations."""
+    with db_cursor() as cur:
+        cur.execute("SELECT DISTINCT tag FROM photo_tags")
+        tags = {row[0] for row in cur.fetchall()}
+    return sorted(tags | {config.TAG_EN_TO_FR[t] for t in tags if t in config.TAG_EN_TO_FR}
+                  | set(config.TAG_EN_TO_FR.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dtype", default=config.CLIP_INDEX_DTYPE, choices=("float32", "float16"),
+                        help="storage type of the matrix (default %(default)s)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="incremental: fold rows updated since the watermark into the delta")
+    parser.add_argument("--retrain", action="store_true",
+                        help="train new IVF centroids instead of reusing the previous ones")
+    parser.add_argument("--warm-text", action="store_true",
+                        help="only pre-encode the tag vocabulary into the text query cache")
+    args = parser.parse_args()
+
+    print(f"=== CLIP index ({config.CLIP_INDEX_DIR}) ===")
+    if args.warm_text:
+        start = time.time()
+        vocabulary = tag_vocabulary()
+        encoded = clip_search_service.warm_text_cache(vocabulary)
+        print(f"  {len(vocabulary)} prompts, {encoded} encoded in {time.time() - start:.1f}s "
+              f"({config.CLIP_TEXT_STORE})")
+        return
+    if config.EMBEDDING_STORAGE == "pgvector":
+        # Searches are ranked by PostgreSQL (clip_pgvector): nothing maps the local index
+        print("  EMBEDDING_STORAGE=pgvector: index build skipped")
+        return
+    if args.refresh:
+        fetched = clip_search_service.refresh_index()
+        print(f"  {fetched} changed embeddings fetched")
+        return
+    meta = clip_search_service.build_index(args.dtype, retrain=args.retrain)
+    size_mb = meta["count"] * meta["dim"] * (2 if meta["dtype"] == "float16" else 4) / 1024 / 1024
+    print(f"  {meta['count']} embeddings x {meta['dim']} ({meta['dtype']}, {size_mb:.1f} MB) "
+          f"in {meta['build_seconds']}s")
+    ann = meta.get("ann")
+    if ann:
+        print(f"  ANN {ann['backend']}: {ann.get('nlist', '-')} lists, nprobe {config.CLIP_ANN_NPROBE}, "
+              f"recall@{ann['recall_k']} {ann['recall']} ({ann['build_seconds']}s)")
+    elif config.CLIP_ANN_BACKEND:
+        print(f"  ANN {config.CLIP_ANN_BACKEND}: skipped below {config.CLIP_ANN_MIN_ROWS} embeddings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Shared CLIP inference service on a unix socket (config.CLIP_SIDECAR_SOCKET).
+
+Loads the model once for the dashboard workers and the analysis scripts
+(services/clip_client.py, analysis/scripts/clip_client.py). Concurrent encode
+requests of the same kind that arrive within CLIP_SIDECAR_WINDOW seconds share
+one forward pass, up to CLIP_SIDECAR_MAX_BATCH prompts or images.
+
+    python clip_sidecar.py [--socket /run/freerando/clip.sock]
+"""
+
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+import numpy as np
+import config
+
+
+class Batcher:
+    """Collects encode jobs of one kind and runs them together in a single thread."""
+
+    def __init__(self, name, encode):
+        self.name = name
+        self.encode = encode
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.metrics = {"requests": 0, "items": 0, "batches": 0, "max_batch": 0,
+                        "wait_ms": 0.0, "encode_ms": 0.0}
+        threading.Thread(target=self._run, name=f"batch-{name}", daemon=True).start()
+
+    def submit(self, items):
+        """Encode items (blocking); returns their float32 rows."""
+        job = {"items": items, "queued": time.monotonic(), "done": threading.Event(),
+               "result": None, "error": None}
+        self.jobs.put(job)
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def _collect(self):
+        batch = [self.jobs.get()]
+        count = len(batch[0]["items"])
+        deadline = time.monotonic() + config.CLIP_SIDECAR_WINDOW
+        while count < config.CLIP_SIDECAR_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(job)
+            count += len(job["items"])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for job in batch for item in job["items"]]
+            start = time.monotonic()
+            try:
+                vectors = self.encode(items)
+                error = None
+            except Exception as e:
+                vectors, error = None, e
+            done = time.monotonic()
+
+            offset = 0
+            for job in batch:
+                if error is None:
+                    job["result"] = vectors[offset:offset + len(job["items"])]
+                job["error"] = error
+                offset += len(job["items"])
+                job["done"].set()
+
+            with self.lock:
+                m = self.metrics
+                m["requests"] += len(batch)
+                m["items"] += len(items)
+                m["batches"] += 1
+                m["max_batch"] = max(m["max_batch"], len(items))
+                m["wait_ms"] += sum((start - job["queued"]) * 1000 for job in batch)
+                m["encode_ms"] += (done - start) * 1000
+
+    def stats(self):
+        with self.lock:
+            m = dict(self.metrics)
+        return {
+            "queue_depth": self.jobs.qsize(),
+            "requests": m["requests"],
+            "items": m["items"],
+            "batches": m["batches"],
+            "max_batch": m["max_batch"],
+            "mean_batch": round(m["items"] / m["batches"], 2) if m["batches"] else None,
+            "mean_wait_ms": round(m["wait_ms"] / m["requests"], 1) if m["requests"] else None,
+            "mean_encode_ms": round(m["encode_ms"] / m["batches"], 1) if m["batches"] else None,
+        }
+
+
+class Model:
+    """Full CLIP model (text and image towers); forward passes are serialised."""
+
+    def __init__(self):
+        import open_clip
+        import torch
+
+        self.torch = torch
+        start = time.time()
+        self.model, _, self.preprocess = open_clip.create_model_and_transforms(
+            config.CLIP_MODEL, pretrained=config.CLIP_PRETRAINED)
+        self.model.eval()
+        self.tokenizer = open_clip.tokenize
+        self.lock = threading.Lock()
+        print(f"[CLIP sidecar] {config.CLIP_MODEL}/{config.CLIP_PRETRAINED} loaded in {time.time() - start:.1f}s")
+
+    def _normalized(self, features):
+        features /= features.norm(dim=-1, keepdim=True)
+        return features.cpu().numpy().astype(np.float32)
+
+    def encode_texts(self, prompts):
+        with self.lock, self.torch.no_grad():
+            return self._normalized(self.model.encode_text(self.tokenizer(prompts)))
+
+    def encode_images(self, images):
+        batch = self.torch.stack([self.preprocess(img) for img in images])
+        with self.lock, self.torch.no_grad():
+            return self._normalized(self.model.encode_image(batch))
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            header = json.loads(self.rfile.readline())
+            payload = self.rfile.read(header.get("payload", 0))
+            reply, body = self.server.dispatch(header, payload)
+        except Exception as e:
+            reply, body = {"error": str(e)}, b""
+        self.wfile.write(json.dumps(dict(reply, payload=len(body))).encode() + b"\n" + body)
+
+
+class Sidecar(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, model):
+        self.started = time.time()
+        self.batchers = {
+            "text": Batcher("text", model.encode_texts),
+            "image": Batcher("image", model.encode_images),
+        }
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, Handler)
+        os.chmod(path, 0o660)
+
+    def dispatch(self, header, payload):
+        op = header.get("op")
+        if op == "stats":
+            return {"stats": {"uptime_seconds": int(time.time() - self.started),
+                              **{name: b.stats() for name, b in self.batchers.items()}}}, b""
+        if op == "text":
+            vectors = self.batchers["text"].submit(header["prompts"])
+        elif op == "image":
+            from PIL import Image
+
+            images, offset = [], 0
+            for width, height in header["sizes"]:
+                size = width * height * 3
+                images.append(Image.frombytes("RGB", (width, height), payload[offset:offset + size]))
+                offset += size
+            vectors = self.batchers["image"].submit(images)
+        else:
+            raise ValueError(f"unknown op {op!r}")
+        return {"shape": list(vectors.shape)}, vectors.tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=config.CLIP_SIDECAR_SOCKET)
+    args = parser.parse_args()
+
+    server = Sidecar(args.socket, Model())
+    print(f"[CLIP sidecar] Listening on {args.socket} (window {config.CLIP_SIDECAR_WINDOW * 1000:.0f} ms, "
+          f"batch <= {config.CLIP_SIDECAR_MAX_BATCH})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
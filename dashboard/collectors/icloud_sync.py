@@ -1,11 +1,22 @@
 import os
 import time
 import config
+from services import events
 
 _cache = None
 _cache_time = 0
 
 
+def _invalidate(data):
+    global _cache
+    _cache = None
+
+
+# extract_exif.py announces new or changed files once scanned; files landing from iCloud before
+# that send nothing, so the short PHOTOS_CACHE_TTL is kept even while events flow
+events.subscribe("photos", _invalidate)
+
+
 def collect():
     global _cache, _cache_time
 
@@ -0,0 +1,43 @@
+import psutil
+import config
+from services import thumbnail_manifest
+
+
+def collect():
+    """Thumbnail cache footprint per class, budgets, hit ratios and last GC run."""
+    try:
+        # Publish this worker's buffered access counts before reading them back
+        thumbnail_manifest.flush_access()
+        usage = thumbnail_manifest.usage()
+        counters = usage["counters"]
+
+        classes = []
+        for cls, info in sorted(usage["classes"].items(), key=lambda kv: str(kv[0])):
+            name = "faces" if cls == "faces" else str(cls)
+            hits = counters.get(f"hits_{name}", 0)
+            misses = counters.get(f"misses_{name}", 0)
+            budget_mb = config.THUMBNAIL_BUDGET_MB.get(cls)
+            classes.append({
+                "name": name,
+                "count": info["count"],
+                "bytes": info["bytes"],
+                "budget_bytes": budget_mb * 1024 * 1024 if budget_mb is not None else None,
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None,
+            })
+
+        disk = psutil.disk_usage(config.THUMBNAIL_DIR)
+        return {
+            "classes": classes,
+            "total_bytes": sum(c["bytes"] for c in classes),
+            "disk_free": disk.free,
+            "disk_total": disk.total,
+            "store": config.THUMBNAIL_STORE,
+            "gc_last_run": counters.get("gc_last_run"),
+            "gc_last_removed": counters.get("gc_last_removed"),
+            "gc_last_evicted_bytes": counters.get("gc_last_evicted_bytes"),
+            "error": None,
+        }
+    except Exception as e:
+        return {"classes": [], "total_bytes": 0, "error": str(e)}
@@ -7,6 +7,8 @@ DEBUG = False
 
 # Photo path
 PHOTOS_ROOT = "/u01/photos/icloud-shared"
+# Touched by analysis/scripts/extract_exif.py when photos were added or changed
+RESCAN_STAMP = "/u01/photos/.rescan"
 
 # Docker
 DOCKER_CONTAINER_NAME = "icloudpd-shared"
@@ -18,8 +20,65 @@ PG_DATABASE = os.environ.get("PG_DATABASE", "freerando")
 PG_USER = os.environ.get("PG_USER", "freerando")
 PG_PASSWORD = os.environ.get("PG_PASSWORD", "freerando")
 
+# Media delivery (/thumb, /full, face crops)
+# None: gunicorn streams the bytes; "x-accel": nginx via X-Accel-Redirect; "x-sendfile": Apache/lighttpd
+MEDIA_OFFLOAD = os.environ.get("MEDIA_OFFLOAD") or None
+# nginx internal locations aliased to PHOTOS_ROOT and THUMBNAIL_DIR (x-accel only)
+MEDIA_ACCEL_PHOTOS = "/_media/photos"
+MEDIA_ACCEL_THUMBNAILS = "/_media/thumbnails"
+MEDIA_MAX_AGE = 31536000  # versioned thumbnail URLs (?v=) are immutable: one year
+
+# Photo id -> path resolver for the media routes (services/photo_resolver.py)
+PHOTO_RESOLVER_CACHE_SIZE = 20000
+# Optional local SQLite copy of id -> path, warmed from one query (None: LRU + PostgreSQL only)
+PHOTO_RESOLVER_MAP = os.environ.get("PHOTO_RESOLVER_MAP") or None
+
+# CLIP model of the search service and of the inference sidecar (same as analysis/scripts/config.py)
+CLIP_MODEL = "ViT-B-32"
+CLIP_PRETRAINED = "laion2b_s34b_b79k"
+
+# CLIP search index (services/clip_search_service.py): memory-mapped embedding matrix on local disk
+CLIP_INDEX_DIR = "/u01/photos/clip-index"
+CLIP_INDEX_DTYPE = "float32"  # "float16" halves file and page cache, but scores ~7x slower (no BLAS path)
+CLIP_REFRESH_INTERVAL = 600  # background fetch of embeddings changed since the last build/refresh
+CLIP_DELTA_MAX_ROWS = 20000  # past this many changed rows, the refresh rewrites the whole index
+CLIP_REFRESH_OVERLAP = 3600  # seconds re-read before the watermark (analysis batches commit late)
+# Optional ANN index over the base matrix (services/clip_ann.py): "ivf" (numpy), "faiss", "hnswlib"
+CLIP_ANN_BACKEND = os.environ.get("CLIP_ANN_BACKEND") or None
+CLIP_ANN_MIN_ROWS = 100000  # below this, exact scoring is already fast enough
+CLIP_ANN_NLIST = None  # IVF buckets, None = 4 * sqrt(count)
+CLIP_ANN_NPROBE = 32  # buckets scored per query (hnswlib: ef = 8 * nprobe)
+# Encoded text queries (services/clip_text_cache.py): per-worker LRU + SQLite store shared by workers
+CLIP_TEXT_CACHE_SIZE = 2048
+CLIP_TEXT_STORE = os.path.join(CLIP_INDEX_DIR, "text-cache.sqlite")  # None = LRU only
+CLIP_TEXT_STORE_MAX = 100000
+CLIP_PROMPT_TEMPLATES = ("{}",)  # prompt ensembling, e.g. ("{}", "a photo of {}"): vectors averaged
+CLIP_NEGATIVE_WEIGHT = 0.5  # share of the negative prompts' vector subtracted from the query
+CLIP_TEXT_ONLY = True  # load only the CLIP text tower in the dashboard (False: full model)
+# Shared CLIP inference service (clip_sidecar.py); when unreachable, text is encoded in-process
+CLIP_SIDECAR_SOCKET = os.environ.get("CLIP_SIDECAR_SOCKET", "/run/freerando/clip.sock") or None
+CLIP_SIDECAR_TIMEOUT = 10  # seconds per request; well under gunicorn --timeout 30 so the fallback can run
+CLIP_SIDECAR_RETRY = 30  # seconds of in-process encoding after a sidecar failure before trying it again
+CLIP_SIDECAR_WINDOW = 0.01  # seconds a batch waits for more concurrent requests
+CLIP_SIDECAR_MAX_BATCH = 32
+# Where CLIP search ranks embeddings: "bytea" (the memory-mapped index above) or "pgvector"
+# (photos.clip_vector, sql/002_pgvector.sql: top-k computed by PostgreSQL, no local index)
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "bytea")
+CLIP_PGVECTOR_EF_SEARCH = 100  # HNSW candidate list (hnsw.ef_search), raised to offset + limit
+# Filtered HNSW scans keep going until enough rows pass (pgvector >= 0.8); None on older versions
+CLIP_PGVECTOR_ITERATIVE_SCAN = "relaxed_order"
+
 # Cache TTLs (seconds)
 PHOTOS_CACHE_TTL = 300  # 5 minutes
+# Explorer search totals (services/result_count.py): exact counts cached per filter set; above
+# SEARCH_COUNT_EXACT_MAX planner-estimated rows the estimate is served while the count runs behind
+SEARCH_COUNT_CACHE_TTL = 120
+SEARCH_COUNT_EXACT_MAX = 20000
+# Cache invalidation events (services/events.py): LISTEN/NOTIFY channel, None = TTLs only.
+# While a worker listens, its caches keep entries up to EVENT_CACHE_MAX_AGE instead of their TTL
+EVENT_CHANNEL = os.environ.get("EVENT_CHANNEL", "freerando_events") or None
+EVENT_CACHE_MAX_AGE = 3600
+CLIP_REFRESH_DEBOUNCE = 20  # seconds an "embeddings"/"photos" event waits for more before the refresh
 
 # Traduction tags anglais → français (CLIP + YOLO)
 TAG_EN_TO_FR = {
@@ -82,3 +141,21 @@ TAG_EN_TO_FR = {
 
 # Thumbnails
 THUMBNAIL_DIR = "/u01/photos/thumbnails"
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "3"))  # generate_thumbnails.py pool size
+# Formats offered to browsers through Accept, in order of preference (JPEG is the fallback).
+# "avif" is smaller still but slow to encode on the Pi and needs Pillow >= 11.2 or pillow-avif-plugin.
+THUMBNAIL_FORMATS = ["webp"]
+# Where thumbnails are stored: "files" (one file per thumbnail) or "pack" (segment files + mmap index,
+# see services/thumbnail_pack.py; fill it with pack_thumbnails.py import)
+THUMBNAIL_STORE = os.environ.get("THUMBNAIL_STORE", "files")
+THUMBNAIL_PACK_SEGMENT_MB = 256
+# Formats generate_thumbnails.py renders ahead of time
+THUMBNAIL_PREGENERATE_FORMATS = ["jpeg", "webp"]
+# Disk budget per cache class in MB (None: unbounded), enforced LRU-first by gc_thumbnails.py
+THUMBNAIL_BUDGET_MB = {300: None, 1200: 4096, "faces": None}
+# On-demand rendering (services/render_coordinator.py): concurrent renders across all workers,
+# how long a request queues for a slot before answering 503, and the Retry-After it sends
+RENDER_SLOTS = int(os.environ.get("RENDER_SLOTS", "1"))
+RENDER_QUEUE_WAIT = 8
+RENDER_RETRY_AFTER = 2
+RENDER_KEY_STRIPES = 256
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Garbage-collect the thumbnail cache: orphans, stale renders, then per-class disk budgets.
+
+    python gc_thumbnails.py [--dry-run]
+
+1. Thumbnails of photos no longer in `photos`, or rendered before the original's
+   file_modified (file re-downloaded or edited), are removed.
+2. Face crops whose (face, photo) pair no longer exists in photo_faces (merged or
+   removed faces) are removed.
+3. Each class over its config.THUMBNAIL_BUDGET_MB is trimmed, least recently
+   served first (access times recorded by the dashboard in the manifest).
+"""
+
+import argparse
+import time
+import psycopg2
+import config
+from services import thumbnail_manifest, thumbnail_pack
+from services.thumbnail_service import delete_face_crop, delete_thumbnail
+
+MB = 1024 * 1024
+
+
+def get_db():
+    return psycopg2.connect(
+        host=config.PG_HOST, port=config.PG_PORT,
+        dbname=config.PG_DATABASE, user=config.PG_USER,
+        password=config.PG_PASSWORD,
+    )
+
+
+def fetch_reference():
+    """Return ({photo_id: file_modified epoch}, {(face_id, photo_id)}) from PostgreSQL."""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, EXTRACT(EPOCH FROM file_modified) FROM photos")
+    modified = {pid: float(mtime or 0) for pid, mtime in cur.fetchall()}
+    cur.execute("SELECT DISTINCT face_id, photo_id FROM photo_faces")
+    pairs = set(cur.fetchall())
+    cur.close()
+    conn.close()
+    return modified, pairs
+
+
+def collect_orphans(modified, pairs, dry_run):
+    """Remove thumbnails and crops that no longer match a photo. Returns (thumbs, faces) removed."""
+    n_thumbs = n_faces = 0
+    for photo_id, size, fmt, created in thumbnail_manifest.all_thumbs():
+        mtime = modified.get(photo_id)
+        if mtime is not None and created >= mtime:
+            continue
+        if not dry_run:
+            delete_thumbnail(photo_id, size, fmt)
+        n_thumbs += 1
+    for face_id, photo_id, created in thumbnail_manifest.all_face_crops():
+        mtime = modified.get(photo_id)
+        if (face_id, photo_id) in pairs and mtime is not None and created >= mtime:
+            continue
+        if not dry_run:
+            delete_face_crop(face_id, photo_id)
+        n_faces += 1
+    return n_thumbs, n_faces
+
+
+def enforce_budgets(dry_run):
+    """Evict least recently used entries of every class over budget. Returns {class: bytes freed}."""
+    classes = thumbnail_manifest.usage()["classes"]
+    freed = {}
+    for cls, budget_mb in config.THUMBNAIL_BUDGET_MB.items():
+        if budget_mb is None or cls not in classes:
+            continue
+        excess = classes[cls]["bytes"] - budget_mb * MB
+        freed[cls] = 0
+        while excess > 0:
+            if cls == "faces":
+                batch = [((face_id, photo_id), nbytes)
+                         for face_id, photo_id, nbytes in thumbnail_manifest.least_recently_used_faces()]
+            else:
+                batch = [((photo_id, cls, fmt), nbytes)
+                         for photo_id, fmt, nbytes in thumbnail_manifest.least_recently_used(cls)]
+            if not batch:
+                break
+            for key, nbytes in batch:
+                if excess <= 0:
+                    break
+                if not dry_run:
+                    (delete_face_crop if cls == "faces" else delete_thumbnail)(*key)
+                excess -= nbytes
+                freed[cls] += nbytes
+            if dry_run:
+                break
+    return freed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="report what would be removed")
+    args = parser.parse_args()
+
+    start = time.time()
+    print(f"=== Thumbnail cache GC ({config.THUMBNAIL_DIR}){' [dry run]' if args.dry_run else ''} ===")
+
+    modified, pairs = fetch_reference()
+    n_thumbs, n_faces = collect_orphans(modified, pairs, args.dry_run)
+    print(f"  Orphaned or stale: {n_thumbs} thumbnails, {n_faces} face crops")
+
+    freed = enforce_budgets(args.dry_run)
+    for cls, nbytes in freed.items():
+        label = "faces" if cls == "faces" else f"{cls}px"
+        print(f"  {label}: {nbytes / MB:.1f} MB evicted to fit {config.THUMBNAIL_BUDGET_MB[cls]} MB")
+
+    if not args.dry_run:
+        if config.THUMBNAIL_STORE == "pack":
+            result = thumbnail_pack.compact()
+            print(f"  Pack: reclaimed {result['reclaimed_bytes'] / MB:.1f} MB")
+        thumbnail_manifest.set_counter("gc_last_run", int(time.time()))
+        thumbnail_manifest.set_counter("gc_last_removed", n_thumbs + n_faces)
+        thumbnail_manifest.set_counter("gc_last_evicted_bytes", sum(freed.values()))
+
+    print(f"\nDone in {time.time() - start:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,29 @@
 #!/usr/bin/env python3
-"""Batch pre-generate thumbnails for all photos and face crops."""
+"""Batch pre-generate thumbnails for all photos and face crops.
 
-import sys
+Work is grouped by photo: each original is decoded once and every missing
+derivative (300px, optionally 1200px, face crops, the colour placeholder stored
+in photos.placeholder) is written from that decode.
+Pending photos are found through the thumbnail manifest, then rendered by a
+pool of worker processes. Safe to interrupt: the next run resumes where this
+one stopped. Photos that cannot be decoded get an empty placeholder and are
+skipped by later runs; to retry them:
+    UPDATE photos SET placeholder = NULL WHERE placeholder = '';
+"""
+
+import argparse
+import os
 import time
+from multiprocessing import Pool
 import psycopg2
+from psycopg2.extras import execute_values
 import config
-from services.thumbnail_service import (
-    get_thumbnail_path, generate_thumbnail,
-    get_face_crop_path, generate_face_crop,
-)
+from services import thumbnail_manifest
+from services.photo_service import media_version
+from services.thumbnail_service import available_formats, render_photo
+
+IMAGE_EXTENSIONS = ('.HEIC', '.JPG', '.JPEG', '.PNG')
+UNDECODABLE = ""  # photos.placeholder of a file that failed to decode: left out of the pending work
 
 
 def get_db():
@@ -19,93 +34,225 @@ def get_db():
     )
 
 
-def generate_photo_thumbnails(size=300):
-    """Generate thumbnails for all photos that don't have one yet."""
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, filepath FROM photos ORDER BY id")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    total = len(rows)
-    generated = 0
-    skipped = 0
-    errors = 0
-
-    print(f"[Thumbnails {size}px] {total} photos to check...")
-
-    for i, (photo_id, filepath) in enumerate(rows, 1):
-        if get_thumbnail_path(photo_id, size):
-            skipped += 1
-            continue
-
-        path = generate_thumbnail(filepath, photo_id, size)
-        if path:
-            generated += 1
-        else:
-            errors += 1
+def fetch_work(outputs, batch_size=5000):
+    """Return [(photo_id, filepath, version, missing_outputs, missing_faces, needs_placeholder)] for photos with pending work.
 
-        if i % 100 == 0:
-            print(f"  [{i}/{total}] generated={generated} skipped={skipped} errors={errors}")
+    outputs: (size, format) pairs every photo should have.
 
-    print(f"[Thumbnails {size}px] Done: generated={generated} skipped={skipped} errors={errors}")
-    return generated
-
-
-def generate_face_crops():
-    """Generate face crops for all faces that don't have one yet."""
+    Photos are read from PostgreSQL in id order, by batches, and checked against
+    the manifest; nothing on disk is stat-ed.
+    """
     conn = get_db()
     cur = conn.cursor()
+
+    # One representative crop per face (same choice as face_service.get_face_crop_info)
+    done_faces = thumbnail_manifest.existing_face_crops()
     cur.execute("""
         SELECT DISTINCT ON (pf.face_id)
-               pf.face_id, pf.photo_id, p.filepath,
+               pf.face_id, pf.photo_id,
                pf.bbox_x1, pf.bbox_y1, pf.bbox_x2, pf.bbox_y2
         FROM photo_faces pf
-        JOIN photos p ON p.id = pf.photo_id
         ORDER BY pf.face_id, pf.id
     """)
-    rows = cur.fetchall()
+    faces_by_photo = {}
+    for face_id, photo_id, x1, y1, x2, y2 in cur.fetchall():
+        if (face_id, photo_id) not in done_faces:
+            faces_by_photo.setdefault(photo_id, []).append((face_id, [x1, y1, x2, y2]))
+
+    work = []
+    last_id = 0
+    while True:
+        cur.execute("""
+            SELECT id, filepath, file_modified, filesize, placeholder IS NULL FROM photos
+            WHERE id > %s AND extension IN %s AND placeholder IS DISTINCT FROM %s
+            ORDER BY id LIMIT %s
+        """, (last_id, IMAGE_EXTENSIONS, UNDECODABLE, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        ids = [r[0] for r in rows]
+        done = {out: thumbnail_manifest.existing_thumbs(ids, *out) for out in outputs}
+        for photo_id, filepath, file_modified, filesize, needs_placeholder in rows:
+            missing_outputs = [out for out in outputs if photo_id not in done[out]]
+            missing_faces = faces_by_photo.get(photo_id, [])
+            if missing_outputs or missing_faces or needs_placeholder:
+                work.append((photo_id, filepath, media_version(file_modified, filesize),
+                             missing_outputs, missing_faces, needs_placeholder))
+
     cur.close()
     conn.close()
+    return work
 
-    total = len(rows)
-    generated = 0
-    skipped = 0
-    errors = 0
 
-    print(f"[Face crops] {total} faces to check...")
+def _render_task(task):
+    photo_id, filepath, version, outputs, faces, needs_placeholder = task
+    result = render_photo(filepath, photo_id, thumbs=outputs, faces=faces, placeholder=needs_placeholder,
+                          version=version)
+    placeholder = result["placeholder"]
+    if (needs_placeholder and placeholder is None
+            and os.path.exists(os.path.join(config.PHOTOS_ROOT, filepath))):
+        placeholder = UNDECODABLE
+    errors = (len(outputs) - len(result["thumbs"])) + (len(faces) - len(result["faces"]))
+    ext = os.path.splitext(filepath)[1].upper()
+    return (photo_id, len(result["thumbs"]), len(result["faces"]), errors, ext, result["decode"],
+            placeholder)
 
-    for i, (face_id, photo_id, filepath, x1, y1, x2, y2) in enumerate(rows, 1):
-        if get_face_crop_path(face_id):
-            skipped += 1
-            continue
 
-        path = generate_face_crop(filepath, face_id, photo_id, [x1, y1, x2, y2])
-        if path:
-            generated += 1
-        else:
-            errors += 1
+def save_placeholders(conn, placeholders):
+    """Write [(photo_id, placeholder)] to photos in one statement."""
+    if not placeholders:
+        return
+    cur = conn.cursor()
+    execute_values(cur, """
+        UPDATE photos p SET placeholder = v.placeholder
+        FROM (VALUES %s) AS v (id, placeholder)
+        WHERE p.id = v.id
+    """, placeholders)
+    conn.commit()
+    cur.close()
 
-        if i % 50 == 0:
-            print(f"  [{i}/{total}] generated={generated} skipped={skipped} errors={errors}")
 
-    print(f"[Face crops] Done: generated={generated} skipped={skipped} errors={errors}")
-    return generated
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m{seconds % 60:02d}s"
 
 
-if __name__ == "__main__":
+def print_decode_stats(by_format):
+    """by_format: {extension: {"preview": n, "reduced": n, "full": n}}"""
+    for ext in sorted(by_format):
+        counts = by_format[ext]
+        total = sum(counts.values())
+        fast = counts.get("preview", 0) + counts.get("reduced", 0)
+        print(
+            f"  {ext:6} {total:8d} decoded  preview={counts.get('preview', 0)} "
+            f"reduced={counts.get('reduced', 0)} full={counts.get('full', 0)} "
+            f"fast path {100 * fast / total if total else 0:.0f}%"
+        )
+
+
+def print_format_savings():
+    report = thumbnail_manifest.format_savings()
+    for size in sorted(report):
+        for fmt, row in sorted(report[size].items()):
+            mb = row["bytes"] / 1024 / 1024
+            line = f"  {size:5d}px {fmt:5} {row['photos']:8d} photos {mb:9.1f} MB"
+            if fmt != "jpeg":
+                line += (f"  vs JPEG {row['jpeg_bytes'] / 1024 / 1024:9.1f} MB"
+                         f"  savings {row['savings_pct']:.1f}%")
+            print(line)
+
+
+def generate_all(sizes, formats, workers, chunksize):
+    """Render every missing thumbnail size/format and face crop, one decode per photo."""
+    outputs = [(size, fmt) for size in sizes for fmt in formats]
+    work = fetch_work(outputs)
+    total = len(work)
+    stats = {"photos": 0, "thumbs": 0, "faces": 0, "placeholders": 0, "errors": 0}
+    by_format = {}
+    placeholders = []
+
+    print(
+        f"[Thumbnails {'+'.join(str(s) for s in sizes)}px {'+'.join(formats)} + faces + placeholders] "
+        f"{total} photos pending, {workers} workers"
+    )
+    if total == 0:
+        return stats
+
+    start = time.time()
+    last_report = start
+    conn = get_db()
+    with Pool(workers) as pool:
+        for photo_id, n_thumbs, n_faces, errors, ext, decode, placeholder in pool.imap_unordered(
+                _render_task, work, chunksize=chunksize):
+            stats["photos"] += 1
+            if placeholder is not None:
+                placeholders.append((photo_id, placeholder))
+                stats["placeholders"] += placeholder != UNDECODABLE
+                if len(placeholders) >= 500:
+                    save_placeholders(conn, placeholders)
+                    placeholders = []
+            if decode:
+                counts = by_format.setdefault(ext, {})
+                counts[decode] = counts.get(decode, 0) + 1
+            stats["thumbs"] += n_thumbs
+            stats["faces"] += n_faces
+            stats["errors"] += errors
+
+            now = time.time()
+            if now - last_report >= 10 or stats["photos"] == total:
+                last_report = now
+                elapsed = now - start
+                rate = stats["photos"] / elapsed if elapsed > 0 else 0
+                eta = (total - stats["photos"]) / rate if rate > 0 else 0
+                print(
+                    f"  [{stats['photos']}/{total}] {rate:.1f} photos/s ETA {_format_eta(eta)} "
+                    f"thumbs={stats['thumbs']} faces={stats['faces']} errors={stats['errors']}"
+                )
+    save_placeholders(conn, placeholders)
+    conn.close()
+
+    print(
+        f"[Thumbnails] Done: decoded={stats['photos']} thumbs={stats['thumbs']} "
+        f"faces={stats['faces']} placeholders={stats['placeholders']} errors={stats['errors']}"
+    )
+    print_decode_stats(by_format)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true",
+                        help="also render 1200px thumbnails (lightbox), slower")
+    parser.add_argument("--workers", type=int, default=config.THUMBNAIL_WORKERS,
+                        help=f"worker processes (default {config.THUMBNAIL_WORKERS})")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="photos handed to a worker at a time (default 16)")
+    parser.add_argument("--formats", default=",".join(config.THUMBNAIL_PREGENERATE_FORMATS),
+                        help="comma-separated output formats (default %(default)s)")
+    parser.add_argument("--report-formats", action="store_true",
+                        help="print the size of each format against JPEG across the cache, and exit")
+    parser.add_argument("--stats", action="store_true",
+                        help="print how the cached thumbnails were decoded, per format, and exit")
+    parser.add_argument("--rebuild-manifest", action="store_true",
+                        help="re-index the thumbnails already on disk before generating")
+    args = parser.parse_args()
+
+    if args.stats:
+        for ext, per_size in sorted(thumbnail_manifest.decode_stats().items()):
+            for size, counts in sorted(per_size.items()):
+                print_decode_stats({f"{ext}@{size}": counts})
+        return
+    if args.report_formats:
+        print_format_savings()
+        return
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    encodable = available_formats()
+    for fmt in formats:
+        if fmt not in encodable:
+            parser.error(f"format {fmt!r} cannot be encoded here (available: {', '.join(encodable)})")
+
     start = time.time()
 
-    # 300px thumbnails (grid)
-    generate_photo_thumbnails(300)
+    if args.rebuild_manifest:
+        n_thumbs, n_faces = thumbnail_manifest.rebuild(
+            {size: os.path.join(config.THUMBNAIL_DIR, str(size)) for size in (300, 1200)},
+            os.path.join(config.THUMBNAIL_DIR, "faces"),
+        )
+        print(f"[Manifest] Indexed {n_thumbs} thumbnails and {n_faces} face crops")
 
-    # 1200px thumbnails (lightbox) — optional, can be slow
-    if "--full" in sys.argv:
-        generate_photo_thumbnails(1200)
+    # 300px thumbnails (grid); 1200px (lightbox) only with --full
+    sizes = [300]
+    if args.full:
+        sizes.append(1200)
 
-    # Face crops
-    generate_face_crops()
+    generate_all(sizes, formats, max(1, args.workers), max(1, args.chunksize))
 
     elapsed = time.time() - start
     print(f"\nTotal time: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
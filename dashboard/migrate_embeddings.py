@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Re-encode stored embeddings in a compact format, with a recall-loss report first.
+
+    python migrate_embeddings.py clip --codec int8 [--pca 256] [--dry-run]
+    python migrate_embeddings.py face --codec float16
+
+Reads the full-size vectors of the kind (photos.clip_embedding or faces.embedding),
+optionally fits a PCA projection on a sample, and prints, for every codec with and
+without that projection, the bytes per vector and the recall@k of cosine search
+against float32. Unless --dry-run, the chosen format is recorded in
+embedding_formats (sql/003_embedding_formats.sql), every row is rewritten, and
+the format becomes the one the analysis scripts write. Stop the analysis timer
+meanwhile: rows it writes during the run keep the previous format.
+
+Rows already reduced by another projection cannot be restored and are left as
+they are. updated_at is not touched; the CLIP index rebuilds by itself when the
+projection changed, and otherwise keeps serving its current vectors.
+"""
+
+import argparse
+import time
+import numpy as np
+from psycopg2.extras import execute_values
+from services import db, embedding_codec, events
+
+REPORT_ROWS = 50000  # corpus of the recall report (random rows)
+
+
+def _fetch(cur, table, column, since_id=0, limit=None):
+    cur.execute(f"""
+        SELECT id, {column} FROM {table}
+        WHERE id > %s AND {column} IS NOT NULL AND length({column}) > 0
+        ORDER BY id {"LIMIT %s" if limit else ""}
+    """, (since_id, limit) if limit else (since_id,))
+    return cur.fetchall()
+
+
+def load_full(cur, table, column):
+    """(ids, float32 matrix) of the full-size vectors, and how many rows are reduced already."""
+    ids, vectors, reduced, dim = [], [], 0, None
+    for row_id, blob in _fetch(cur, table, column):
+        vec, projection_id = embedding_codec.decode(blob)
+        if projection_id:
+            reduced += 1
+            continue
+        dim = dim or len(vec)
+        if len(vec) != dim:
+            reduced += 1
+            continue
+        ids.append(row_id)
+        vectors.append(vec)
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(ids, dtype=np.int64), matrix, reduced
+
+
+def _normalized(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def _roundtrip(matrix, codec, projection):
+    return np.vstack([embedding_codec.decode(embedding_codec.encode(v, codec, projection))[0] for v in matrix])
+
+
+def recall(exact, matrix, codec, projection, k, queries):
+    """Mean share of the exact top-k found by cosine search over the decoded vectors."""
+    decoded = _normalized(_roundtrip(matrix, codec, projection))
+    hits = 0
+    for q in queries:
+        truth = np.argpartition(exact @ exact[q], -k)[-k:]
+        query = exact[q] if projection is None else projection.apply(exact[q])
+        found = np.argpartition(decoded @ (query / np.linalg.norm(query)), -k)[-k:]
+        hits += len(np.intersect1d(truth, found))
+    return hits / (k * len(queries))
+
+
+def report(matrix, projection, k, query_count):
+    """Rows (codec, dims, bytes per vector, recall@k) of every candidate format."""
+    rng = np.random.default_rng(0)
+    corpus = matrix[rng.choice(len(matrix), min(len(matrix), REPORT_ROWS), replace=False)]
+    exact = _normalized(corpus)
+    k = min(k, len(corpus))
+    queries = rng.choice(len(corpus), min(query_count, len(corpus)), replace=False)
+    rows = []
+    for candidate in [None] + ([projection] if projection is not None else []):
+        dims = candidate.dims if candidate is not None else matrix.shape[1]
+        for codec in embedding_codec.CODECS:
+            rows.append((codec, dims, embedding_codec.encoded_size(codec, dims),
+                         recall(exact, corpus, codec, candidate, k, queries)))
+    return rows
+
+
+def rewrite(conn, table, column, codec, projection, batch):
+    """Re-encode every full-size row. Returns (rewritten, left)."""
+    rewritten = left = 0
+    last_id = 0
+    with conn.cursor() as cur:
+        while True:
+            rows = _fetch(cur, table, column, last_id, batch)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            values = []
+            for row_id, blob in rows:
+                vec, projection_id = embedding_codec.decode(blob)
+                if projection_id:
+                    left += 1
+                    continue
+                values.append((row_id, embedding_codec.encode(vec, codec, projection)))
+            if values:
+                execute_values(cur, f"""
+                    UPDATE {table} t SET {column} = v.blob
+                    FROM (VALUES %s) AS v(id, blob) WHERE t.id = v.id
+                """, values)
+            conn.commit()
+            rewritten += len(values)
+            print(f"  {table}: {rewritten} rewritten", end="\r")
+    print()
+    return rewritten, left
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("kind", choices=sorted(embedding_codec.KINDS))
+    parser.add_argument("--codec", choices=embedding_codec.CODECS, default="float16")
+    parser.add_argument("--pca", type=int, default=None, help="reduce to this many dimensions (e.g. 128-256)")
+    parser.add_argument("--sample", type=int, default=20000, help="rows the PCA is fitted on")
+    parser.add_argument("--k", type=int, default=50, help="recall@k of the report")
+    parser.add_argument("--queries", type=int, default=200, help="query rows of the report")
+    parser.add_argument("--batch", type=int, default=2000, help="rows per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="report only, change nothing")
+    args = parser.parse_args()
+
+    table, column = embedding_codec.KINDS[args.kind]
+    conn = db.get_conn()
+    try:
+        with conn.cursor() as cur:
+            start = time.time()
+            ids, matrix, reduced = load_full(cur, table, column)
+        conn.commit()
+        print(f"[embeddings] {table}.{column}: {len(ids)} full-size vectors ({matrix.shape[1:] or '-'} dims), "
+              f"{reduced} already reduced, read in {time.time() - start:.1f}s")
+        if not len(ids):
+            return
+
+        projection = None
+        if args.pca:
+            rng = np.random.default_rng(0)
+            sample = matrix[rng.choice(len(matrix), min(len(matrix), args.sample), replace=False)]
+            projection = embedding_codec.Projection.fit(_normalized(sample), args.pca)
+
+        print(f"{'codec':<8} {'dims':>5} {'bytes':>6} {'total MB':>9} {'recall@' + str(args.k):>10}")
+        chosen = None
+        for codec, dims, size, rec in report(matrix, projection, args.k, args.queries):
+            print(f"{codec:<8} {dims:>5} {size:>6} {size * len(ids) / 1e6:>9.1f} {rec:>10.3f}")
+            if codec == args.codec and (projection is None) == (dims == matrix.shape[1]):
+                chosen = rec
+        if args.dry_run:
+            return
+
+        with conn.cursor() as cur:
+            format_id = embedding_codec.save_format(cur, args.kind, args.codec, projection, round(chosen, 4))
+        conn.commit()
+        rewritten, left = rewrite(conn, table, column, args.codec, projection, args.batch)
+        with conn.cursor() as cur:
+            embedding_codec.activate_format(cur, args.kind, format_id)
+            if args.kind == "clip":
+                events.notify(cur, "embeddings")  # the index rebuilds in a new projection space
+        conn.commit()
+        print(f"[embeddings] {rewritten} rows now {args.codec}"
+              + (f" x {projection.dims} (projection {format_id})" if projection is not None else "")
+              + (f", {left} reduced rows left as they were" if left else ""))
+    finally:
+        db.put_conn(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Copy photos.clip_embedding and faces.embedding (bytea) into their pgvector columns.
+
+Run after sql/002_pgvector.sql and before switching EMBEDDING_STORAGE to
+"pgvector"; from then on the analysis scripts fill both columns. Only rows whose
+vector is still NULL are read, so it can be interrupted and re-run. updated_at
+is left alone: the in-memory index sees no change.
+
+    python migrate_pgvector.py [--batch 2000]
+"""
+
+import argparse
+import time
+import numpy as np
+from psycopg2.extras import execute_values
+from services import db, embedding_codec
+from services.clip_pgvector import vector_literal
+
+DIM = 512  # vector(512) in sql/002_pgvector.sql
+TABLES = (
+    ("photos", "clip_embedding", "clip_vector"),
+    ("faces", "embedding", "embedding_vector"),
+)
+
+
+def migrate(table, source, target, batch):
+    """Fill table.target from table.source, batch rows per transaction. Returns (copied, skipped)."""
+    copied = skipped = 0
+    last_id = 0
+    conn = db.get_conn()
+    try:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute(f"""
+                    SELECT id, {source} FROM {table}
+                    WHERE id > %s AND {target} IS NULL AND {source} IS NOT NULL
+                    ORDER BY id LIMIT %s
+                """, (last_id, batch))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                values = []
+                for row_id, blob in rows:
+                    vec, projection_id = embedding_codec.decode(blob)
+                    # Empty blobs mark photos without a possible embedding; PCA-reduced
+                    # ones (migrate_embeddings.py) no longer fit vector(512)
+                    if (len(vec) != DIM or projection_id or not vec.any()
+                            or not np.isfinite(vec).all()):
+                        skipped += 1
+                        continue
+                    values.append((row_id, vector_literal(vec)))
+                if values:
+                    execute_values(cur, f"""
+                        UPDATE {table} t SET {target} = v.vec::vector
+                        FROM (VALUES %s) AS v(id, vec) WHERE t.id = v.id
+                    """, values)
+                conn.commit()
+                copied += len(values)
+                print(f"  {table}: {copied} copied, {skipped} skipped", end="\r")
+    finally:
+        db.put_conn(conn)
+    print()
+    return copied, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=2000, help="rows per transaction")
+    args = parser.parse_args()
+
+    for table, source, target in TABLES:
+        start = time.time()
+        copied, skipped = migrate(table, source, target, args.batch)
+        print(f"[pgvector] {table}.{target}: {copied} copied, {skipped} skipped in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
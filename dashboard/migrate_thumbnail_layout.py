@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Move thumbnails from the flat cache layout into id-hash shard directories.
+
+    THUMBNAIL_DIR/300/12345.jpg        -> THUMBNAIL_DIR/300/39/12345.jpg
+    THUMBNAIL_DIR/faces/42_12345.jpg   -> THUMBNAIL_DIR/faces/2a/42_12345.jpg
+
+Safe to run while the dashboard is up and to re-run: files are renamed on the
+same filesystem, and a flat file whose sharded copy was already re-rendered is
+simply removed. The manifest stores no paths, so it needs no update.
+"""
+
+import os
+import sys
+import time
+import config
+from services.thumbnail_service import THUMBNAIL_SIZES, shard
+
+
+def _migrate_dir(directory, key_of):
+    """Move the regular files directly under directory into shard sub-directories.
+
+    key_of(stem) returns the integer the shard is derived from, or None to leave the file.
+    Returns (moved, dropped, left).
+    """
+    moved = dropped = left = 0
+    if not os.path.isdir(directory):
+        return moved, dropped, left
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stem = entry.name.split(".", 1)[0]
+            key = key_of(stem)
+            if key is None or entry.name.endswith(".tmp"):
+                left += 1
+                continue
+
+            target_dir = os.path.join(directory, shard(key))
+            target = os.path.join(target_dir, entry.name)
+            os.makedirs(target_dir, exist_ok=True)
+            if os.path.exists(target):
+                os.remove(entry.path)
+                dropped += 1
+            else:
+                os.replace(entry.path, target)
+                moved += 1
+
+            if (moved + dropped) % 5000 == 0:
+                print(f"  {directory}: moved={moved} dropped={dropped}", end="\r")
+    return moved, dropped, left
+
+
+def _photo_key(stem):
+    return int(stem) if stem.isdigit() else None
+
+
+def _face_key(stem):
+    parts = stem.split("_")
+    if len(parts) == 2 and all(p.isdigit() for p in parts):
+        return int(parts[0])
+    return None
+
+
+def main():
+    start = time.time()
+    print(f"=== Thumbnail cache layout migration ({config.THUMBNAIL_DIR}) ===")
+
+    total_left = 0
+    for size in THUMBNAIL_SIZES:
+        directory = os.path.join(config.THUMBNAIL_DIR, str(size))
+        moved, dropped, left = _migrate_dir(directory, _photo_key)
+        total_left += left
+        print(f"  {size}px: moved={moved} dropped={dropped} left={left}          ")
+
+    directory = os.path.join(config.THUMBNAIL_DIR, "faces")
+    moved, dropped, left = _migrate_dir(directory, _face_key)
+    total_left += left
+    print(f"  faces: moved={moved} dropped={dropped} left={left}          ")
+
+    print(f"\nDone in {time.time() - start:.0f}s")
+    if total_left:
+        print(f"  {total_left} unrecognised files left in place", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Maintain the packed thumbnail store (config.THUMBNAIL_STORE = "pack").
+
+    python pack_thumbnails.py import [--remove]   copy the loose-file cache into the pack
+    python pack_thumbnails.py compact [--ratio 0.5]
+    python pack_thumbnails.py stats
+"""
+
+import argparse
+import os
+import time
+import config
+from services import thumbnail_pack
+from services.thumbnail_service import FORMATS, THUMBNAIL_SIZES
+
+_EXTENSION_FORMATS = {ext: fmt for fmt, (ext, _, _, _) in FORMATS.items()}
+
+
+def import_loose_files(remove=False):
+    """Append every loose thumbnail to the pack. Face crops stay as files."""
+    imported = 0
+    start = time.time()
+    for size in THUMBNAIL_SIZES:
+        for dirpath, _dirs, files in os.walk(os.path.join(config.THUMBNAIL_DIR, str(size))):
+            for fname in files:
+                stem, ext = os.path.splitext(fname)
+                fmt = _EXTENSION_FORMATS.get(ext)
+                if fmt is None or not stem.isdigit():
+                    continue
+                path = os.path.join(dirpath, fname)
+                with open(path, "rb") as f:
+                    thumbnail_pack.put(int(stem), size, fmt, f.read())
+                if remove:
+                    os.remove(path)
+                imported += 1
+                if imported % 1000 == 0:
+                    rate = imported / (time.time() - start)
+                    print(f"  {imported} imported ({rate:.0f}/s)", end="\r")
+    print(f"  {imported} thumbnails imported in {time.time() - start:.0f}s          ")
+
+
+def print_stats():
+    s = thumbnail_pack.stats()
+    mb = 1024 * 1024
+    print(f"  Segments: {s['segments']}")
+    print(f"  Thumbnails: {s['blobs']}")
+    print(f"  On disk: {s['bytes'] / mb:.1f} MB (live {s['live_bytes'] / mb:.1f} MB, "
+          f"dead {s['dead_bytes'] / mb:.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="copy loose thumbnails into the pack")
+    p_import.add_argument("--remove", action="store_true", help="delete each loose file once packed")
+    p_compact = sub.add_parser("compact", help="reclaim space from replaced or deleted thumbnails")
+    p_compact.add_argument("--ratio", type=float, default=0.5,
+                           help="rewrite segments whose live share is below this (default 0.5)")
+    sub.add_parser("stats", help="print segment and space usage")
+    args = parser.parse_args()
+
+    print(f"=== Thumbnail pack ({os.path.join(config.THUMBNAIL_DIR, 'pack')}) ===")
+    if args.command == "import":
+        import_loose_files(remove=args.remove)
+    elif args.command == "compact":
+        result = thumbnail_pack.compact(min_live_ratio=args.ratio)
+        print(f"  Rewrote {result['segments']} segments, moved {result['moved']} thumbnails, "
+              f"reclaimed {result['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+    print_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 """Album management: list, create, update, delete, add/remove photos."""
 
+from services import pagination
 from services.db import db_cursor
+from services.photo_service import media_version, thumb_url
 
 
 def list_albums(page=1, per_page=20):
@@ -115,30 +117,43 @@ def delete_album(album_id):
     return {"ok": True}
 
 
-def get_album_photos(album_id, page=1, per_page=50):
-    """Get photos in an album."""
+def get_album_photos(album_id, page=1, per_page=50, cursor=None):
+    """Get photos in an album, last added first (cursor: see photo_service.search_photos)."""
     per_page = min(per_page, 200)
     offset = (page - 1) * per_page
+    after = pagination.decode_cursor(cursor, "added_at", "desc") if cursor else None
+    select = """
+        SELECT p.id, p.filename, p.filepath, p.date_taken, p.camera_model,
+               p.latitude, p.longitude, p.width, p.height, ap.added_at,
+               p.file_modified, p.filesize, p.placeholder
+        FROM photos p
+        JOIN album_photos ap ON ap.photo_id = p.id
+    """
 
     with db_cursor() as cur:
         cur.execute("SELECT COUNT(*) FROM album_photos WHERE album_id = %s", (album_id,))
         total = cur.fetchone()[0]
 
-        cur.execute("""
-            SELECT p.id, p.filename, p.filepath, p.date_taken, p.camera_model,
-                   p.latitude, p.longitude, p.width, p.height, ap.added_at
-            FROM photos p
-            JOIN album_photos ap ON ap.photo_id = p.id
-            WHERE ap.album_id = %s
-            ORDER BY ap.added_at DESC
-            LIMIT %s OFFSET %s
-        """, (album_id, per_page, offset))
+        if after is not None or offset == 0:
+            rows, more = pagination.fetch_page(
+                cur, select, "ap.album_id = %s", [album_id], "ap.added_at", "ap.photo_id", "desc", after, per_page)
+        else:
+            cur.execute(f"""
+                {select}
+                WHERE ap.album_id = %s
+                ORDER BY ap.added_at DESC NULLS LAST, ap.photo_id DESC
+                LIMIT %s OFFSET %s
+            """, (album_id, per_page, offset))
+            columns = [desc[0] for desc in cur.description]
+            rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+            more = offset + len(rows) < total
+        next_cursor = (pagination.encode_cursor("added_at", "desc", rows[-1]["added_at"], rows[-1]["id"])
+                       if rows and more else None)
 
-        columns = [desc[0] for desc in cur.description]
         photos = []
-        for row in cur.fetchall():
-            photo = dict(zip(columns, row))
-            photo["thumb_url"] = f"/api/explorer/photo/{photo['id']}/thumb"
+        for photo in rows:
+            photo["version"] = media_version(photo.pop("file_modified"), photo.pop("filesize"))
+            photo["thumb_url"] = thumb_url(photo["id"], photo["version"])
             photo["added_at"] = str(photo["added_at"]) if photo.get("added_at") else None
             if photo["latitude"]:
                 photo["latitude"] = float(photo["latitude"])
@@ -146,7 +161,7 @@ def get_album_photos(album_id, page=1, per_page=50):
                 photo["longitude"] = float(photo["longitude"])
             photos.append(photo)
 
-    return {"photos": photos, "total": total, "page": page, "per_page": per_page}
+    return {"photos": photos, "total": total, "page": page, "per_page": per_page, "next_cursor": next_cursor}
 
 
 def add_photos_to_album(album_id, photo_ids):
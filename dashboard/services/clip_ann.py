@@ -0,0 +1,225 @@
+"""Approximate nearest-neighbour index over the CLIP base matrix (optional).
+
+Backends, chosen with config.CLIP_ANN_BACKEND:
+    "ivf"      pure numpy IVF-Flat: spherical k-means centroids, rows bucketed by
+               nearest centroid, queries score only the CLIP_ANN_NPROBE closest buckets.
+               Files are .npy and memory-mapped like the matrix itself.
+    "faiss"    faiss.IndexIVFFlat (inner product), when faiss is installed
+    "hnswlib"  hnswlib HNSW graph (cosine), when hnswlib is installed
+
+The index covers the base generation only; photos analysed since then are in the
+delta matrix, which clip_search_service scores exactly. Full builds reuse the
+previous IVF centroids (rows are only re-bucketed) unless retrain=True.
+All backends return positions into the base matrix.
+"""
+
+import os
+import time
+import numpy as np
+import config
+
+ASSIGN_BLOCK = 65536
+KMEANS_ITERATIONS = 15
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def available_backends():
+    backends = ["ivf"]
+    for name in ("faiss", "hnswlib"):
+        try:
+            __import__(name)
+            backends.append(name)
+        except ImportError:
+            pass
+    return backends
+
+
+def _path(name):
+    return os.path.join(config.CLIP_INDEX_DIR, name)
+
+
+def default_nlist(n):
+    """About 4 * sqrt(n) buckets, so a bucket holds ~sqrt(n)/4 rows."""
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def _assign(matrix, centroids):
+    """Nearest centroid (max inner product) of every row, block by block."""
+    labels = np.empty(len(matrix), dtype=np.int32)
+    centroids_t = centroids.T.astype(np.float32)
+    for start in range(0, len(matrix), ASSIGN_BLOCK):
+        block = np.asarray(matrix[start:start + ASSIGN_BLOCK], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids_t, axis=1)
+    return labels
+
+
+def train_centroids(matrix, nlist, seed=0):
+    """Spherical k-means on a sample of the (normalised) rows."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))],
+                        dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty buckets with random rows instead of leaving dead centroids
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """IVF-Flat over a memory-mapped matrix: buckets are position lists, vectors stay in place."""
+
+    def __init__(self, matrix, centroids, order, offsets, nprobe):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    def search(self, query_vec, k):
+        nprobe = min(self.nprobe, len(self.centroids))
+        closeness = self.centroids @ query_vec
+        probe = np.argpartition(closeness, len(closeness) - nprobe)[len(closeness) - nprobe:]
+        positions = np.sort(np.concatenate(
+            [self.order[self.offsets[b]:self.offsets[b + 1]] for b in probe]
+        ))
+        if not len(positions):
+            return positions, np.zeros(0, dtype=np.float32)
+        scores = np.asarray(self.matrix[positions], dtype=np.float32) @ query_vec
+        k = min(k, len(scores))
+        best = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+        return positions[best], scores[best]
+
+
+class _FaissIndex:
+    def __init__(self, index, nprobe):
+        self.index = index
+        self.index.nprobe = nprobe
+
+    def search(self, query_vec, k):
+        scores, positions = self.index.search(query_vec.reshape(1, -1).astype(np.float32), k)
+        keep = positions[0] >= 0
+        return positions[0][keep], scores[0][keep]
+
+
+class _HnswIndex:
+    def __init__(self, index, ef):
+        self.index = index
+        self.index.set_ef(ef)
+
+    def search(self, query_vec, k):
+        k = min(k, self.index.get_current_count())
+        positions, distances = self.index.knn_query(query_vec.reshape(1, -1), k=k)
+        return positions[0].astype(np.int64), 1 - distances[0]
+
+
+def build(backend, matrix, generation, previous=None, retrain=False):
+    """Build the ANN index for a base matrix. Returns the "ann" meta entry.
+
+    previous: the "ann" entry of the last generation, whose IVF centroids are
+    reused when dims match and retrain is False.
+    """
+    start = time.time()
+    n, dim = matrix.shape
+    files = {}
+    entry = {"backend": backend, "generation": generation, "count": int(n)}
+
+    if backend == "ivf":
+        centroids = None
+        if (not retrain and previous and previous.get("backend") == "ivf"
+                and os.path.exists(_path(previous["files"]["centroids"]))):
+            centroids = np.load(_path(previous["files"]["centroids"]))
+            if centroids.shape[1] != dim:
+                centroids = None
+        if centroids is None:
+            centroids = train_centroids(matrix, config.CLIP_ANN_NLIST or default_nlist(n))
+            entry["trained_at"] = time.time()
+        else:
+            entry["trained_at"] = previous.get("trained_at")
+        labels = _assign(matrix, centroids)
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+        files = {"centroids": f"ann-centroids-{generation}.npy",
+                 "order": f"ann-order-{generation}.npy",
+                 "offsets": f"ann-offsets-{generation}.npy"}
+        np.save(_path(files["centroids"]), centroids)
+        np.save(_path(files["order"]), order)
+        np.save(_path(files["offsets"]), offsets.astype(np.int64))
+        entry["nlist"] = int(len(centroids))
+
+    elif backend == "faiss":
+        import faiss
+        nlist = config.CLIP_ANN_NLIST or default_nlist(n)
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        data = np.asarray(matrix, dtype=np.float32)
+        index.train(data)
+        index.add(data)
+        files = {"index": f"ann-faiss-{generation}.index"}
+        faiss.write_index(index, _path(files["index"]))
+        entry["nlist"] = nlist
+
+    elif backend == "hnswlib":
+        import hnswlib
+        index = hnswlib.Index(space="cosine", dim=dim)
+        index.init_index(max_elements=n, ef_construction=200, M=16)
+        for begin in range(0, n, ASSIGN_BLOCK):
+            block = np.asarray(matrix[begin:begin + ASSIGN_BLOCK], dtype=np.float32)
+            index.add_items(block, np.arange(begin, begin + len(block)))
+        files = {"index": f"ann-hnsw-{generation}.bin"}
+        index.save_index(_path(files["index"]))
+
+    else:
+        raise ValueError(f"unknown ANN backend {backend!r} (available: {', '.join(available_backends())})")
+
+    entry["files"] = files
+    entry["build_seconds"] = round(time.time() - start, 1)
+    return entry
+
+
+def load(entry, matrix):
+    """Open a built index for searching over the mapped base matrix."""
+    backend = entry["backend"]
+    if backend == "ivf":
+        files = entry["files"]
+        return IVFIndex(
+            matrix,
+            np.load(_path(files["centroids"])),
+            np.load(_path(files["order"]), mmap_mode="r"),
+            np.load(_path(files["offsets"])),
+            config.CLIP_ANN_NPROBE,
+        )
+    if backend == "faiss":
+        import faiss
+        return _FaissIndex(faiss.read_index(_path(entry["files"]["index"]), faiss.IO_FLAG_MMAP),
+                           config.CLIP_ANN_NPROBE)
+    if backend == "hnswlib":
+        import hnswlib
+        index = hnswlib.Index(space="cosine", dim=matrix.shape[1])
+        index.load_index(_path(entry["files"]["index"]), max_elements=entry["count"])
+        return _HnswIndex(index, max(config.CLIP_ANN_NPROBE * 8, 64))
+    raise ValueError(f"unknown ANN backend {backend!r}")
+
+
+def recall_at_k(ann, matrix, k=50, queries=200, seed=0):
+    """Mean share of the exact top-k found by the ANN index, over stored rows used as queries."""
+    if not len(matrix):
+        return None
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), min(queries, len(matrix)), replace=False)
+    total = 0.0
+    for pos in picks:
+        q = np.asarray(matrix[pos], dtype=np.float32)
+        exact = np.asarray(matrix @ q, dtype=np.float32)
+        kk = min(k, len(exact))
+        truth = set(np.argpartition(exact, len(exact) - kk)[len(exact) - kk:].tolist())
+        found, _scores = ann.search(q, kk)
+        total += len(truth.intersection(found.tolist())) / kk
+    return round(total / len(picks), 4)
@@ -0,0 +1,76 @@
+"""Client of the CLIP inference sidecar (dashboard/clip_sidecar.py) on a unix socket.
+
+The same file ships as analysis/scripts/clip_client.py: both sides read
+CLIP_SIDECAR_SOCKET, CLIP_SIDECAR_TIMEOUT and CLIP_SIDECAR_RETRY from their own
+config.
+
+Wire format, both ways: one JSON header line, then header["payload"] bytes.
+Images go as raw RGB pixels (header "sizes"), embeddings come back as
+L2-normalised float32 rows (header "shape").
+
+After a failure (unreachable, timeout, error reply) the sidecar is not tried
+again for CLIP_SIDECAR_RETRY seconds: calls raise SidecarUnavailable right away,
+so a hung sidecar costs one timeout, not one per request.
+"""
+
+import json
+import socket
+import time
+import numpy as np
+import config
+
+_retry_at = 0.0  # monotonic time before which the sidecar is skipped
+
+
+class SidecarUnavailable(Exception):
+    """No sidecar configured, or it could not be reached in time: encode locally instead."""
+
+
+class SidecarError(SidecarUnavailable):
+    """The sidecar answered with an error (out of memory, bad input): encode locally as well."""
+
+
+def _call(header, payload=b""):
+    global _retry_at
+    path = config.CLIP_SIDECAR_SOCKET
+    if not path:
+        raise SidecarUnavailable("no CLIP_SIDECAR_SOCKET configured")
+    if time.monotonic() < _retry_at:
+        raise SidecarUnavailable(f"{path}: skipped after a failure, retried in {_retry_at - time.monotonic():.0f}s")
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(config.CLIP_SIDECAR_TIMEOUT)
+            sock.connect(path)
+            sock.sendall(json.dumps(dict(header, payload=len(payload))).encode() + b"\n" + payload)
+            with sock.makefile("rb") as f:
+                reply = json.loads(f.readline())
+                body = f.read(reply.get("payload", 0))
+    except (OSError, ValueError) as e:
+        _retry_at = time.monotonic() + config.CLIP_SIDECAR_RETRY
+        raise SidecarUnavailable(f"{path}: {e}") from e
+    if "error" in reply:
+        _retry_at = time.monotonic() + config.CLIP_SIDECAR_RETRY
+        raise SidecarError(f"CLIP sidecar: {reply['error']}")
+    return reply, body
+
+
+def _matrix(reply, body):
+    return np.frombuffer(body, dtype=np.float32).reshape(reply["shape"])
+
+
+def encode_texts(prompts):
+    """Normalised text embeddings, one row per prompt."""
+    return _matrix(*_call({"op": "text", "prompts": list(prompts)}))
+
+
+def encode_images(images):
+    """Normalised image embeddings of PIL images, one row per image."""
+    images = [img.convert("RGB") for img in images]
+    payload = b"".join(img.tobytes() for img in images)
+    return _matrix(*_call({"op": "image", "sizes": [img.size for img in images]}, payload))
+
+
+def stats():
+    """Queue depth and batching metrics of the sidecar."""
+    reply, _ = _call({"op": "stats"})
+    return reply["stats"]
@@ -0,0 +1,106 @@
+"""CLIP search ranked by PostgreSQL through pgvector (config.EMBEDDING_STORAGE = "pgvector").
+
+photos.clip_vector (sql/002_pgvector.sql, copied from the bytea column by
+migrate_pgvector.py and kept filled by the analysis scripts) carries an HNSW or
+IVFFlat index: filters, ordering by cosine distance and LIMIT all run in the
+database and only the top rows come back. No local index is built or mapped.
+"""
+
+import json
+import re
+from datetime import datetime
+import numpy as np
+import config
+from services import photo_service
+from services.db import db_cursor
+
+EF_SEARCH_MAX = 1000  # pgvector upper bound of hnsw.ef_search
+
+
+def vector_literal(vec):
+    """pgvector text input of a vector: '[0.1,0.2,...]'."""
+    return "[" + ",".join(f"{x:.7g}" for x in np.asarray(vec, dtype=np.float32)) + "]"
+
+
+def _where(filters, exclude):
+    for key in ("date_from", "date_to"):
+        if filters.get(key):
+            datetime.strptime(filters[key], "%Y-%m-%d")  # ValueError, like the in-memory path
+    where, params = photo_service.filter_sql(
+        filters.get("tag"), filters.get("source"), filters.get("date_from"), filters.get("date_to"),
+        filters.get("camera"), filters.get("face_id"), filters.get("filename"), filters.get("has_gps"),
+    )
+    if exclude is not None and len(exclude):
+        where += " AND p.id <> ALL(%s)"
+        params.append([int(i) for i in exclude])
+    return where, params
+
+
+def _tune(cur, k):
+    """Scan settings for this transaction. Each index type ignores the other's setting."""
+    cur.execute("SET LOCAL hnsw.ef_search = %s", (min(max(config.CLIP_PGVECTOR_EF_SEARCH, k), EF_SEARCH_MAX),))
+    cur.execute("SET LOCAL ivfflat.probes = %s", (config.CLIP_ANN_NPROBE,))
+    if config.CLIP_PGVECTOR_ITERATIVE_SCAN:
+        cur.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (config.CLIP_PGVECTOR_ITERATIVE_SCAN,))
+
+
+def search(query_vec, k, min_score, filters, exclude=None):
+    """[(photo_id, score)] of the k nearest photos passing filters (see clip_search_service._filter_mask)
+    and scoring above min_score, best first."""
+    where, params = _where(filters, exclude)
+    vec = vector_literal(query_vec)
+    with db_cursor() as cur:
+        _tune(cur, k)
+        cur.execute(f"""
+            SELECT p.id, 1 - (p.clip_vector <=> %s::vector)
+            FROM photos p
+            WHERE p.clip_vector IS NOT NULL AND {where}
+            ORDER BY p.clip_vector <=> %s::vector
+            LIMIT %s
+        """, [vec] + params + [vec, k])
+        rows = cur.fetchall()
+    # relaxed_order scans may hand rows back slightly out of order
+    results = [(photo_id, float(score)) for photo_id, score in rows if score > min_score]
+    results.sort(key=lambda r: r[1], reverse=True)
+    return results
+
+
+def photo_vectors(photo_ids):
+    """Stored vectors of the photo_ids that have one, as a float32 matrix."""
+    with db_cursor() as cur:
+        cur.execute(
+            "SELECT clip_vector::text FROM photos WHERE id = ANY(%s) AND clip_vector IS NOT NULL",
+            ([int(i) for i in photo_ids],),
+        )
+        rows = cur.fetchall()
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.array([json.loads(text) for text, in rows], dtype=np.float32)
+
+
+def stats():
+    """pgvector version, vectors stored (and embeddings not copied yet), indexes on photos.clip_vector."""
+    with db_cursor() as cur:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+        cur.execute("""
+            SELECT COUNT(clip_vector),
+                   COUNT(*) FILTER (WHERE clip_vector IS NULL AND length(clip_embedding) > 0)
+            FROM photos
+        """)
+        vectors, missing = cur.fetchone()
+        cur.execute("""
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = 'photos' AND indexdef LIKE '%%(clip_vector%%'
+        """)
+        indexes = [{"name": name, "method": re.search(r"USING (\w+)", definition).group(1)}
+                   for name, definition in cur.fetchall()]
+    return {
+        "pgvector": row[0] if row else None,
+        "vectors": vectors,
+        "missing_vectors": missing,
+        "indexes": indexes,
+        "ef_search": config.CLIP_PGVECTOR_EF_SEARCH,
+        "probes": config.CLIP_ANN_NPROBE,
+        "iterative_scan": config.CLIP_PGVECTOR_ITERATIVE_SCAN,
+    }
@@ -1,24 +1,119 @@
-"""CLIP text-to-image search: encode query text and find similar photos."""
+"""CLIP text-to-image search: encode query text and find similar photos.
 
-import time
+Photo embeddings are kept on local disk as one contiguous, L2-normalised matrix
+(CLIP_INDEX_DIR/embeddings-<generation>.npy) with the aligned photo ids
+(ids-<generation>.npy). Every worker memory-maps the same files, so the pages are
+shared through the page cache instead of copied per process. meta.json names
+the current generation; build_index() writes a new one from PostgreSQL.
+
+Between full builds, refresh_index() fetches only the rows whose updated_at moved
+past the watermark into a small delta matrix (delta-*.npy) that shadows the base
+rows of the same photos. A background thread in each worker runs it every
+CLIP_REFRESH_INTERVAL seconds (one worker at a time, through the build lock), so
+requests never wait on a refresh; they pick up the new meta.json on their next check.
+An "embeddings" or "photos" event (services/events.py) wakes that thread early,
+and tag/face events drop the matching cached member sets.
+
+With CLIP_ANN_BACKEND set, full builds also write an approximate index of the base
+matrix (services/clip_ann.py) and search only scores the rows it proposes; the
+delta stays small and is always scored exactly.
+
+Each generation also stores per-photo filter columns aligned with its rows
+(date_taken, GPS presence, camera code), so search_vector() can apply the
+photo_service.search_photos filters as one boolean mask over the matrix while
+scoring. Tag, face and filename filters resolve to sorted photo id sets, fetched
+from PostgreSQL and cached for MEMBER_CACHE_TTL seconds.
+
+Stored blobs are decoded by services/embedding_codec.py. Once CLIP embeddings
+are reduced by a PCA projection, the index holds rows of that projection only
+(meta["projection"]) and text queries are projected the same way.
+
+With config.EMBEDDING_STORAGE = "pgvector", none of the above is used: searches
+go to services/clip_pgvector.py and PostgreSQL returns the top rows itself.
+"""
+
+import fcntl
+import json
+import os
 import threading
+import time
+from datetime import datetime, timedelta
 import numpy as np
+import config
+from services import clip_ann, clip_client, clip_pgvector, clip_text_cache, db, embedding_codec, events
 from services.db import db_cursor
 
-# Cache
-_embeddings_cache = None  # dict: photo_id -> normalized float32 array
-_cache_time = 0
-_cache_lock = threading.Lock()
-CACHE_TTL = 600  # 10 minutes
+# Memory-mapped index of the current generation
+_index = None  # {"ids", "matrix", "columns", "delta_ids", "delta_matrix", "delta_columns",
+               #  "shadowed", "camera_codes", "ann", "projection", "meta"}
+_index_mtime = None
+_index_checked = 0
+_index_lock = threading.Lock()
+INDEX_CHECK_INTERVAL = 5  # seconds between stat() calls on meta.json
+INDEX_FORMAT = 2  # bumped when the files change shape; older indexes are rebuilt on load
+COLUMNS = ("dates", "gps", "cameras")
+
+# Sorted photo ids per tag / face / filename filter: {key: (fetched_at, ids)}
+_member_cache = {}
+_member_lock = threading.Lock()
+MEMBER_CACHE_TTL = 60
+MEMBER_CACHE_SIZE = 64
+
+_refresher = None
+_refresh_wake = threading.Event()  # set by events: rows changed, refresh now
+_refresh_state = {"checked_at": None, "last_delta": None, "error": None}
+
+# Rows scored at a time for float16 matrices (converted to float32 block by block)
+SCORE_BLOCK = 65536
+# Below this share of rows passing the filters, gather and score only those rows
+GATHER_RATIO = 0.5
+MIN_SCORE = 0.15  # minimum relevance threshold
+SIMILAR_MIN_SCORE = 0.5  # image-to-image similarities run much higher than text-to-image ones
 
 # CLIP model (lazy loaded)
+MODEL_NAME = config.CLIP_MODEL
+PRETRAINED = config.CLIP_PRETRAINED
+MODEL_KEY = f"{MODEL_NAME}/{PRETRAINED}"  # text cache entries are per model
+ENCODE_BATCH = 64  # prompts per text transformer forward pass
 _clip_model = None
 _clip_tokenizer = None
 _model_lock = threading.Lock()
+_sidecar_error = None  # last reason the sidecar could not be used, for the stats
+
+
+def _text_state_dict(path):
+    """Checkpoint weights minus the image tower (visual.*), read without loading the rest."""
+    import torch
+
+    if path.endswith(".safetensors"):
+        from safetensors import safe_open
+        with safe_open(path, framework="pt") as f:
+            return {k: f.get_tensor(k) for k in f.keys() if not k.startswith("visual.")}
+    # mmap: the pages of the skipped visual tensors are never read
+    state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    state = state.get("state_dict", state)
+    state = {k[7:] if k.startswith("module.") else k: v for k, v in state.items()}
+    return {k: v for k, v in state.items() if not k.startswith("visual.")}
+
+
+def _load_text_model(open_clip):
+    """CLIP with its image tower dropped before the checkpoint is read.
+
+    The dashboard only encodes text: the ViT-B-32 image tower is ~88M of the
+    ~151M parameters. Returns (model, visual MB skipped).
+    """
+    model = open_clip.create_model(MODEL_NAME, pretrained=None)
+    visual_mb = sum(p.numel() * p.element_size() for p in model.visual.parameters()) / 1024 / 1024
+    model.visual = None
+    path = open_clip.download_pretrained(open_clip.get_pretrained_cfg(MODEL_NAME, PRETRAINED))
+    missing, _unexpected = model.load_state_dict(_text_state_dict(str(path)), strict=False)
+    if missing:
+        raise RuntimeError(f"text weights missing from {path}: {', '.join(missing[:5])}")
+    return model.eval(), visual_mb
 
 
 def _load_model():
-    """Lazy-load CLIP model for text encoding only."""
+    """Lazy-load CLIP model for text encoding only (text tower alone with CLIP_TEXT_ONLY)."""
     global _clip_model, _clip_tokenizer
     if _clip_model is not None:
         return
@@ -26,94 +121,823 @@ def _load_model():
     with _model_lock:
         if _clip_model is not None:
             return
+        import gc
         import open_clip
+        import psutil
         print("[CLIP Search] Loading model...")
-        _clip_model, _, _ = open_clip.create_model_and_transforms(
-            "ViT-B-32", pretrained="laion2b_s34b_b79k"
-        )
+        start, rss = time.time(), psutil.Process().memory_info().rss
+        model, skipped = None, 0
+        if config.CLIP_TEXT_ONLY:
+            try:
+                model, skipped = _load_text_model(open_clip)
+            except Exception as e:
+                print(f"[CLIP Search] Text-only loading failed ({e}), loading the full model")
+        if model is None:
+            model, _, _ = open_clip.create_model_and_transforms(MODEL_NAME, pretrained=PRETRAINED)
+            model.eval()
+        gc.collect()
         _clip_tokenizer = open_clip.tokenize
-        print("[CLIP Search] Model ready")
+        _clip_model = model
+        print(f"[CLIP Search] Model ready in {time.time() - start:.1f}s, "
+              f"RSS +{(psutil.Process().memory_info().rss - rss) / 1024 / 1024:.0f} MB"
+              + (f" (image tower skipped: {skipped:.0f} MB)" if skipped else ""))
+
+
+def _meta_path():
+    return os.path.join(config.CLIP_INDEX_DIR, "meta.json")
+
+
+def _read_meta():
+    with open(_meta_path()) as f:
+        return json.load(f)
+
+
+def _write_meta(meta):
+    tmp = _meta_path() + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, _meta_path())
+
+
+def _remove_unreferenced(meta):
+    """Unlink files of previous generations (processes still mapping them keep their pages)."""
+    keep = {meta.get(k) for k in ("embeddings", "ids", "delta_embeddings", "delta_ids")}
+    keep.update((meta.get("columns") or {}).values())
+    keep.update((meta.get("delta_columns") or {}).values())
+    keep.update((meta.get("ann") or {}).get("files", {}).values())
+    for name in os.listdir(config.CLIP_INDEX_DIR):
+        if (name.endswith(".npy") or name.startswith("ann-")) and name not in keep:
+            os.remove(os.path.join(config.CLIP_INDEX_DIR, name))
+
+
+class _build_lock:
+    """Cross-process lock serialising builds and refreshes. acquired is False when
+    blocking=False and another process holds it."""
+
+    def __init__(self, blocking=True):
+        self.blocking = blocking
+        self.acquired = False
+
+    def __enter__(self):
+        os.makedirs(config.CLIP_INDEX_DIR, exist_ok=True)
+        self.fd = os.open(os.path.join(config.CLIP_INDEX_DIR, ".build.lock"), os.O_CREAT | os.O_RDWR, 0o664)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+            self.acquired = True
+        except BlockingIOError:
+            pass
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.acquired:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        return False
+
 
+def _normalize_rows(block):
+    norms = np.linalg.norm(block, axis=1)
+    keep = norms > 0
+    return block[keep] / norms[keep, None], keep
 
-def _load_embeddings():
-    """Load all photo embeddings from DB into RAM cache."""
-    global _embeddings_cache, _cache_time
 
-    with _cache_lock:
-        if _embeddings_cache is not None and (time.time() - _cache_time) < CACHE_TTL:
-            return _embeddings_cache
+def _fetch_embeddings(since=None, batch_size=5000, space=0):
+    """Yield (ids, float32 matrix, max updated_at, columns) batches of valid embeddings from PostgreSQL.
 
-    print("[CLIP Search] Loading embeddings cache...")
-    embeddings = {}
+    columns: {"dates": datetime64[s] (NaT when unknown), "gps": bool, "cameras": model names}.
+    space: projection id the rows must be encoded with (0: full-size vectors); rows
+    of another space (half-way through migrate_embeddings.py) are skipped.
+
+    since: only rows with updated_at >= since (the watermark is inclusive, patching
+    a row twice is harmless). A named (server-side) cursor streams the rows, so the
+    whole table never sits in Python memory at once.
+    """
+    conn = db.get_conn()
+    try:
+        with conn.cursor(name="clip_index") as cur:
+            cur.itersize = batch_size
+            cur.execute(f"""
+                SELECT id, clip_embedding, updated_at, date_taken, latitude IS NOT NULL, camera_model
+                FROM photos
+                WHERE clip_embedding IS NOT NULL AND length(clip_embedding) > 0
+                {"AND updated_at >= %s" if since else ""}
+                ORDER BY id
+            """, (since,) if since else None)
+            dim = None
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                ids, vectors, newest = [], [], None
+                dates, gps, cameras = [], [], []
+                for photo_id, emb_bytes, updated_at, date_taken, has_gps, camera in rows:
+                    emb, projection_id = embedding_codec.decode(emb_bytes)
+                    # Rows of another projection space (mid-migration, or left reduced) do not set dim
+                    if projection_id != space:
+                        continue
+                    dim = dim or len(emb)
+                    if len(emb) != dim:
+                        continue
+                    ids.append(photo_id)
+                    vectors.append(emb)
+                    dates.append(date_taken)
+                    gps.append(has_gps)
+                    cameras.append(camera)
+                    if updated_at is not None and (newest is None or updated_at > newest):
+                        newest = updated_at
+                if ids:
+                    columns = {
+                        "dates": np.array([d or "NaT" for d in dates], dtype="datetime64[s]"),
+                        "gps": np.array(gps, dtype=bool),
+                        "cameras": np.array(cameras, dtype=object),
+                    }
+                    yield np.asarray(ids, dtype=np.int64), np.vstack(vectors), newest, columns
+        conn.commit()
+    finally:
+        db.put_conn(conn)
+
+
+def _collect(since, dtype, space=0):
+    """Fetch and normalise embeddings. Returns (ids sorted, matrix, watermark iso or None, columns)."""
+    id_blocks, matrix_blocks, column_blocks, watermark = [], [], [], None
+    for ids, block, newest, columns in _fetch_embeddings(since, space=space):
+        block, keep = _normalize_rows(block)
+        id_blocks.append(ids[keep])
+        matrix_blocks.append(block.astype(dtype))
+        column_blocks.append({name: col[keep] for name, col in columns.items()})
+        if newest is not None and (watermark is None or newest > watermark):
+            watermark = newest
+    if not id_blocks:
+        return np.zeros(0, dtype=np.int64), None, None, None
+    ids = np.concatenate(id_blocks)
+    matrix = np.vstack(matrix_blocks)
+    columns = {name: np.concatenate([c[name] for c in column_blocks]) for name in COLUMNS}
+    return ids, matrix, watermark.isoformat() if watermark else None, columns
+
+
+def _encode_cameras(columns, meta):
+    """Replace camera model names by int32 codes into meta["cameras"] (append-only, -1 = unknown)."""
+    cameras = meta.setdefault("cameras", [])
+    codes = {name: i for i, name in enumerate(cameras)}
+    encoded = np.full(len(columns["cameras"]), -1, dtype=np.int32)
+    for i, name in enumerate(columns["cameras"]):
+        if name is None:
+            continue
+        if name not in codes:
+            codes[name] = len(cameras)
+            cameras.append(name)
+        encoded[i] = codes[name]
+    columns["cameras"] = encoded
+    return columns
+
+
+def _empty_columns():
+    return {"dates": np.zeros(0, dtype="datetime64[s]"), "gps": np.zeros(0, dtype=bool),
+            "cameras": np.zeros(0, dtype=np.int32)}
+
+
+def _save_columns(prefix, generation, columns):
+    names = {}
+    for name in COLUMNS:
+        names[name] = f"{prefix}{name}-{generation}.npy"
+        np.save(os.path.join(config.CLIP_INDEX_DIR, names[name]), columns[name])
+    return names
+
+
+def build_index(dtype=None, retrain=False):
+    """Write a new index generation from PostgreSQL and make it current. Returns its meta.
+
+    Readers switch to the new generation on their next meta.json check; previous
+    files are unlinked (open maps stay valid). retrain: recompute the IVF centroids
+    instead of reusing the previous generation's.
+    """
+    dtype = np.dtype(dtype or config.CLIP_INDEX_DTYPE)
+    with _build_lock():
+        return _build(dtype, retrain)
+
+
+def _build(dtype, retrain=False):
+    start = time.time()
+    try:
+        previous_ann = _read_meta().get("ann")
+    except FileNotFoundError:
+        previous_ann = None
+    generation = f"{int(start * 1000):x}"
+    space = _index_space()
+    ids, matrix, watermark, columns = _collect(None, dtype, space)
+    if matrix is None:
+        matrix, columns = np.zeros((0, 0), dtype=dtype), _empty_columns()
+    meta = {"cameras": []}
+    _encode_cameras(columns, meta)
+
+    emb_name, ids_name = f"embeddings-{generation}.npy", f"ids-{generation}.npy"
+    np.save(os.path.join(config.CLIP_INDEX_DIR, emb_name), np.ascontiguousarray(matrix))
+    np.save(os.path.join(config.CLIP_INDEX_DIR, ids_name), ids)
+    meta.update({
+        "format": INDEX_FORMAT,
+        "generation": generation,
+        "embeddings": emb_name,
+        "ids": ids_name,
+        "columns": _save_columns("", generation, columns),
+        "count": int(len(ids)),
+        "dim": int(matrix.shape[1]),
+        "dtype": dtype.name,
+        "projection": space,
+        "watermark": watermark,
+        "built_at": time.time(),
+        "build_seconds": round(time.time() - start, 1),
+        "refreshed_at": time.time(),
+        "delta_count": 0,
+        "last_delta": 0,
+        "ann": None,
+    })
+    if config.CLIP_ANN_BACKEND and len(ids) >= config.CLIP_ANN_MIN_ROWS:
+        meta["ann"] = _build_ann(_map(emb_name), generation, previous_ann, retrain)
+    _write_meta(meta)
+    _remove_unreferenced(meta)
+    return meta
+
+
+def _index_space():
+    """Projection id of the active CLIP embedding format (0: full-size vectors)."""
     with db_cursor() as cur:
-        cur.execute("""
-            SELECT id, clip_embedding FROM photos
-            WHERE clip_embedding IS NOT NULL AND length(clip_embedding) > 0
-        """)
-        for photo_id, emb_bytes in cur.fetchall():
+        _, projection = embedding_codec.active_format(cur, "clip")
+    return projection.id if projection is not None else 0
+
+
+def _build_ann(matrix, generation, previous, retrain):
+    """ANN index of a new base generation, with its recall@k against exact scoring."""
+    entry = clip_ann.build(config.CLIP_ANN_BACKEND, matrix, generation, previous, retrain)
+    entry["recall_k"] = 50
+    entry["recall"] = clip_ann.recall_at_k(clip_ann.load(entry, matrix), matrix, k=entry["recall_k"])
+    print(f"[CLIP Search] {entry['backend']} index built in {entry['build_seconds']}s, "
+          f"recall@{entry['recall_k']} {entry['recall']}")
+    return entry
+
+
+def refresh_index(blocking=True):
+    """Fold rows changed since the watermark into the delta. Returns the number of rows fetched.
+
+    Falls back to a full build once the delta outgrows CLIP_DELTA_MAX_ROWS. With
+    blocking=False, returns None right away if another process holds the build lock.
+    """
+    with _build_lock(blocking) as lock:
+        if not lock.acquired:
+            return None
+        if not os.path.exists(_meta_path()) or _read_meta().get("format") != INDEX_FORMAT:
+            _build(np.dtype(config.CLIP_INDEX_DTYPE))
+            return 0
+        if _read_meta().get("projection", 0) != _index_space():
+            # migrate_embeddings.py switched the PCA projection: rows live in a new space
+            _build(np.dtype(config.CLIP_INDEX_DTYPE))
+            return 0
+        return _refresh()
+
+
+def _current_rows(meta, ids, dim):
+    """Rows and filter columns the index holds now for ids (delta wins over base), and a found mask."""
+    current = np.zeros((len(ids), dim), dtype=np.dtype(meta["dtype"]))
+    columns = {name: np.zeros(len(ids), dtype=col.dtype) for name, col in _empty_columns().items()}
+    found = np.zeros(len(ids), dtype=bool)
+    for ids_key, emb_key, cols_key in (("ids", "embeddings", "columns"),
+                                       ("delta_ids", "delta_embeddings", "delta_columns")):
+        if not meta.get(ids_key):
+            continue
+        held = _map(meta[ids_key])
+        if not len(held):
+            continue
+        pos = np.clip(np.searchsorted(held, ids), 0, len(held) - 1)
+        hit = held[pos] == ids
+        if hit.any():
+            current[hit] = _map(meta[emb_key])[pos[hit]]
+            for name, col in columns.items():
+                col[hit] = _map(meta[cols_key][name])[pos[hit]]
+            found |= hit
+    return current, columns, found
+
+
+def _columns_differ(current, fetched):
+    dates_a, dates_b = current["dates"], fetched["dates"]
+    same_date = (dates_a == dates_b) | (np.isnat(dates_a) & np.isnat(dates_b))
+    return ~same_date | (current["gps"] != fetched["gps"]) | (current["cameras"] != fetched["cameras"])
+
+
+def _refresh():
+    meta = _read_meta()
+    dtype = np.dtype(meta["dtype"])
+    # Look back CLIP_REFRESH_OVERLAP before the watermark: updated_at is the writer's
+    # transaction start, so a batch can commit after rows stamped later than it
+    since = None
+    if meta.get("watermark"):
+        since = (datetime.fromisoformat(meta["watermark"])
+                 - timedelta(seconds=config.CLIP_REFRESH_OVERLAP)).isoformat()
+    ids, matrix, watermark, columns = _collect(since, dtype, meta.get("projection", 0))
+    if len(ids) == 0:
+        return 0
+    _encode_cameras(columns, meta)
+
+    # Keep only rows that are new or differ from what the index already serves
+    # (EXIF re-extraction moves updated_at too, and may change the filter columns)
+    current, current_columns, found = _current_rows(meta, ids, matrix.shape[1])
+    changed = (~found | ~np.all(np.isclose(current, matrix, atol=1e-3), axis=1)
+               | _columns_differ(current_columns, columns))
+    ids, matrix = ids[changed], matrix[changed]
+    columns = {name: col[changed] for name, col in columns.items()}
+    fetched = len(ids)
+    if watermark and (not meta.get("watermark") or watermark > meta["watermark"]):
+        meta["watermark"] = watermark
+    if fetched == 0:
+        _write_meta_if_watermark_moved(meta)
+        return 0
+
+    # Merge with the current delta, newest rows winning
+    if meta.get("delta_ids"):
+        old_ids = np.load(os.path.join(config.CLIP_INDEX_DIR, meta["delta_ids"]))
+        old_matrix = np.load(os.path.join(config.CLIP_INDEX_DIR, meta["delta_embeddings"]))
+        keep = ~np.isin(old_ids, ids)
+        ids = np.concatenate([old_ids[keep], ids])
+        matrix = np.vstack([old_matrix[keep], matrix])
+        columns = {name: np.concatenate([np.load(os.path.join(config.CLIP_INDEX_DIR,
+                                                              meta["delta_columns"][name]))[keep], col])
+                   for name, col in columns.items()}
+    order = np.argsort(ids)
+    ids, matrix = ids[order], matrix[order]
+    columns = {name: col[order] for name, col in columns.items()}
+
+    if len(ids) > config.CLIP_DELTA_MAX_ROWS:
+        _build(dtype)
+        return fetched
+
+    generation = f"{int(time.time() * 1000):x}"
+    meta["delta_embeddings"] = f"delta-embeddings-{generation}.npy"
+    meta["delta_ids"] = f"delta-ids-{generation}.npy"
+    np.save(os.path.join(config.CLIP_INDEX_DIR, meta["delta_embeddings"]), np.ascontiguousarray(matrix))
+    np.save(os.path.join(config.CLIP_INDEX_DIR, meta["delta_ids"]), ids)
+    meta["delta_columns"] = _save_columns("delta-", generation, columns)
+    meta["delta_count"] = int(len(ids))
+    meta["last_delta"] = int(fetched)
+    meta["refreshed_at"] = time.time()
+    _write_meta(meta)
+    _remove_unreferenced(meta)
+    return fetched
+
+
+def _write_meta_if_watermark_moved(meta):
+    # Rewriting meta.json makes every worker remap: only do it when something changed
+    if meta.get("watermark") != _read_meta().get("watermark"):
+        _write_meta(meta)
+
+
+def _refresh_loop():
+    while True:
+        # With events flowing, the periodic refresh is only a fallback
+        if _refresh_wake.wait(events.cache_ttl(config.CLIP_REFRESH_INTERVAL)):
+            time.sleep(config.CLIP_REFRESH_DEBOUNCE)  # let the writer's next batches land too
+        _refresh_wake.clear()
+        try:
+            # None: another worker (or build_clip_index.py) is on it, its result shows up in meta.json
+            fetched = refresh_index(blocking=False)
+            if fetched is not None:
+                _refresh_state["last_delta"] = fetched
+                _refresh_state["checked_at"] = time.time()
+            _refresh_state["error"] = None
+        except Exception as e:
+            _refresh_state["error"] = str(e)
+            print(f"[CLIP Search] Refresh failed: {e}")
+
+
+def _ensure_refresher():
+    global _refresher
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = threading.Thread(target=_refresh_loop, name="clip-index-refresh", daemon=True)
+        _refresher.start()
+
+
+def _map(name):
+    return np.load(os.path.join(config.CLIP_INDEX_DIR, name), mmap_mode="r")
+
+
+def _load_index():
+    """Return the current memory-mapped index, remapping when meta.json changed."""
+    global _index, _index_mtime, _index_checked
+    now = time.time()
+    with _index_lock:
+        if _index is not None and now - _index_checked < INDEX_CHECK_INTERVAL:
+            return _index
+        _index_checked = now
+        try:
+            mtime = os.stat(_meta_path()).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if _index is not None and mtime == _index_mtime:
+            return _index
+
+        if mtime is None or _read_meta().get("format") != INDEX_FORMAT:
+            # Only ever happens once per installation (and format change); refreshes run in the background
+            print("[CLIP Search] No index yet, building it...")
+            build_index()
+            mtime = os.stat(_meta_path()).st_mtime
+
+        meta = _read_meta()
+        index = {"ids": _map(meta["ids"]), "matrix": _map(meta["embeddings"]), "meta": meta,
+                 "columns": {name: _map(f) for name, f in meta["columns"].items()},
+                 "delta_ids": None, "delta_matrix": None, "delta_columns": None,
+                 "shadowed": None, "ann": None, "projection": None,
+                 "camera_codes": {name: i for i, name in enumerate(meta.get("cameras", []))}}
+        if meta.get("delta_ids"):
+            index["delta_ids"] = _map(meta["delta_ids"])
+            index["delta_matrix"] = _map(meta["delta_embeddings"])
+            index["delta_columns"] = {name: _map(f) for name, f in meta["delta_columns"].items()}
+            # Base rows superseded by the delta (re-analysed photos)
+            index["shadowed"] = np.flatnonzero(np.isin(index["ids"], index["delta_ids"]))
+        if meta.get("projection"):
+            with db_cursor() as cur:
+                index["projection"] = embedding_codec.load_projection(cur, meta["projection"])
+        ann = meta.get("ann")
+        if ann and ann["backend"] == config.CLIP_ANN_BACKEND:
             try:
-                emb = np.frombuffer(bytes(emb_bytes), dtype=np.float32)
-                if len(emb) > 0:
-                    norm = np.linalg.norm(emb)
-                    if norm > 0:
-                        embeddings[photo_id] = emb / norm
-            except Exception:
-                pass
+                index["ann"] = clip_ann.load(ann, index["matrix"])
+            except (ImportError, OSError) as e:
+                print(f"[CLIP Search] {ann['backend']} index unavailable, exact scoring: {e}")
+        _index = index
+        _index_mtime = mtime
+        print(f"[CLIP Search] Mapped {meta['count']} embeddings + {meta.get('delta_count', 0)} delta "
+              f"({meta['dtype']})")
+    _ensure_refresher()
+    return _index
 
-    with _cache_lock:
-        _embeddings_cache = embeddings
-        _cache_time = time.time()
 
-    print(f"[CLIP Search] Cached {len(embeddings)} embeddings")
-    return embeddings
+def score_all(matrix, query_vec):
+    """Cosine similarity of every row with the query (both normalised), as float32."""
+    query_vec = query_vec.astype(np.float32)
+    if matrix.dtype == np.float32:
+        return matrix @ query_vec
+    # numpy has no BLAS path for float16: widen block by block
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK):
+        block = matrix[start:start + SCORE_BLOCK]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query_vec
+    return scores
 
 
-def search_by_text(query, limit=50):
-    """Search photos by text query using CLIP cosine similarity.
+def top_k(scores, k):
+    """Indices of the k highest scores, best first, without sorting the whole array."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+    return part[np.argsort(scores[part])[::-1]]
+
+
+def _members(kind, value, source=None):
+    """Sorted ids of the photos with a tag, a face or a filename match, cached MEMBER_CACHE_TTL seconds."""
+    key = (kind, value, source)
+    now = time.time()
+    with _member_lock:
+        cached = _member_cache.get(key)
+        if cached and now - cached[0] < events.cache_ttl(MEMBER_CACHE_TTL):
+            return cached[1]
+
+    with db_cursor() as cur:
+        if kind == "tag":
+            cur.execute(
+                "SELECT DISTINCT photo_id FROM photo_tags WHERE tag = %s"
+                + (" AND source = %s" if source else ""),
+                (value, source) if source else (value,),
+            )
+        elif kind == "face":
+            cur.execute("SELECT DISTINCT photo_id FROM photo_faces WHERE face_id = %s", (value,))
+        else:
+            cur.execute("SELECT id FROM photos WHERE filename ILIKE %s", (f"%{value}%",))
+        ids = np.sort(np.fromiter((row[0] for row in cur.fetchall()), dtype=np.int64))
+
+    with _member_lock:
+        if len(_member_cache) >= MEMBER_CACHE_SIZE:
+            _member_cache.pop(min(_member_cache, key=lambda k: _member_cache[k][0]))
+        _member_cache[key] = (now, ids)
+    return ids
+
+
+def _drop_members(kind, value=None):
+    """Forget the cached member sets of kind (all of them when value is None)."""
+    with _member_lock:
+        for key in [k for k in _member_cache if k[0] == kind and (value is None or k[1] == value)]:
+            del _member_cache[key]
+
+
+def _on_tags(data):
+    _drop_members("tag", (data or {}).get("tag"))
+
+
+def _on_faces(data):
+    face_ids = (data or {}).get("face_ids")
+    if face_ids is None:
+        _drop_members("face")
+    for face_id in face_ids or ():
+        _drop_members("face", face_id)
+
+
+def _on_photos(data):
+    _drop_members("filename")
+    _refresh_wake.set()
+
+
+def _on_embeddings(data):
+    _refresh_wake.set()
+
+
+events.subscribe("tags", _on_tags)
+events.subscribe("faces", _on_faces)
+events.subscribe("photos", _on_photos)
+events.subscribe("embeddings", _on_embeddings)
+
+
+def _in_sorted(ids, members):
+    """Boolean mask of ids found in the sorted members array."""
+    if not len(members):
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.clip(np.searchsorted(members, ids), 0, len(members) - 1)
+    return members[pos] == ids
+
 
-    Returns list of {"photo_id": int, "score": float} sorted by score desc.
+def _filter_mask(index, ids, columns, filters):
+    """Rows of one part (base or delta) passing photo_service.search_photos-style filters.
+
+    filters: {"tag", "source", "date_from", "date_to", "camera", "face_id", "filename",
+    "has_gps"}, falsy values ignored. Dates are YYYY-MM-DD (ValueError otherwise).
+    """
+    mask = np.ones(len(ids), dtype=bool)
+    if filters.get("date_from"):
+        mask &= columns["dates"] >= np.datetime64(filters["date_from"], "D")
+    if filters.get("date_to"):
+        # Inclusive day, like "<= date_to 23:59:59" in SQL; NaT compares False both ways
+        mask &= columns["dates"] < np.datetime64(filters["date_to"], "D") + np.timedelta64(1, "D")
+    if filters.get("camera"):
+        mask &= columns["cameras"] == index["camera_codes"].get(filters["camera"], -2)
+    if filters.get("has_gps"):
+        mask &= columns["gps"]
+    if filters.get("tag"):
+        mask &= _in_sorted(ids, _members("tag", filters["tag"], filters.get("source")))
+    if filters.get("face_id"):
+        mask &= _in_sorted(ids, _members("face", filters["face_id"]))
+    if filters.get("filename"):
+        mask &= _in_sorted(ids, _members("filename", filters["filename"]))
+    return mask
+
+
+def _score_rows(ids, matrix, mask, query_vec):
+    """(ids, scores) of the rows passing mask (None = all rows)."""
+    if mask is None:
+        return ids, score_all(matrix, query_vec)
+    if mask.mean() < GATHER_RATIO:
+        # Selective filters: only read the matching rows
+        positions = np.flatnonzero(mask)
+        return ids[positions], score_all(matrix[positions], query_vec)
+    return ids[mask], score_all(matrix, query_vec)[mask]
+
+
+def _positions(ids, wanted):
+    """Positions in the sorted ids array of the wanted photo ids that it holds."""
+    if not len(ids) or not len(wanted):
+        return np.zeros(0, dtype=np.int64)
+    pos = np.clip(np.searchsorted(ids, wanted), 0, len(ids) - 1)
+    return pos[ids[pos] == wanted]
+
+
+def search_vector(query_vec, limit=50, min_score=MIN_SCORE, filters=None, offset=0, exclude=None):
+    """Photos most similar to a normalised query vector, best first.
+
+    filters: see _filter_mask; they restrict the rows scored, so ranking and
+    filtering are one pass over the mapped matrix. exclude: photo ids left out
+    of the results (the query photos of a similarity search). Returns
+    ([(photo_id, score)] for ranks offset..offset+limit, total), total being the
+    number of photos passing the filters and min_score, or None when the ANN
+    index or pgvector answered (they only see their candidates).
+    """
+    query_vec = query_vec.astype(np.float32)
+    filters = {k: v for k, v in (filters or {}).items() if v}
+    exclude = np.sort(np.asarray(exclude if exclude is not None else [], dtype=np.int64))
+    k = offset + limit
+    if config.EMBEDDING_STORAGE == "pgvector":
+        return clip_pgvector.search(query_vec, k, min_score, filters, exclude)[offset:k], None
+
+    index = _load_index()
+    # Base rows never returned: superseded by the delta, or excluded
+    hidden = _positions(index["ids"], exclude)
+    if index["shadowed"] is not None:
+        hidden = np.concatenate([index["shadowed"], hidden])
+    parts, total = [], 0
+
+    if index["ann"] is not None and not filters:
+        # Candidates from the ANN index, over-fetched to make up for hidden rows
+        positions, scores = index["ann"].search(query_vec, k + min(len(hidden), k))
+        keep = ~np.isin(positions, hidden)
+        parts.append((index["ids"][positions[keep]], scores[keep]))
+        total = None
+    elif len(index["ids"]):
+        mask = _filter_mask(index, index["ids"], index["columns"], filters) if filters else None
+        if len(hidden):
+            if mask is None:
+                mask = np.ones(len(index["ids"]), dtype=bool)
+            mask[hidden] = False
+        parts.append(_score_rows(index["ids"], index["matrix"], mask, query_vec))
+    if index["delta_ids"] is not None and len(index["delta_ids"]):
+        mask = (_filter_mask(index, index["delta_ids"], index["delta_columns"], filters)
+                if filters else None)
+        excluded = _positions(index["delta_ids"], exclude)
+        if len(excluded):
+            if mask is None:
+                mask = np.ones(len(index["delta_ids"]), dtype=bool)
+            mask[excluded] = False
+        parts.append(_score_rows(index["delta_ids"], index["delta_matrix"], mask, query_vec))
+
+    results = []
+    for ids, scores in parts:
+        above = scores > min_score
+        if total is not None:
+            total += int(above.sum())
+        results += [(int(ids[i]), float(scores[i])) for i in top_k(scores, k) if above[i]]
+    results.sort(key=lambda r: r[1], reverse=True)
+    return results[offset:k], total
+
+
+def encode_texts(prompts):
+    """Normalised CLIP text embeddings of prompts, as a (len(prompts), dim) float32 matrix.
+
+    Cached prompts (LRU, then the shared store) skip the model; the others are
+    encoded together, ENCODE_BATCH per forward pass.
     """
+    keys = [clip_text_cache.normalize_prompt(p) for p in prompts]
+    vectors = clip_text_cache.get_many(MODEL_KEY, list(dict.fromkeys(keys)))
+    missing = [k for k in dict.fromkeys(keys) if k not in vectors]
+    if missing:
+        encoded = _encode_missing(missing)
+        clip_text_cache.put_many(MODEL_KEY, encoded)
+        vectors.update(encoded)
+    return np.vstack([vectors[k] for k in keys])
+
+
+def _encode_missing(prompts):
+    """{prompt: vector} from the sidecar when it answers, else from the in-process model."""
+    global _sidecar_error
+    if config.CLIP_SIDECAR_SOCKET:
+        try:
+            encoded = dict(zip(prompts, clip_client.encode_texts(prompts)))
+            _sidecar_error = None
+            return encoded
+        except clip_client.SidecarUnavailable as e:
+            if _sidecar_error is None:
+                print(f"[CLIP Search] Sidecar unavailable ({e}), encoding in-process")
+            _sidecar_error = str(e)
+
     import torch
 
     _load_model()
-    embeddings = _load_embeddings()
+    encoded = {}
+    for start in range(0, len(prompts), ENCODE_BATCH):
+        batch = prompts[start:start + ENCODE_BATCH]
+        with torch.no_grad():
+            features = _clip_model.encode_text(_clip_tokenizer(batch))
+            features /= features.norm(dim=-1, keepdim=True)
+        encoded.update(zip(batch, features.cpu().numpy().astype(np.float32)))
+    return encoded
 
-    if not embeddings:
-        return []
 
-    # Encode text query
-    tokens = _clip_tokenizer([query])
-    with torch.no_grad():
-        text_features = _clip_model.encode_text(tokens)
-        text_features /= text_features.norm(dim=-1, keepdim=True)
+def text_query_vector(query, negatives=None):
+    """Query vector for a text search: the CLIP_PROMPT_TEMPLATES ensemble of query,
+    minus CLIP_NEGATIVE_WEIGHT times the ensemble of the negative prompts."""
+    negatives = [n for n in (negatives or []) if n.strip()]
+    templates = config.CLIP_PROMPT_TEMPLATES
+    prompts = [t.format(text) for text in [query] + negatives for t in templates]
+    vectors = encode_texts(prompts)
+    query_vec = vectors[:len(templates)].mean(axis=0)
+    if negatives:
+        query_vec = query_vec - config.CLIP_NEGATIVE_WEIGHT * vectors[len(templates):].mean(axis=0)
+    return query_vec / np.linalg.norm(query_vec)
 
-    query_vec = text_features.squeeze(0).cpu().numpy().astype(np.float32)
 
-    # Compute cosine similarity with all photos
-    photo_ids = list(embeddings.keys())
-    emb_matrix = np.stack([embeddings[pid] for pid in photo_ids])
+def warm_text_cache(prompts):
+    """Encode the prompts not cached yet (with every template). Returns how many were encoded."""
+    prompts = [t.format(p) for p in prompts for t in config.CLIP_PROMPT_TEMPLATES]
+    keys = list(dict.fromkeys(clip_text_cache.normalize_prompt(p) for p in prompts))
+    # Not through encode_texts: the vocabulary would show up in the hit/miss counters of the queries
+    cached = clip_text_cache.get_many(MODEL_KEY, keys, count=False)
+    missing = [k for k in keys if k not in cached]
+    if missing:
+        clip_text_cache.put_many(MODEL_KEY, _encode_missing(missing))
+    return len(missing)
 
-    scores = emb_matrix @ query_vec  # cosine similarity (both normalized)
 
-    # Sort by score descending
-    top_indices = np.argsort(scores)[::-1][:limit]
+def _to_index_space(query_vec):
+    """A full-size query vector projected like the index rows (when they are PCA-reduced)."""
+    if config.EMBEDDING_STORAGE == "pgvector":
+        return query_vec
+    projection = _load_index()["projection"]
+    if projection is None:
+        return query_vec
+    query_vec = projection.apply(query_vec)
+    return query_vec / np.linalg.norm(query_vec)
 
-    results = []
-    for idx in top_indices:
-        score = float(scores[idx])
-        if score > 0.15:  # minimum relevance threshold
-            results.append({
-                "photo_id": photo_ids[idx],
-                "score": round(score, 4),
-            })
 
-    return results
+def search_by_text(query, limit=50, filters=None, offset=0, negatives=None):
+    """Search photos by text query using CLIP cosine similarity.
+
+    negatives: prompts steering away from ("lac" without "bateau").
+    Returns ([{"photo_id": int, "score": float}] sorted by score desc, total);
+    see search_vector for filters, offset and total.
+    """
+    query_vec = _to_index_space(text_query_vector(query, negatives))
+    results, total = search_vector(query_vec, limit, filters=filters, offset=offset)
+    return [{"photo_id": pid, "score": round(score, 4)} for pid, score in results], total
+
+
+def photo_vector(photo_ids):
+    """Normalised mean of the stored embeddings of photo_ids (delta rows win), or None if none is indexed."""
+    wanted = np.unique(np.asarray(photo_ids, dtype=np.int64))
+    if config.EMBEDDING_STORAGE == "pgvector":
+        vectors = clip_pgvector.photo_vectors(wanted)
+    else:
+        index = _load_index()
+        vectors, found = [], np.zeros(0, dtype=np.int64)
+        if index["delta_ids"] is not None:
+            pos = _positions(index["delta_ids"], wanted)
+            vectors.append(np.asarray(index["delta_matrix"][pos], dtype=np.float32))
+            found = index["delta_ids"][pos]
+        pos = _positions(index["ids"], np.setdiff1d(wanted, found))
+        vectors.append(np.asarray(index["matrix"][pos], dtype=np.float32))
+        vectors = np.vstack(vectors)
+    if not len(vectors):
+        return None
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vec = vectors.sum(axis=0)
+    norm = np.linalg.norm(query_vec)
+    return query_vec / norm if norm > 0 else None
+
+
+def search_similar(photo_ids, limit=50, min_score=SIMILAR_MIN_SCORE, filters=None, offset=0):
+    """Photos that look like the given ones, using their stored embeddings as the query.
+
+    No model and no image decode: the query is the mean of the indexed vectors.
+    Returns ([{"photo_id", "score"}], total) like search_by_text, without the query
+    photos themselves, or (None, None) when none of them has an embedding.
+    """
+    query_vec = photo_vector(photo_ids)
+    if query_vec is None:
+        return None, None
+    results, total = search_vector(query_vec, limit, min_score, filters, offset, exclude=photo_ids)
+    return [{"photo_id": pid, "score": round(score, 4)} for pid, score in results], total
+
+
+def _encoder_stats():
+    """Where text queries get encoded: the sidecar (with its batching metrics) or this process."""
+    if config.CLIP_SIDECAR_SOCKET:
+        try:
+            return {"mode": "sidecar", "sidecar": clip_client.stats()}
+        except clip_client.SidecarUnavailable as e:
+            return {"mode": "in-process", "sidecar_error": str(e), "model_loaded": _clip_model is not None}
+    return {"mode": "in-process", "model_loaded": _clip_model is not None}
 
 
 def get_search_stats():
-    """Return cache statistics."""
-    embeddings = _load_embeddings()
+    """Index size, age, last incremental refresh and ANN index (if any), or the pgvector storage."""
+    if config.EMBEDDING_STORAGE == "pgvector":
+        return {
+            "storage": "pgvector",
+            **clip_pgvector.stats(),
+            "text_cache": clip_text_cache.stats(),
+            "encoder": _encoder_stats(),
+            "events": events.stats(),
+        }
+
+    index = _load_index()
+    meta = index["meta"]
+    ann = meta.get("ann")
+    now = time.time()
     return {
-        "cached_embeddings": len(embeddings),
-        "cache_age_seconds": int(time.time() - _cache_time) if _cache_time > 0 else None,
+        "storage": "bytea",
+        "cached_embeddings": meta["count"],
+        "delta_embeddings": meta.get("delta_count", 0),
+        "dtype": meta["dtype"],
+        "dim": meta["dim"],
+        "projection": meta.get("projection") or None,
+        "index_age_seconds": int(now - meta["built_at"]),
+        "refresh_age_seconds": int(now - meta.get("refreshed_at", meta["built_at"])),
+        "last_delta": meta.get("last_delta", 0),
+        "watermark": meta.get("watermark"),
+        "last_check_seconds": (int(now - _refresh_state["checked_at"])
+                               if _refresh_state["checked_at"] else None),
+        "last_check_delta": _refresh_state["last_delta"],
+        "refresh_error": _refresh_state["error"],
+        "text_cache": clip_text_cache.stats(),
+        "encoder": _encoder_stats(),
+        "events": events.stats(),
+        "ann": {
+            "backend": ann["backend"],
+            "active": index["ann"] is not None,
+            "nlist": ann.get("nlist"),
+            "nprobe": config.CLIP_ANN_NPROBE,
+            "recall": ann.get("recall"),
+            "recall_k": ann.get("recall_k"),
+            "build_seconds": ann.get("build_seconds"),
+        } if ann else None,
     }
@@ -0,0 +1,138 @@
+"""Cache of encoded CLIP text queries: prompt -> normalised text embedding.
+
+Lookups go through a bounded in-process LRU, then a small SQLite store shared by
+every worker (config.CLIP_TEXT_STORE), so a prompt encoded once by any process
+(or pre-warmed from the tag vocabulary by build_clip_index.py --warm-text) never
+runs the text transformer again. Entries are keyed by model, so switching
+checkpoints does not serve stale vectors.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import config
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS texts (
+        model TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        vector BLOB NOT NULL,
+        created REAL NOT NULL,
+        PRIMARY KEY (model, prompt)
+    );
+"""
+
+_lru = OrderedDict()  # (model, prompt) -> float32 vector
+_lock = threading.Lock()
+_counts = {"hits": 0, "store_hits": 0, "misses": 0}
+_local = threading.local()
+
+
+def normalize_prompt(prompt):
+    """Cache key of a prompt: the CLIP tokenizer lowercases and collapses whitespace anyway."""
+    return " ".join(prompt.lower().split())
+
+
+def _store_conn():
+    path = config.CLIP_TEXT_STORE
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key == (os.getpid(), path):
+        return conn
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.key = (os.getpid(), path)
+    return conn
+
+
+def _remember(key, vector):
+    # Caller holds _lock
+    _lru[key] = vector
+    _lru.move_to_end(key)
+    while len(_lru) > config.CLIP_TEXT_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+def get_many(model, prompts, count=True):
+    """{prompt: vector} for the (normalised) prompts already encoded; the others are misses.
+
+    count=False leaves the hit/miss counters alone (pre-warming is not query traffic).
+    """
+    found, missing = {}, []
+    with _lock:
+        for prompt in prompts:
+            vector = _lru.get((model, prompt))
+            if vector is None:
+                missing.append(prompt)
+                continue
+            _lru.move_to_end((model, prompt))
+            found[prompt] = vector
+        if count:
+            _counts["hits"] += len(found)
+
+    if missing and config.CLIP_TEXT_STORE:
+        conn = _store_conn()
+        placeholders = ",".join("?" * len(missing))
+        rows = conn.execute(
+            f"SELECT prompt, vector FROM texts WHERE model = ? AND prompt IN ({placeholders})",
+            [model] + missing,
+        ).fetchall()
+        with _lock:
+            for prompt, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float32)
+                found[prompt] = vector
+                _remember((model, prompt), vector)
+            if count:
+                _counts["store_hits"] += len(rows)
+
+    if count:
+        with _lock:
+            _counts["misses"] += len(prompts) - len(found)
+    return found
+
+
+def put_many(model, vectors):
+    """Record freshly encoded {prompt: vector} in the LRU and the shared store."""
+    with _lock:
+        for prompt, vector in vectors.items():
+            _remember((model, prompt), vector)
+    if not vectors or not config.CLIP_TEXT_STORE:
+        return
+
+    now = time.time()
+    conn = _store_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO texts (model, prompt, vector, created) VALUES (?, ?, ?, ?)",
+            [(model, p, np.asarray(v, dtype=np.float32).tobytes(), now) for p, v in vectors.items()],
+        )
+        # Oldest entries go first once the store is full
+        excess = conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0] - config.CLIP_TEXT_STORE_MAX
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM texts WHERE rowid IN (SELECT rowid FROM texts ORDER BY created LIMIT ?)",
+                (excess,),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def stats():
+    """LRU size and hit/miss counters of this process, and the shared store size."""
+    with _lock:
+        result = dict(_counts, cached=len(_lru), capacity=config.CLIP_TEXT_CACHE_SIZE)
+    lookups = result["hits"] + result["store_hits"] + result["misses"]
+    result["hit_ratio"] = round((result["hits"] + result["store_hits"]) / lookups, 3) if lookups else None
+    if config.CLIP_TEXT_STORE and os.path.exists(config.CLIP_TEXT_STORE):
+        result["stored"] = _store_conn().execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+    return result
@@ -22,6 +22,17 @@ def get_pool():
     return _pool
 
 
+def connect():
+    """Standalone connection outside the pool, for long-running background work."""
+    return psycopg2.connect(
+        host=config.PG_HOST,
+        port=config.PG_PORT,
+        dbname=config.PG_DATABASE,
+        user=config.PG_USER,
+        password=config.PG_PASSWORD,
+    )
+
+
 def get_conn():
     return get_pool().getconn()
 
@@ -0,0 +1,150 @@
+"""Compact encodings of the stored embeddings (photos.clip_embedding, faces.embedding).
+
+The same file ships as analysis/scripts/embedding_codec.py: the analysis scripts
+encode with the active format of each kind, the dashboard decodes, and
+dashboard/migrate_embeddings.py re-encodes existing rows and picks the format.
+
+A blob is either the legacy raw float32 vector (no header, still written for
+"float32" without projection) or an 8-byte header (b"EMB", codec, projection
+id, dims) followed by:
+    float32  dims x float32
+    float16  dims x float16
+    int8     float32 scale, then dims x int8 (value = q * scale)
+Projection id 0 means a full-size vector; otherwise the vector was reduced by the
+PCA projection stored under that id in embedding_formats (sql/003_embedding_formats.sql).
+"""
+
+import struct
+import numpy as np
+
+MAGIC = b"EMB"
+CODECS = ("float32", "float16", "int8")
+KINDS = {"clip": ("photos", "clip_embedding"), "face": ("faces", "embedding")}
+_HEADER = struct.Struct("<3sBHH")
+_SCALE = struct.Struct("<f")
+
+
+class Projection:
+    """Uncentred PCA: the top eigenvectors of the vectors' second-moment matrix.
+
+    Without centring, dot products between projected vectors approximate the
+    original ones for any input, text queries included, not only for images.
+    """
+
+    def __init__(self, projection_id, components):
+        self.id = projection_id
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # (dims, input dim)
+
+    @property
+    def dims(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, sample, dims):
+        """Projection keeping the dims main directions of a (rows, dim) sample."""
+        sample = np.asarray(sample, dtype=np.float64)
+        _, vectors = np.linalg.eigh(sample.T @ sample)
+        return cls(0, vectors[:, ::-1][:, :dims].T)
+
+    def apply(self, vectors):
+        """Project one vector or a matrix of row vectors."""
+        return np.asarray(vectors, dtype=np.float32) @ self.components.T
+
+
+def encode(vector, codec="float32", projection=None):
+    """Blob of one embedding, projected first when a projection is given."""
+    vector = np.asarray(vector, dtype=np.float32)
+    projection_id = 0
+    if projection is not None:
+        vector = projection.apply(vector)
+        projection_id = projection.id
+    if codec == "float32" and not projection_id:
+        return vector.tobytes()  # legacy layout, readable by older code
+
+    header = _HEADER.pack(MAGIC, CODECS.index(codec), projection_id, len(vector))
+    if codec == "float32":
+        return header + vector.tobytes()
+    if codec == "float16":
+        return header + vector.astype(np.float16).tobytes()
+    peak = float(np.abs(vector).max())
+    scale = peak / 127 if peak > 0 else 1.0
+    return header + _SCALE.pack(scale) + np.round(vector / scale).astype(np.int8).tobytes()
+
+
+def _body_size(codec, dims):
+    return {0: 4 * dims, 1: 2 * dims, 2: _SCALE.size + dims}.get(codec)
+
+
+def decode(blob):
+    """(float32 vector, projection id) of a stored blob."""
+    blob = bytes(blob)
+    if blob[:3] == MAGIC and len(blob) >= _HEADER.size:
+        _, codec, projection_id, dims = _HEADER.unpack_from(blob)
+        # A legacy float32 vector starting with these bytes would not have this length
+        if len(blob) == _HEADER.size + (_body_size(codec, dims) or -1):
+            body = blob[_HEADER.size:]
+            if codec == 0:
+                vector = np.frombuffer(body, dtype=np.float32).copy()
+            elif codec == 1:
+                vector = np.frombuffer(body, dtype=np.float16).astype(np.float32)
+            else:
+                scale = _SCALE.unpack_from(body)[0]
+                vector = np.frombuffer(body, dtype=np.int8, offset=_SCALE.size).astype(np.float32) * scale
+            return vector, projection_id
+    return np.frombuffer(blob, dtype=np.float32), 0
+
+
+def encoded_size(codec, dims):
+    """Bytes per stored vector."""
+    if codec == "float32":
+        return 4 * dims
+    return _HEADER.size + _body_size(CODECS.index(codec), dims)
+
+
+# --- embedding_formats table (psycopg2 cursors) ---
+
+def _has_table(cur):
+    cur.execute("SELECT to_regclass('embedding_formats') IS NOT NULL")
+    return cur.fetchone()[0]
+
+
+def load_projection(cur, projection_id):
+    cur.execute("SELECT dims, components FROM embedding_formats WHERE id = %s", (projection_id,))
+    row = cur.fetchone()
+    if row is None or row[1] is None:
+        raise LookupError(f"no embedding projection {projection_id}")
+    dims, components = row
+    return Projection(projection_id, np.frombuffer(bytes(components), dtype=np.float32).reshape(dims, -1))
+
+
+def active_format(cur, kind):
+    """(codec, Projection or None) new kind embeddings are written with; float32 by default."""
+    if not _has_table(cur):
+        return "float32", None
+    cur.execute("SELECT id, codec, dims FROM embedding_formats WHERE kind = %s AND active", (kind,))
+    row = cur.fetchone()
+    if row is None:
+        return "float32", None
+    format_id, codec, dims = row
+    return codec, load_projection(cur, format_id) if dims else None
+
+
+def save_format(cur, kind, codec, projection=None, recall=None, active=False):
+    """Record a format of kind (its projection gets the row id). Returns the id."""
+    cur.execute(
+        """INSERT INTO embedding_formats (kind, codec, dims, components, recall, active)
+           VALUES (%s, %s, %s, %s, %s, FALSE) RETURNING id""",
+        (kind, codec, projection.dims if projection else None,
+         projection.components.tobytes() if projection else None, recall),
+    )
+    format_id = cur.fetchone()[0]
+    if projection is not None:
+        projection.id = format_id
+    if active:
+        activate_format(cur, kind, format_id)
+    return format_id
+
+
+def activate_format(cur, kind, format_id):
+    cur.execute("UPDATE embedding_formats SET active = FALSE WHERE kind = %s AND active", (kind,))
+    cur.execute("UPDATE embedding_formats SET active = TRUE WHERE id = %s", (format_id,))
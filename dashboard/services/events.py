@@ -0,0 +1,151 @@
+"""Cache invalidation across workers over PostgreSQL LISTEN/NOTIFY.
+
+Writers call notify(cur, topic, **data) in their transaction: PostgreSQL
+delivers it on commit, to every listener. The analysis scripts send the same
+events (analysis/scripts/events.py). Topics:
+
+    photos      files or EXIF rows added/changed (extract_exif.py)
+    embeddings  CLIP embeddings written (analyze_photos.py, backfill, migrations)
+    tags        photo_tags changed; data: tag (omitted when several)
+    faces       faces / photo_faces changed; data: face_ids
+    counts      exact search total counted by a worker (result_count.py); data: where, params, total, started
+
+Each worker runs one listener thread (start(), called by app.py) on its own
+connection, and calls the handlers subscribed to the topic with the event data.
+After a lost connection every handler is called with None: events may have been
+missed, so caches drop everything. Caches keep their TTL as a fallback and
+only stretch it to config.EVENT_CACHE_MAX_AGE while listening() is True.
+"""
+
+import json
+import os
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+import config
+
+_handlers = {}  # topic -> [handler(data or None)]
+_listener = None
+_listener_pid = None
+_state = {"connected": False, "since": None, "received": {}, "last_event": None,
+          "reconnects": 0, "error": None}
+_lock = threading.Lock()
+RECONNECT_DELAY = 5  # seconds between connection attempts
+POLL_TIMEOUT = 60  # seconds of select() before checking the connection is alive
+
+
+def notify(cur, topic, **data):
+    """Queue an event on the writer's transaction (sent on commit)."""
+    if not config.EVENT_CHANNEL:
+        return
+    cur.execute("SELECT pg_notify(%s, %s)", (config.EVENT_CHANNEL, json.dumps(dict(data, topic=topic))))
+
+
+def subscribe(topic, handler):
+    """Call handler(data) on every event of topic, handler(None) after missed events."""
+    with _lock:
+        _handlers.setdefault(topic, []).append(handler)
+
+
+def listening():
+    """True while this worker's listener is connected: caches may skip their TTL reloads."""
+    return _state["connected"]
+
+
+def cache_ttl(ttl):
+    """ttl, or config.EVENT_CACHE_MAX_AGE while events invalidate the caches."""
+    return max(ttl, config.EVENT_CACHE_MAX_AGE) if listening() else ttl
+
+
+def _dispatch(topic, data):
+    with _lock:
+        handlers = list(_handlers.get(topic, ())) if topic else [h for hs in _handlers.values() for h in hs]
+    for handler in handlers:
+        try:
+            handler(data)
+        except Exception as e:
+            print(f"[Events] {topic or '*'} handler {handler.__qualname__} failed: {e}")
+
+
+def _connect():
+    conn = psycopg2.connect(
+        host=config.PG_HOST,
+        port=config.PG_PORT,
+        dbname=config.PG_DATABASE,
+        user=config.PG_USER,
+        password=config.PG_PASSWORD,
+        keepalives=1,
+        keepalives_idle=60,
+    )
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {config.EVENT_CHANNEL}")
+    return conn
+
+
+def _listen():
+    while True:
+        conn = None
+        try:
+            conn = _connect()
+            if _state["since"] is not None:
+                # Events sent while disconnected are lost: flush every cache
+                _state["reconnects"] += 1
+                _dispatch(None, None)
+            _state.update(connected=True, since=time.time(), error=None)
+            while True:
+                if select.select([conn], [], [], POLL_TIMEOUT) == ([], [], []):
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")  # raises when the server went away
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    event = conn.notifies.pop(0)
+                    try:
+                        data = json.loads(event.payload)
+                    except ValueError:
+                        continue
+                    topic = data.pop("topic", None)
+                    _state["received"][topic] = _state["received"].get(topic, 0) + 1
+                    _state["last_event"] = time.time()
+                    _dispatch(topic, data)
+        except Exception as e:
+            if _state["connected"] or _state["error"] is None:
+                print(f"[Events] Listener disconnected: {e}")
+            _state.update(connected=False, error=str(e))
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(RECONNECT_DELAY)
+
+
+def start():
+    """Start this worker's listener thread (once per process)."""
+    global _listener, _listener_pid
+    if not config.EVENT_CHANNEL:
+        return
+    with _lock:
+        if _listener is not None and _listener.is_alive() and _listener_pid == os.getpid():
+            return
+        _listener = threading.Thread(target=_listen, name="pg-events", daemon=True)
+        _listener_pid = os.getpid()
+        _listener.start()
+
+
+def stats():
+    """Listener connection state and events received per topic."""
+    now = time.time()
+    return {
+        "channel": config.EVENT_CHANNEL,
+        "connected": _state["connected"],
+        "connected_seconds": int(now - _state["since"]) if _state["connected"] else None,
+        "reconnects": _state["reconnects"],
+        "received": dict(_state["received"]),
+        "last_event_seconds": int(now - _state["last_event"]) if _state["last_event"] else None,
+        "error": _state["error"],
+    }
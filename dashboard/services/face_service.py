@@ -1,6 +1,8 @@
 """Face management: list, rename, merge, crop."""
 
+from services import events, pagination
 from services.db import db_cursor
+from services.photo_service import media_version, thumb_url
 
 
 def list_faces(page=1, per_page=20):
@@ -59,10 +61,17 @@ def list_faces(page=1, per_page=20):
     return {"faces": faces, "total": total, "page": page, "per_page": per_page}
 
 
-def get_face_photos(face_id, page=1, per_page=50):
-    """Get all photos containing a specific face."""
+def get_face_photos(face_id, page=1, per_page=50, cursor=None):
+    """Get all photos containing a specific face, newest first (cursor: see photo_service.search_photos)."""
     per_page = min(per_page, 200)
     offset = (page - 1) * per_page
+    after = pagination.decode_cursor(cursor, "date_taken", "desc") if cursor else None
+    select = """
+        SELECT p.id, p.filename, p.filepath, p.date_taken, p.camera_model,
+               p.latitude, p.longitude, p.width, p.height, p.file_modified, p.filesize, p.placeholder
+        FROM photos p
+    """
+    where = "p.id IN (SELECT pf.photo_id FROM photo_faces pf WHERE pf.face_id = %s)"
 
     with db_cursor() as cur:
         cur.execute("""
@@ -70,28 +79,33 @@ def get_face_photos(face_id, page=1, per_page=50):
         """, (face_id,))
         total = cur.fetchone()[0]
 
-        cur.execute("""
-            SELECT DISTINCT p.id, p.filename, p.filepath, p.date_taken, p.camera_model,
-                   p.latitude, p.longitude, p.width, p.height
-            FROM photos p
-            JOIN photo_faces pf ON pf.photo_id = p.id
-            WHERE pf.face_id = %s
-            ORDER BY p.date_taken DESC NULLS LAST
-            LIMIT %s OFFSET %s
-        """, (face_id, per_page, offset))
+        if after is not None or offset == 0:
+            rows, more = pagination.fetch_page(
+                cur, select, where, [face_id], "p.date_taken", "p.id", "desc", after, per_page)
+        else:
+            cur.execute(f"""
+                {select}
+                WHERE {where}
+                ORDER BY p.date_taken DESC NULLS LAST, p.id DESC
+                LIMIT %s OFFSET %s
+            """, (face_id, per_page, offset))
+            columns = [desc[0] for desc in cur.description]
+            rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+            more = offset + len(rows) < total
+        next_cursor = (pagination.encode_cursor("date_taken", "desc", rows[-1]["date_taken"], rows[-1]["id"])
+                       if rows and more else None)
 
-        columns = [desc[0] for desc in cur.description]
         photos = []
-        for row in cur.fetchall():
-            photo = dict(zip(columns, row))
-            photo["thumb_url"] = f"/api/explorer/photo/{photo['id']}/thumb"
+        for photo in rows:
+            photo["version"] = media_version(photo.pop("file_modified"), photo.pop("filesize"))
+            photo["thumb_url"] = thumb_url(photo["id"], photo["version"])
             if photo["latitude"]:
                 photo["latitude"] = float(photo["latitude"])
             if photo["longitude"]:
                 photo["longitude"] = float(photo["longitude"])
             photos.append(photo)
 
-    return {"photos": photos, "total": total, "page": page, "per_page": per_page}
+    return {"photos": photos, "total": total, "page": page, "per_page": per_page, "next_cursor": next_cursor}
 
 
 def rename_face(face_id, label):
@@ -104,6 +118,7 @@ def rename_face(face_id, label):
         row = cur.fetchone()
         if not row:
             return None
+        events.notify(cur, "faces", face_ids=[face_id])
     return {"ok": True, "face_id": face_id, "label": label}
 
 
@@ -120,6 +135,7 @@ def update_face_type(face_id, face_type):
         row = cur.fetchone()
         if not row:
             return None
+        events.notify(cur, "faces", face_ids=[face_id])
     return {"ok": True, "face_id": face_id, "face_type": face_type}
 
 
@@ -155,6 +171,7 @@ def merge_faces(source_ids, target_id):
             SELECT COUNT(*) FROM photo_faces WHERE face_id = %s
         """, (target_id,))
         new_count = cur.fetchone()[0]
+        events.notify(cur, "faces", face_ids=list(source_ids) + [target_id])
 
     return {
         "ok": True,
@@ -189,6 +206,7 @@ def assign_face_to_photo(photo_id, face_id, bbox=None):
             VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
         """, (photo_id, face_id, x1, y1, x2, y2, confidence))
         pf_id = cur.fetchone()[0]
+        events.notify(cur, "faces", face_ids=[face_id])
 
     return {"ok": True, "photo_face_id": pf_id}
 
@@ -201,6 +219,7 @@ def create_face(label):
             VALUES (%s) RETURNING id
         """, (label,))
         face_id = cur.fetchone()[0]
+        events.notify(cur, "faces", face_ids=[face_id])
     return {"ok": True, "face_id": face_id, "label": label}
 
 
@@ -213,6 +232,7 @@ def remove_face_from_photo(photo_id, face_id):
         row = cur.fetchone()
         if not row:
             return None
+        events.notify(cur, "faces", face_ids=[face_id])
     return {"ok": True}
 
 
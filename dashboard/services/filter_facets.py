@@ -0,0 +1,90 @@
+"""Explorer filter options (/api/explorer/filters), served from memory.
+
+With sql/005_filter_facets.sql applied, the counts come from the filter_facets
+table that triggers keep up to date on every write: loading it is one small
+query, and its highest version is the ETag of the endpoint. Without it, they are
+aggregated over photos and photo_tags (photo_service.get_filters) and the ETag
+is a hash of the result. Either way the result is kept in memory until a
+photos, tags or faces event, or FACETS_CACHE_TTL.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from services import events, photo_service
+from services.db import db_cursor
+
+FACETS_CACHE_TTL = 300
+TOP_TAGS = 50  # tags listed per source, most frequent first
+
+_cache = None  # (time, filters, version)
+_generation = 0  # bumped by events: a load started before one is not kept
+_lock = threading.Lock()
+
+
+def _has_table(cur):
+    cur.execute("SELECT to_regclass('filter_facets') IS NOT NULL")
+    return cur.fetchone()[0]
+
+
+def _from_store(cur):
+    cur.execute("SELECT facet, source, value, count FROM filter_facets WHERE count > 0")
+    cameras, tags, years, totals = [], {"clip": [], "yolo": []}, [], {}
+    for facet, source, value, count in cur.fetchall():
+        if facet == "camera":
+            cameras.append({"model": value, "count": count})
+        elif facet == "tag":
+            tags.setdefault(source, []).append({"tag": value, "count": count})
+        elif facet == "year":
+            years.append(int(value))
+        else:
+            totals[facet] = count
+    cameras.sort(key=lambda c: -c["count"])
+    for source in tags:
+        tags[source] = sorted(tags[source], key=lambda t: -t["count"])[:TOP_TAGS]
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM filter_facets")
+    version = f"f{cur.fetchone()[0]}"
+    return {
+        "cameras": cameras,
+        "tags": {"clip": tags["clip"], "yolo": tags["yolo"]},
+        "years": sorted(years),
+        "total_photos": totals.get("total", 0),
+        "total_geolocated": totals.get("geolocated", 0),
+        "total_with_faces": totals.get("with_faces", 0),
+    }, version
+
+
+def get_filters():
+    """(filter options, version): the version changes whenever the options do."""
+    global _cache
+    with _lock:
+        cached = _cache
+    if cached and time.time() - cached[0] < events.cache_ttl(FACETS_CACHE_TTL):
+        return cached[1], cached[2]
+
+    now, generation = time.time(), _generation
+    with db_cursor() as cur:
+        store = _has_table(cur)
+        if store:
+            filters, version = _from_store(cur)
+    if not store:
+        filters = photo_service.get_filters()
+        digest = hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+        version = f"h{digest[:16]}"
+    with _lock:
+        if generation == _generation:
+            _cache = (now, filters, version)
+    return filters, version
+
+
+def _invalidate(data):
+    global _cache, _generation
+    with _lock:
+        _cache = None
+        _generation += 1
+
+
+events.subscribe("photos", _invalidate)
+events.subscribe("tags", _invalidate)
+events.subscribe("faces", _invalidate)
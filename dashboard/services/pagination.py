@@ -0,0 +1,96 @@
+"""Keyset (cursor) pagination of the photo grids.
+
+LIMIT/OFFSET makes PostgreSQL read and discard every row before the page, so
+deep pages of the explorer get slower the further one scrolls. A cursor carries
+the sort value and id of the last row served instead, and the next page starts
+right after it in the index: (sort column, id) for each allowed sort, see
+sql/004_pagination_indexes.sql.
+
+NULL sort values go last in descending order and first in ascending order, as
+before. The NULL and non-NULL rows are fetched as separate segments, each a
+plain range of the (column, id) index read forwards or backwards; a single
+ORDER BY ... NULLS LAST could not use that index in descending order.
+
+Cursors are opaque to clients: urlsafe base64 of [sort, order, value, id].
+"""
+
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+
+def encode_cursor(sort, order, value, row_id):
+    """Opaque cursor pointing after the row (value, row_id) of the sort."""
+    if isinstance(value, datetime.datetime):
+        value = {"dt": value.isoformat()}
+    elif isinstance(value, Decimal):
+        value = int(value) if value == value.to_integral_value() else float(value)
+    payload = json.dumps([sort, order, value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort, order):
+    """(value, row_id) of a cursor made for sort/order. Raises ValueError when it does not fit."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, row_id = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {e}") from None
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError(f"cursor made for {cursor_sort} {cursor_order}, not {sort} {order}")
+    if not isinstance(row_id, int):
+        raise ValueError("invalid cursor: id")
+    if isinstance(value, dict):
+        try:
+            value = datetime.datetime.fromisoformat(value["dt"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("invalid cursor: date") from None
+    return value, row_id
+
+
+def segments(column, id_column, order, after=None):
+    """[(condition, params)] in page order, each fetched with ORDER BY column order, id_column order.
+
+    after: (value, row_id) of the last row served, None for the first page.
+    """
+    cmp = "<" if order == "desc" else ">"
+    if column == id_column:
+        if after is None:
+            return [("TRUE", [])]
+        return [(f"{id_column} {cmp} %s", [after[1]])]
+
+    not_null = (f"{column} IS NOT NULL", [])
+    null = (f"{column} IS NULL", [])
+    if after is not None:
+        value, row_id = after
+        if value is None:
+            null = (f"{column} IS NULL AND {id_column} {cmp} %s", [row_id])
+        else:
+            not_null = (f"({column}, {id_column}) {cmp} (%s, %s)", [value, row_id])
+    if order == "desc":
+        # NULLS LAST: once past the NULLs, nothing is left
+        return [not_null, null] if after is None or after[0] is not None else [null]
+    # NULLS FIRST: once past the NULLs, skip them
+    return [null, not_null] if after is None or after[0] is None else [not_null]
+
+
+def fetch_page(cur, select, where, params, column, id_column, order, after, limit):
+    """Rows (dicts) of the page after `after` (see segments) and whether another page follows.
+
+    select: "SELECT ... FROM ..." of the rows, without WHERE.
+    """
+    rows = []
+    for condition, condition_params in segments(column, id_column, order, after):
+        # One row beyond the page tells whether there is a next one
+        cur.execute(f"""
+            {select}
+            WHERE {where} AND {condition}
+            ORDER BY {column} {order}, {id_column} {order}
+            LIMIT %s
+        """, params + condition_params + [limit + 1 - len(rows)])
+        columns = [desc[0] for desc in cur.description]
+        rows.extend(dict(zip(columns, row)) for row in cur.fetchall())
+        if len(rows) > limit:
+            break
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,163 @@
+"""Resolve a photo id to (filepath, extension, version) for the media routes.
+
+/thumb misses and /full only need the file location, not the tags and faces that
+photo_service.get_photo_detail loads. Lookups go through a bounded in-process LRU,
+then (when config.PHOTO_RESOLVER_MAP is set) a local SQLite map filled from one
+query over photos, then a single-row PostgreSQL query.
+
+Both caches are dropped when the rescan stamp (config.RESCAN_STAMP, touched by
+analysis/scripts/extract_exif.py when files were added or changed) moves.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import config
+from services.db import db_cursor
+from services.photo_service import media_version
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS paths (
+        photo_id INTEGER PRIMARY KEY,
+        filepath TEXT NOT NULL,
+        extension TEXT,
+        version TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+"""
+
+STAMP_CHECK_INTERVAL = 2  # seconds between stat() calls on the rescan stamp
+
+_lru = OrderedDict()  # photo_id -> (filepath, extension, version)
+_lock = threading.Lock()
+_stamp = None
+_stamp_checked = 0
+_local = threading.local()
+_warm_lock = threading.Lock()
+
+
+def _current_stamp():
+    try:
+        return str(os.stat(config.RESCAN_STAMP).st_mtime)
+    except OSError:
+        return "0"
+
+
+def _check_stamp():
+    """Clear the LRU when the rescan stamp moved. Returns the current stamp."""
+    global _stamp, _stamp_checked
+    now = time.time()
+    with _lock:
+        if _stamp is not None and now - _stamp_checked < STAMP_CHECK_INTERVAL:
+            return _stamp
+        _stamp_checked = now
+        stamp = _current_stamp()
+        if stamp != _stamp:
+            _lru.clear()
+            _stamp = stamp
+        return stamp
+
+
+def _map_conn():
+    path = config.PHOTO_RESOLVER_MAP
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key == (os.getpid(), path):
+        return conn
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.key = (os.getpid(), path)
+    return conn
+
+
+def _map_stamp(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+    return row[0] if row else None
+
+
+def warm(stamp=None):
+    """Refill the on-disk map from a single query over photos. Returns the row count."""
+    stamp = stamp or _current_stamp()
+    with db_cursor() as cur:
+        cur.execute("SELECT id, filepath, extension, file_modified, filesize FROM photos")
+        rows = [(pid, path, ext, media_version(mtime, size))
+                for pid, path, ext, mtime, size in cur.fetchall()]
+
+    conn = _map_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM paths")
+        conn.executemany("INSERT INTO paths VALUES (?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('stamp', ?)", (stamp,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(rows)
+
+
+def _from_map(photo_id, stamp):
+    conn = _map_conn()
+    if _map_stamp(conn) != stamp:
+        # One worker thread re-warms; the others wait for it instead of all querying photos
+        with _warm_lock:
+            if _map_stamp(conn) != stamp:
+                warm(stamp)
+    return conn.execute(
+        "SELECT filepath, extension, version FROM paths WHERE photo_id = ?", (photo_id,)
+    ).fetchone()
+
+
+def _from_db(photo_id):
+    with db_cursor() as cur:
+        cur.execute(
+            "SELECT filepath, extension, file_modified, filesize FROM photos WHERE id = %s",
+            (photo_id,),
+        )
+        row = cur.fetchone()
+    if not row:
+        return None
+    return row[0], row[1], media_version(row[2], row[3])
+
+
+def resolve(photo_id):
+    """Return {"filepath", "extension", "version"} for a photo, or None if unknown."""
+    stamp = _check_stamp()
+    with _lock:
+        entry = _lru.get(photo_id)
+        if entry is not None:
+            _lru.move_to_end(photo_id)
+
+    if entry is None:
+        if config.PHOTO_RESOLVER_MAP:
+            entry = _from_map(photo_id, stamp)
+        if entry is None:
+            # Unknown to the map (added since the last warm) or no map configured
+            entry = _from_db(photo_id)
+        if entry is None:
+            return None
+        with _lock:
+            _lru[photo_id] = tuple(entry)
+            while len(_lru) > config.PHOTO_RESOLVER_CACHE_SIZE:
+                _lru.popitem(last=False)
+
+    filepath, extension, version = entry
+    return {"filepath": filepath, "extension": extension, "version": version}
+
+
+def invalidate(photo_id=None):
+    """Forget one photo (or everything) in this process."""
+    with _lock:
+        if photo_id is None:
+            _lru.clear()
+        else:
+            _lru.pop(photo_id, None)
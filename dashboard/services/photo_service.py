@@ -1,15 +1,26 @@
 """Photo search and filter queries."""
 
+from services import pagination, result_count
 from services.db import db_cursor
 
 
-def search_photos(tag=None, source=None, date_from=None, date_to=None,
-                  camera=None, face_id=None, q=None, has_gps=False,
-                  sort="date_taken", order="desc", page=1, per_page=50):
-    """Search photos with combined filters. Returns (photos, total)."""
-    per_page = min(per_page, 200)
-    offset = (page - 1) * per_page
+def media_version(file_modified, filesize):
+    """Short token that changes when the original file changes (cache-busting URLs, ETags)."""
+    stamp = int(file_modified.timestamp()) if file_modified else 0
+    return f"{stamp:x}{int(filesize or 0):x}"
+
+
+def thumb_url(photo_id, version=None):
+    """Thumbnail URL; with a version it is immutable and cached by browsers for a year."""
+    url = f"/api/explorer/photo/{photo_id}/thumb"
+    if version:
+        url += f"?v={version}"
+    return url
 
+
+def filter_sql(tag=None, source=None, date_from=None, date_to=None,
+               camera=None, face_id=None, q=None, has_gps=False):
+    """WHERE clause over photos aliased p for the search filters. Returns (where, params)."""
     conditions = []
     params = []
 
@@ -49,6 +60,22 @@ def search_photos(tag=None, source=None, date_from=None, date_to=None,
         conditions.append("p.latitude IS NOT NULL")
 
     where = " AND ".join(conditions) if conditions else "1=1"
+    return where, params
+
+
+def search_photos(tag=None, source=None, date_from=None, date_to=None,
+                  camera=None, face_id=None, q=None, has_gps=False,
+                  sort="date_taken", order="desc", page=1, per_page=50, cursor=None):
+    """Search photos with combined filters. Returns (photos, total, next_cursor, approximate).
+
+    With a cursor (the next_cursor of the previous page) the page is read from the
+    index after it (services/pagination.py) and page is ignored; otherwise page
+    is skipped over with OFFSET. Raises ValueError for a cursor of another sort.
+    total is a planner estimate when approximate is True (services/result_count.py).
+    """
+    per_page = min(per_page, 200)
+    offset = (page - 1) * per_page
+    where, params = filter_sql(tag, source, date_from, date_to, camera, face_id, q, has_gps)
 
     # Validate sort/order
     allowed_sorts = {"date_taken", "filename", "filesize", "id"}
@@ -56,27 +83,42 @@ def search_photos(tag=None, source=None, date_from=None, date_to=None,
         sort = "date_taken"
     if order not in ("asc", "desc"):
         order = "desc"
+    after = pagination.decode_cursor(cursor, sort, order) if cursor else None
 
     nulls = "NULLS LAST" if order == "desc" else "NULLS FIRST"
+    select = """
+        SELECT p.id, p.filename, p.filepath, p.extension, p.filesize,
+               p.date_taken, p.camera_model, p.width, p.height,
+               p.latitude, p.longitude, p.altitude, p.file_modified, p.placeholder
+        FROM photos p
+    """
 
     with db_cursor() as cur:
-        # Count total
-        cur.execute(f"SELECT COUNT(*) FROM photos p WHERE {where}", params)
-        total = cur.fetchone()[0]
+        total, approximate = result_count.count(cur, where, params)
 
         # Fetch page
-        cur.execute(f"""
-            SELECT p.id, p.filename, p.filepath, p.extension, p.filesize,
-                   p.date_taken, p.camera_model, p.width, p.height,
-                   p.latitude, p.longitude, p.altitude
-            FROM photos p
-            WHERE {where}
-            ORDER BY p.{sort} {order} {nulls}
-            LIMIT %s OFFSET %s
-        """, params + [per_page, offset])
-
-        columns = [desc[0] for desc in cur.description]
-        photos = [dict(zip(columns, row)) for row in cur.fetchall()]
+        if after is not None or offset == 0:
+            photos, more = pagination.fetch_page(
+                cur, select, where, params, f"p.{sort}", "p.id", order, after, per_page)
+        else:
+            cur.execute(f"""
+                {select}
+                WHERE {where}
+                ORDER BY p.{sort} {order} {nulls}, p.id {order}
+                LIMIT %s OFFSET %s
+            """, params + [per_page + 1, offset])
+            columns = [desc[0] for desc in cur.description]
+            photos = [dict(zip(columns, row)) for row in cur.fetchall()]
+            more = len(photos) > per_page
+            photos = photos[:per_page]
+        if approximate:
+            # What the page query saw beats the estimate
+            if not more and after is None and (photos or offset == 0):
+                total, approximate = offset + len(photos), False
+            else:
+                total = max(total, offset + len(photos) + more)
+        next_cursor = (pagination.encode_cursor(sort, order, photos[-1][sort], photos[-1]["id"])
+                       if photos and more else None)
 
         # Get tags for these photos
         if photos:
@@ -105,7 +147,8 @@ def search_photos(tag=None, source=None, date_from=None, date_to=None,
             for p in photos:
                 p["tags"] = tags_by_photo.get(p["id"], [])
                 p["face_count"] = face_counts.get(p["id"], 0)
-                p["thumb_url"] = f"/api/explorer/photo/{p['id']}/thumb"
+                p["version"] = media_version(p.pop("file_modified"), p["filesize"])
+                p["thumb_url"] = thumb_url(p["id"], p["version"])
                 if p["filesize"]:
                     p["filesize"] = int(p["filesize"])
                 if p["latitude"]:
@@ -115,7 +158,34 @@ def search_photos(tag=None, source=None, date_from=None, date_to=None,
                 if p["altitude"]:
                     p["altitude"] = float(p["altitude"])
 
-    return photos, total
+    return photos, total, next_cursor, approximate
+
+
+def get_photo_cards(photo_ids):
+    """Grid data for a list of photo ids (search results ranked elsewhere): {id: photo}."""
+    if not photo_ids:
+        return {}
+    with db_cursor() as cur:
+        cur.execute("""
+            SELECT id, filename, filepath, date_taken, camera_model,
+                   width, height, latitude, longitude, file_modified, filesize, placeholder
+            FROM photos WHERE id = ANY(%s)
+        """, (list(photo_ids),))
+        photo_map = {}
+        for row in cur.fetchall():
+            p = {
+                "id": row[0], "filename": row[1], "filepath": row[2],
+                "date_taken": str(row[3]) if row[3] else None,
+                "camera_model": row[4],
+                "width": row[5], "height": row[6],
+                "latitude": float(row[7]) if row[7] else None,
+                "longitude": float(row[8]) if row[8] else None,
+                "version": media_version(row[9], row[10]),
+                "placeholder": row[11],
+            }
+            p["thumb_url"] = thumb_url(row[0], p["version"])
+            photo_map[row[0]] = p
+    return photo_map
 
 
 def get_photo_detail(photo_id):
@@ -125,7 +195,7 @@ def get_photo_detail(photo_id):
             SELECT id, filename, filepath, extension, filesize,
                    date_taken, camera_make, camera_model, lens_model,
                    focal_length, aperture, shutter_speed, iso,
-                   width, height, latitude, longitude, altitude
+                   width, height, latitude, longitude, altitude, file_modified
             FROM photos WHERE id = %s
         """, (photo_id,))
         row = cur.fetchone()
@@ -134,6 +204,7 @@ def get_photo_detail(photo_id):
 
         columns = [desc[0] for desc in cur.description]
         photo = dict(zip(columns, row))
+        photo["version"] = media_version(photo.pop("file_modified"), photo["filesize"])
 
         # Float conversions
         for key in ("filesize", "focal_length", "aperture", "latitude",
@@ -229,7 +300,11 @@ def get_geo_photos(tag=None, date_from=None, date_to=None):
 
 
 def get_filters():
-    """Get available filter options for dropdowns."""
+    """Filter options for dropdowns, aggregated over photos and photo_tags.
+
+    The explorer reads them through services/filter_facets.py, which only
+    falls back to this without sql/005_filter_facets.sql.
+    """
     with db_cursor() as cur:
         # Cameras
         cur.execute("""
@@ -0,0 +1,97 @@
+"""Coordinate on-demand renders across gunicorn workers and their threads.
+
+Two kinds of flock()ed files under THUMBNAIL_DIR/.render/:
+    key-XX.lock   one render per key at a time (photo ids hashed onto RENDER_KEY_STRIPES
+                  files); a request for a tile already being rendered waits for it, then
+                  finds the result in the cache instead of decoding the photo again
+    slot-N.lock   RENDER_SLOTS concurrent renders for the whole dashboard
+
+A request that cannot get both within RENDER_QUEUE_WAIT seconds gets RenderBusy and
+answers 503 + Retry-After, so a grid full of uncached tiles never ties up every
+worker until the gunicorn timeout.
+"""
+
+import fcntl
+import os
+import time
+import zlib
+import config
+
+POLL_INTERVAL = 0.05
+
+
+class RenderBusy(Exception):
+    """No render slot (or the in-flight render of the same key) freed up in time."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"render queue full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _lock_dir():
+    return os.path.join(config.THUMBNAIL_DIR, ".render")
+
+
+def _open(name):
+    os.makedirs(_lock_dir(), exist_ok=True)
+    return os.open(os.path.join(_lock_dir(), name), os.O_CREAT | os.O_RDWR, 0o664)
+
+
+def _try_lock(fd, deadline):
+    """Poll a non-blocking flock until it is granted or the deadline passes."""
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+
+
+def _acquire_slot(deadline):
+    """Return the fd of a free slot file, or None once the deadline passed."""
+    fds = [_open(f"slot-{i}.lock") for i in range(max(1, config.RENDER_SLOTS))]
+    try:
+        while True:
+            for i, fd in enumerate(fds):
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                fds.pop(i)
+                return fd
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def run(key, lookup, render):
+    """Return lookup() or render(), with at most one render of `key` in flight.
+
+    lookup() returns the cached result or None. It is retried once the key lock is
+    held, so requests queued behind the same tile get what the first one wrote
+    without taking a slot. Raises RenderBusy after RENDER_QUEUE_WAIT seconds.
+    """
+    deadline = time.monotonic() + config.RENDER_QUEUE_WAIT
+    stripe = zlib.crc32(key.encode()) % config.RENDER_KEY_STRIPES
+    key_fd = _open(f"key-{stripe:02x}.lock")
+    try:
+        if not _try_lock(key_fd, deadline):
+            raise RenderBusy(config.RENDER_RETRY_AFTER)
+        result = lookup()
+        if result is not None:
+            return result
+        slot_fd = _acquire_slot(deadline)
+        if slot_fd is None:
+            raise RenderBusy(config.RENDER_RETRY_AFTER)
+        try:
+            return render()
+        finally:
+            os.close(slot_fd)
+    finally:
+        # Closing the descriptor releases its flock
+        os.close(key_fd)
@@ -0,0 +1,140 @@
+"""Totals of the explorer search without a COUNT(*) on every request.
+
+count(where, params) first asks the planner how many rows the filters select
+(EXPLAIN). Up to config.SEARCH_COUNT_EXACT_MAX estimated rows the exact count
+is cheap and runs right away; above it, the estimate is returned with
+approximate=True and the exact count runs in a background thread, so the next
+pages of the same search get it. Exact counts are cached per filter set
+(the WHERE clause and its parameters, sort and page excluded) for
+config.SEARCH_COUNT_CACHE_TTL seconds, longer while events invalidate them.
+
+A background count runs on its own connection, not one of the request pool,
+and only in one worker at a time per filter set (advisory lock): its result is
+sent as a "counts" event, which fills the cache of every worker.
+"""
+
+import json
+import threading
+import time
+import config
+from services import db, events
+
+_cache = {}  # (where, params) -> (time, total)
+_pending = set()  # keys counted in the background
+_dropped_at = 0.0  # last invalidation: counts started before it are not stored
+_lock = threading.Lock()
+CACHE_SIZE = 256
+BACKGROUND_MAX = 1  # exact counts running at once per worker
+
+
+def _key(where, params):
+    return where, tuple(params)
+
+
+def _cached(key):
+    with _lock:
+        cached = _cache.get(key)
+        if cached and time.time() - cached[0] < events.cache_ttl(config.SEARCH_COUNT_CACHE_TTL):
+            return cached[1]
+    return None
+
+
+def _store(key, total, started):
+    with _lock:
+        if started < _dropped_at:
+            return
+        if len(_cache) >= CACHE_SIZE and key not in _cache:
+            _cache.pop(min(_cache, key=lambda k: _cache[k][0]))
+        _cache[key] = (started, total)
+
+
+def _exact(cur, where, params):
+    cur.execute(f"SELECT COUNT(*) FROM photos p WHERE {where}", params)
+    return cur.fetchone()[0]
+
+
+def _estimate(cur, where, params):
+    cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM photos p WHERE {where}", params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _count_later(key, where, params):
+    def run():
+        started = time.time()
+        conn = None
+        try:
+            conn = db.connect()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                # Session lock, released with the connection: the other workers get the "counts" event
+                cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (json.dumps(key, default=str),))
+                if not cur.fetchone()[0]:
+                    return
+                total = _exact(cur, where, params)
+                events.notify(cur, "counts", where=where, params=list(params), total=total, started=started)
+            _store(key, total, started)
+        except Exception as e:
+            print(f"[Count] Background count failed: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+            with _lock:
+                _pending.discard(key)
+
+    with _lock:
+        if key in _pending or len(_pending) >= BACKGROUND_MAX:
+            return
+        _pending.add(key)
+    threading.Thread(target=run, name="search-count", daemon=True).start()
+
+
+def count(cur, where, params):
+    """(total, approximate) of the photos p matching where (filter_sql output)."""
+    key = _key(where, params)
+    total = _cached(key)
+    if total is not None:
+        return total, False
+
+    started = time.time()
+    estimate = _estimate(cur, where, params)
+    if estimate > config.SEARCH_COUNT_EXACT_MAX:
+        _count_later(key, where, params)
+        return estimate, True
+    total = _exact(cur, where, params)
+    _store(key, total, started)
+    return total, False
+
+
+def _drop(table=None):
+    """Forget the cached counts whose filters read table (all of them when None)."""
+    global _dropped_at
+    with _lock:
+        _dropped_at = time.time()
+        for key in [k for k in _cache if table is None or table in k[0]]:
+            del _cache[key]
+
+
+def _on_photos(data):
+    _drop()
+
+
+def _on_tags(data):
+    _drop("photo_tags")
+
+
+def _on_faces(data):
+    _drop("photo_faces")
+
+
+def _on_counts(data):
+    if data:
+        _store(_key(data["where"], data["params"]), data["total"], data["started"])
+
+
+events.subscribe("counts", _on_counts)
+events.subscribe("photos", _on_photos)
+events.subscribe("tags", _on_tags)
+events.subscribe("faces", _on_faces)
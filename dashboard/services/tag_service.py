@@ -1,5 +1,6 @@
 """Tag management: confirm, label, add, delete."""
 
+from services import events
 from services.db import db_cursor
 
 
@@ -8,11 +9,12 @@ def confirm_tag(tag_id):
     with db_cursor() as cur:
         cur.execute("""
             UPDATE photo_tags SET confirmed = NOT confirmed
-            WHERE id = %s RETURNING id, confirmed
+            WHERE id = %s RETURNING id, confirmed, tag
         """, (tag_id,))
         row = cur.fetchone()
         if not row:
             return None
+        events.notify(cur, "tags", tag=row[2])
     return {"ok": True, "tag_id": row[0], "confirmed": row[1]}
 
 
@@ -21,11 +23,12 @@ def update_tag_label(tag_id, label):
     with db_cursor() as cur:
         cur.execute("""
             UPDATE photo_tags SET label = %s
-            WHERE id = %s RETURNING id
+            WHERE id = %s RETURNING id, tag
         """, (label or None, tag_id))
         row = cur.fetchone()
         if not row:
             return None
+        events.notify(cur, "tags", tag=row[1])
     return {"ok": True, "tag_id": tag_id, "label": label}
 
 
@@ -48,6 +51,7 @@ def add_manual_tag(photo_id, tag, label=None, bbox=None):
         row = cur.fetchone()
         if not row:
             return {"ok": False, "error": "Ce tag existe déjà sur cette photo"}
+        events.notify(cur, "tags", tag=tag.strip().lower())
     return {"ok": True, "tag_id": row[0], "tag": tag, "label": label}
 
 
@@ -68,8 +72,9 @@ def search_tags(q, limit=20):
 def delete_tag(tag_id):
     """Delete a tag (any source)."""
     with db_cursor() as cur:
-        cur.execute("DELETE FROM photo_tags WHERE id = %s RETURNING id", (tag_id,))
+        cur.execute("DELETE FROM photo_tags WHERE id = %s RETURNING id, tag", (tag_id,))
         row = cur.fetchone()
         if not row:
             return None
+        events.notify(cur, "tags", tag=row[1])
     return {"ok": True, "tag_id": tag_id}
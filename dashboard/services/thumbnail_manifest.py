@@ -0,0 +1,372 @@
+"""Local SQLite manifest of the thumbnail cache: which derivatives exist on disk.
+
+The manifest lives next to the thumbnails (THUMBNAIL_DIR/manifest.sqlite), so the
+batch generator can find pending photos with one query per chunk instead of
+stat-ing every cache path. Every process that renders (gunicorn workers, the
+batch generator and its pool) records what it wrote.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import config
+
+# Schema migrations, applied in order; PRAGMA user_version holds the last applied index + 1
+_MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS thumbs (
+        photo_id INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        created REAL NOT NULL,
+        PRIMARY KEY (photo_id, size)
+    );
+    CREATE TABLE IF NOT EXISTS face_crops (
+        face_id INTEGER NOT NULL,
+        photo_id INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        created REAL NOT NULL,
+        PRIMARY KEY (face_id, photo_id)
+    );
+    """,
+    # How each thumbnail was decoded, for the fast-path statistics
+    """
+    ALTER TABLE thumbs ADD COLUMN extension TEXT;
+    ALTER TABLE thumbs ADD COLUMN decode TEXT;
+    """,
+    # One row per output format (jpeg, webp, avif)
+    """
+    CREATE TABLE thumbs_v3 (
+        photo_id INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        fmt TEXT NOT NULL DEFAULT 'jpeg',
+        bytes INTEGER NOT NULL,
+        created REAL NOT NULL,
+        extension TEXT,
+        decode TEXT,
+        PRIMARY KEY (photo_id, size, fmt)
+    );
+    INSERT INTO thumbs_v3 (photo_id, size, bytes, created, extension, decode)
+        SELECT photo_id, size, bytes, created, extension, decode FROM thumbs;
+    DROP TABLE thumbs;
+    ALTER TABLE thumbs_v3 RENAME TO thumbs;
+    """,
+    # Last access (LRU eviction) and hit/miss counters (cache collector)
+    """
+    ALTER TABLE thumbs ADD COLUMN accessed REAL;
+    ALTER TABLE face_crops ADD COLUMN accessed REAL;
+    CREATE INDEX IF NOT EXISTS thumbs_lru ON thumbs (size, COALESCE(accessed, created));
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    # Media version of the original each thumbnail was rendered from (photo_service.media_version)
+    """
+    ALTER TABLE thumbs ADD COLUMN version TEXT;
+    """,
+]
+
+# Access times and hit/miss counts are buffered per process and written at most this often
+ACCESS_FLUSH_INTERVAL = 30
+
+# Cache file extension -> format name
+_EXTENSION_FORMATS = {".jpg": "jpeg", ".webp": "webp", ".avif": "avif"}
+
+_local = threading.local()
+_access_lock = threading.Lock()
+_pending_thumbs = {}  # (photo_id, size, fmt) -> last access
+_pending_faces = {}  # (face_id, photo_id) -> last access
+_pending_counts = {}  # counter name -> increment
+_last_flush = time.time()
+
+
+def _manifest_path():
+    return os.path.join(config.THUMBNAIL_DIR, "manifest.sqlite")
+
+
+def _migrate(conn):
+    # IMMEDIATE takes the write lock first, so concurrent workers migrate one at a time
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for i, script in enumerate(_MIGRATIONS[version:], start=version):
+            for statement in script.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {i + 1}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def get_conn():
+    """Per-thread (and per-process) connection, created and migrated on first use."""
+    path = _manifest_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key == (os.getpid(), path):
+        return conn
+
+    os.makedirs(config.THUMBNAIL_DIR, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _migrate(conn)
+
+    _local.conn = conn
+    _local.key = (os.getpid(), path)
+    return conn
+
+
+def record_thumb(photo_id, size, fmt, nbytes, extension=None, decode=None, version=None):
+    get_conn().execute(
+        """INSERT OR REPLACE INTO thumbs (photo_id, size, fmt, bytes, created, extension, decode, version)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (photo_id, size, fmt, nbytes, time.time(), extension, decode, version),
+    )
+
+
+def thumb_version(photo_id, size, fmt):
+    """Media version of the original a thumbnail was rendered from, None when unknown or not cached."""
+    row = get_conn().execute(
+        "SELECT version FROM thumbs WHERE photo_id = ? AND size = ? AND fmt = ?", (photo_id, size, fmt)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def record_face_crop(face_id, photo_id, nbytes):
+    get_conn().execute(
+        "INSERT OR REPLACE INTO face_crops (face_id, photo_id, bytes, created) VALUES (?, ?, ?, ?)",
+        (face_id, photo_id, nbytes, time.time()),
+    )
+
+
+def note_thumb_access(photo_id, size, fmt, hit):
+    """Remember that a thumbnail was served (hit) or had to be rendered (miss)."""
+    now = time.time()
+    with _access_lock:
+        _pending_thumbs[(photo_id, size, fmt)] = now
+        name = f"{'hits' if hit else 'misses'}_{size}"
+        _pending_counts[name] = _pending_counts.get(name, 0) + 1
+    _maybe_flush(now)
+
+
+def note_face_access(face_id, photo_id, hit):
+    now = time.time()
+    with _access_lock:
+        _pending_faces[(face_id, photo_id)] = now
+        name = f"{'hits' if hit else 'misses'}_faces"
+        _pending_counts[name] = _pending_counts.get(name, 0) + 1
+    _maybe_flush(now)
+
+
+def _maybe_flush(now):
+    if now - _last_flush >= ACCESS_FLUSH_INTERVAL:
+        flush_access()
+
+
+def flush_access():
+    """Write buffered access times and counters in one transaction."""
+    global _last_flush, _pending_thumbs, _pending_faces, _pending_counts
+    with _access_lock:
+        thumbs, faces, counts = _pending_thumbs, _pending_faces, _pending_counts
+        _pending_thumbs, _pending_faces, _pending_counts = {}, {}, {}
+        _last_flush = time.time()
+    if not (thumbs or faces or counts):
+        return
+
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "UPDATE thumbs SET accessed = ? WHERE photo_id = ? AND size = ? AND fmt = ?",
+            [(t, pid, size, fmt) for (pid, size, fmt), t in thumbs.items()],
+        )
+        conn.executemany(
+            "UPDATE face_crops SET accessed = ? WHERE face_id = ? AND photo_id = ?",
+            [(t, fid, pid) for (fid, pid), t in faces.items()],
+        )
+        conn.executemany(
+            """INSERT INTO counters (name, value) VALUES (?, ?)
+               ON CONFLICT (name) DO UPDATE SET value = value + excluded.value""",
+            list(counts.items()),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def forget_thumb(photo_id, size, fmt):
+    get_conn().execute(
+        "DELETE FROM thumbs WHERE photo_id = ? AND size = ? AND fmt = ?", (photo_id, size, fmt)
+    )
+
+
+def forget_face_crop(face_id, photo_id):
+    get_conn().execute(
+        "DELETE FROM face_crops WHERE face_id = ? AND photo_id = ?", (face_id, photo_id)
+    )
+
+
+def all_thumbs():
+    """Every (photo_id, size, fmt, created) in the manifest."""
+    return get_conn().execute("SELECT photo_id, size, fmt, created FROM thumbs").fetchall()
+
+
+def all_face_crops():
+    """Every (face_id, photo_id, created) in the manifest."""
+    return get_conn().execute("SELECT face_id, photo_id, created FROM face_crops").fetchall()
+
+
+def least_recently_used(size, limit=1000):
+    """Oldest-accessed thumbnails of a size class: [(photo_id, fmt, bytes)]."""
+    return get_conn().execute("""
+        SELECT photo_id, fmt, bytes FROM thumbs WHERE size = ?
+        ORDER BY COALESCE(accessed, created) LIMIT ?
+    """, (size, limit)).fetchall()
+
+
+def least_recently_used_faces(limit=1000):
+    """Oldest-accessed face crops: [(face_id, photo_id, bytes)]."""
+    return get_conn().execute("""
+        SELECT face_id, photo_id, bytes FROM face_crops
+        ORDER BY COALESCE(accessed, created) LIMIT ?
+    """, (limit,)).fetchall()
+
+
+def usage():
+    """Cache footprint and hit counters.
+
+    Returns {"classes": {size or "faces": {"count": n, "bytes": b}},
+    "counters": {name: value}}.
+    """
+    conn = get_conn()
+    classes = {}
+    for size, count, nbytes in conn.execute("SELECT size, COUNT(*), SUM(bytes) FROM thumbs GROUP BY size"):
+        classes[size] = {"count": count, "bytes": nbytes or 0}
+    count, nbytes = conn.execute("SELECT COUNT(*), SUM(bytes) FROM face_crops").fetchone()
+    classes["faces"] = {"count": count, "bytes": nbytes or 0}
+    counters = dict(conn.execute("SELECT name, value FROM counters"))
+    return {"classes": classes, "counters": counters}
+
+
+def set_counter(name, value):
+    get_conn().execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, value))
+
+
+def existing_thumbs(photo_ids, size, fmt="jpeg"):
+    """Return the subset of photo_ids that already have a thumbnail of this size and format."""
+    found = set()
+    conn = get_conn()
+    ids = list(photo_ids)
+    # SQLite caps bound parameters; 900 stays under the historical 999 limit
+    for i in range(0, len(ids), 900):
+        chunk = ids[i:i + 900]
+        marks = ",".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT photo_id FROM thumbs WHERE size = ? AND fmt = ? AND photo_id IN ({marks})",
+            [size, fmt] + chunk,
+        )
+        found.update(r[0] for r in rows)
+    return found
+
+
+def existing_face_crops():
+    """Return the set of (face_id, photo_id) crops already on disk."""
+    return set(get_conn().execute("SELECT face_id, photo_id FROM face_crops"))
+
+
+def decode_stats():
+    """Per source format and size: how many thumbnails came from each decode path.
+
+    Returns {extension: {size: {"preview": n, "reduced": n, "full": n}}}; thumbnails
+    adopted by rebuild() have no recorded path and are left out.
+    """
+    stats = {}
+    rows = get_conn().execute("""
+        SELECT extension, size, decode, COUNT(DISTINCT photo_id) FROM thumbs
+        WHERE decode IS NOT NULL
+        GROUP BY extension, size, decode
+    """)
+    for ext, size, decode, count in rows:
+        per_size = stats.setdefault(ext or "?", {}).setdefault(size, {"preview": 0, "reduced": 0, "full": 0})
+        per_size[decode] = count
+    return stats
+
+
+def format_savings():
+    """Bytes per format against JPEG, over the photos that have both, for each size.
+
+    Returns {size: {fmt: {"photos": n, "bytes": b, "jpeg_bytes": jb, "savings_pct": p}}}
+    plus a "jpeg" entry with the overall JPEG footprint.
+    """
+    conn = get_conn()
+    report = {}
+    for size, photos, nbytes in conn.execute(
+            "SELECT size, COUNT(*), SUM(bytes) FROM thumbs WHERE fmt = 'jpeg' GROUP BY size"):
+        report.setdefault(size, {})["jpeg"] = {
+            "photos": photos, "bytes": nbytes, "jpeg_bytes": nbytes, "savings_pct": 0.0,
+        }
+    rows = conn.execute("""
+        SELECT t.size, t.fmt, COUNT(*), SUM(t.bytes), SUM(j.bytes)
+        FROM thumbs t
+        JOIN thumbs j ON j.photo_id = t.photo_id AND j.size = t.size AND j.fmt = 'jpeg'
+        WHERE t.fmt != 'jpeg'
+        GROUP BY t.size, t.fmt
+    """)
+    for size, fmt, photos, nbytes, jpeg_bytes in rows:
+        report.setdefault(size, {})[fmt] = {
+            "photos": photos,
+            "bytes": nbytes,
+            "jpeg_bytes": jpeg_bytes,
+            "savings_pct": round(100 * (1 - nbytes / jpeg_bytes), 1) if jpeg_bytes else 0.0,
+        }
+    return report
+
+
+def rebuild(thumb_dirs, faces_dir):
+    """Re-create the manifest from what is actually on disk. Returns (thumbs, faces) counts.
+
+    thumb_dirs: {size: directory}. Used once to adopt an existing cache, or after
+    files were removed by hand.
+    """
+    conn = get_conn()
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DELETE FROM thumbs")
+        conn.execute("DELETE FROM face_crops")
+        n_thumbs = 0
+        for size, directory in thumb_dirs.items():
+            for dirpath, _dirs, files in os.walk(directory):
+                for fname in files:
+                    stem, ext = os.path.splitext(fname)
+                    fmt = _EXTENSION_FORMATS.get(ext)
+                    if fmt is None or not stem.isdigit():
+                        continue
+                    st = os.stat(os.path.join(dirpath, fname))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO thumbs (photo_id, size, fmt, bytes, created) VALUES (?, ?, ?, ?, ?)",
+                        (int(stem), size, fmt, st.st_size, st.st_mtime),
+                    )
+                    n_thumbs += 1
+        n_faces = 0
+        for dirpath, _dirs, files in os.walk(faces_dir):
+            for fname in files:
+                stem, ext = os.path.splitext(fname)
+                parts = stem.split("_")
+                if ext != ".jpg" or len(parts) != 2 or not all(p.isdigit() for p in parts):
+                    continue
+                st = os.stat(os.path.join(dirpath, fname))
+                conn.execute(
+                    "INSERT OR REPLACE INTO face_crops (face_id, photo_id, bytes, created) VALUES (?, ?, ?, ?)",
+                    (int(parts[0]), int(parts[1]), st.st_size, st.st_mtime),
+                )
+                n_faces += 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return n_thumbs, n_faces
@@ -0,0 +1,223 @@
+"""Packed thumbnail store: append-only segment files plus an offset index, read through mmap.
+
+Layout under THUMBNAIL_DIR/pack/:
+    seg-000001.bin ...  concatenated encoded thumbnails, only ever appended to
+    index.sqlite        (photo_id, size, fmt) -> (segment, offset, length)
+    .lock               flock taken by writers (gunicorn workers, generator pool, compaction)
+
+Readers never take the lock: an index row is committed only after its bytes are
+in the segment, and a segment is unlinked only after its rows moved elsewhere.
+Used instead of the loose-file cache when config.THUMBNAIL_STORE == "pack".
+"""
+
+import fcntl
+import mmap
+import os
+import sqlite3
+import threading
+import config
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        photo_id INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        fmt TEXT NOT NULL,
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (photo_id, size, fmt)
+    );
+    CREATE INDEX IF NOT EXISTS blobs_segment ON blobs (segment);
+    CREATE TABLE IF NOT EXISTS segments (
+        id INTEGER PRIMARY KEY,
+        bytes INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+_local = threading.local()
+_maps = {}  # (segment path) -> mmap, shared by the threads of this process
+_maps_lock = threading.Lock()
+
+
+def _pack_dir():
+    return os.path.join(config.THUMBNAIL_DIR, "pack")
+
+
+def _segment_path(segment):
+    return os.path.join(_pack_dir(), f"seg-{segment:06d}.bin")
+
+
+def _conn():
+    path = os.path.join(_pack_dir(), "index.sqlite")
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.key == (os.getpid(), path):
+        return conn
+
+    os.makedirs(_pack_dir(), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.key = (os.getpid(), path)
+    return conn
+
+
+class _write_lock:
+    """Exclusive, cross-process lock for appends, index updates and compaction."""
+
+    def __enter__(self):
+        os.makedirs(_pack_dir(), exist_ok=True)
+        self.fd = os.open(os.path.join(_pack_dir(), ".lock"), os.O_CREAT | os.O_RDWR, 0o664)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        return False
+
+
+def _current_segment(conn, incoming):
+    """Segment to append `incoming` bytes to, starting a new one when the last is full."""
+    row = conn.execute("SELECT id, bytes FROM segments ORDER BY id DESC LIMIT 1").fetchone()
+    max_bytes = config.THUMBNAIL_PACK_SEGMENT_MB * 1024 * 1024
+    if row is None:
+        return 1
+    segment, used = row
+    if used > 0 and used + incoming > max_bytes:
+        return segment + 1
+    return segment
+
+
+def _append(conn, photo_id, size, fmt, data):
+    """Append one blob and point the index at it. Caller holds the write lock."""
+    segment = _current_segment(conn, len(data))
+    with open(_segment_path(segment), "ab") as f:
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO segments (id, bytes) VALUES (?, ?)",
+            (segment, offset + len(data)),
+        )
+        conn.execute(
+            """INSERT OR REPLACE INTO blobs (photo_id, size, fmt, segment, offset, length)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (photo_id, size, fmt, segment, offset, len(data)),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def put(photo_id, size, fmt, data):
+    """Store an encoded thumbnail. A previous version becomes dead space until compaction."""
+    with _write_lock():
+        _append(_conn(), photo_id, size, fmt, data)
+
+
+def _map(segment, needed):
+    """Read-only mmap of a segment covering at least `needed` bytes."""
+    path = _segment_path(segment)
+    with _maps_lock:
+        mm = _maps.get(path)
+        if mm is None or len(mm) < needed:
+            # The segment grew (or is new): map it again. The old map is not closed, responses
+            # may still be streaming from it; it goes away with its last memoryview.
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _maps[path] = mm
+        return mm
+
+
+def get(photo_id, size, fmt):
+    """Return the thumbnail bytes as a zero-copy memoryview over the segment, or None."""
+    conn = _conn()
+    for _attempt in range(2):
+        row = conn.execute(
+            "SELECT segment, offset, length FROM blobs WHERE photo_id = ? AND size = ? AND fmt = ?",
+            (photo_id, size, fmt),
+        ).fetchone()
+        if row is None:
+            return None
+        segment, offset, length = row
+        try:
+            mm = _map(segment, offset + length)
+        except FileNotFoundError:
+            # Compacted between the lookup and the open: the row now points elsewhere
+            continue
+        return memoryview(mm)[offset:offset + length]
+    return None
+
+
+def delete(photo_id, size=None, fmt=None):
+    """Drop index entries for a photo (all sizes/formats by default). Returns the count."""
+    conditions = ["photo_id = ?"]
+    params = [photo_id]
+    if size is not None:
+        conditions.append("size = ?")
+        params.append(size)
+    if fmt is not None:
+        conditions.append("fmt = ?")
+        params.append(fmt)
+    with _write_lock():
+        cur = _conn().execute(f"DELETE FROM blobs WHERE {' AND '.join(conditions)}", params)
+        return cur.rowcount
+
+
+def stats():
+    """Segment count, bytes on disk and bytes still referenced by the index."""
+    conn = _conn()
+    segments, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM segments").fetchone()
+    blobs, live = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM blobs").fetchone()
+    return {
+        "segments": segments,
+        "blobs": blobs,
+        "bytes": total,
+        "live_bytes": live,
+        "dead_bytes": total - live,
+    }
+
+
+def compact(min_live_ratio=0.5):
+    """Rewrite segments whose live data fell under min_live_ratio, then delete them.
+
+    Live blobs are appended to the current segment, which is never compacted itself.
+    Returns {"segments": rewritten, "moved": blobs, "reclaimed_bytes": bytes}.
+    """
+    result = {"segments": 0, "moved": 0, "reclaimed_bytes": 0}
+    with _write_lock():
+        conn = _conn()
+        rows = conn.execute("""
+            SELECT s.id, s.bytes, COALESCE(SUM(b.length), 0)
+            FROM segments s LEFT JOIN blobs b ON b.segment = s.id
+            WHERE s.id < (SELECT MAX(id) FROM segments)
+            GROUP BY s.id
+        """).fetchall()
+
+        for segment, total, live in rows:
+            if total > 0 and live / total >= min_live_ratio:
+                continue
+            path = _segment_path(segment)
+            blobs = conn.execute(
+                "SELECT photo_id, size, fmt, offset, length FROM blobs WHERE segment = ?",
+                (segment,),
+            ).fetchall()
+            if blobs:
+                with open(path, "rb") as f:
+                    for photo_id, size, fmt, offset, length in blobs:
+                        f.seek(offset)
+                        _append(conn, photo_id, size, fmt, f.read(length))
+                        result["moved"] += 1
+
+            conn.execute("DELETE FROM segments WHERE id = ?", (segment,))
+            if os.path.exists(path):
+                os.remove(path)
+            result["segments"] += 1
+            result["reclaimed_bytes"] += total - live
+    return result
@@ -1,83 +1,357 @@
 """Generate and serve photo thumbnails with disk caching."""
 
+import io
+import math
 import os
 import pillow_heif
 pillow_heif.register_heif_opener()
 from PIL import Image
 import config
+from services import thumbnail_manifest, thumbnail_pack
 
+try:
+    # AVIF encoder for Pillow < 11.2 (newer Pillow builds ship it)
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
 
-def get_thumbnail_path(photo_id, size=300):
+THUMBNAIL_SIZES = (300, 1200)
+FACE_CROP_SIZE = 150
+# Bounding boxes are stored in the analysis space (long edge capped at 2048, see analyze_photos.load_image)
+ANALYSIS_MAX_DIM = 2048
+
+# Cache layout: THUMBNAIL_DIR/{size}/{shard}/{photo_id}.{ext} and THUMBNAIL_DIR/faces/{shard}/{face_id}_{photo_id}.jpg
+SHARD_COUNT = 256
+
+# Inline placeholder returned with search results: PLACEHOLDER_GRID x PLACEHOLDER_GRID RGB cells, hex
+PLACEHOLDER_GRID = 4
+
+# Output formats: file extension, Pillow encoder, encoder options, mimetype
+FORMATS = {
+    "jpeg": (".jpg", "JPEG", {"quality": 80, "optimize": True}, "image/jpeg"),
+    "webp": (".webp", "WEBP", {"quality": 75, "method": 4}, "image/webp"),
+    "avif": (".avif", "AVIF", {"quality": 55, "speed": 8}, "image/avif"),
+}
+
+
+def available_formats():
+    """Formats this Pillow build can encode, JPEG always first."""
+    Image.init()
+    return [fmt for fmt, (_, encoder, _, _) in FORMATS.items() if encoder in Image.SAVE]
+
+
+def mimetype(fmt):
+    return FORMATS[fmt][3]
+
+
+def negotiate_format(accept_header):
+    """Pick the thumbnail format for a request from its Accept header.
+
+    Only formats listed in config.THUMBNAIL_FORMATS are offered, in that order, and
+    only when the client names them explicitly: a bare */* gets JPEG.
+    """
+    accepted = {}
+    for item in (accept_header or "").split(","):
+        parts = [p.strip() for p in item.split(";")]
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[parts[0].lower()] = q
+
+    encodable = available_formats()
+    for fmt in config.THUMBNAIL_FORMATS:
+        if fmt in FORMATS and fmt in encodable and accepted.get(mimetype(fmt), 0) > 0:
+            return fmt
+    return "jpeg"
+
+
+def shard(key):
+    """Bucket directory for an id: 256 buckets keep each directory to a few thousand files."""
+    return f"{key % SHARD_COUNT:02x}"
+
+
+def _thumbnail_file(photo_id, size, fmt="jpeg"):
+    return os.path.join(config.THUMBNAIL_DIR, str(size), shard(photo_id), f"{photo_id}{FORMATS[fmt][0]}")
+
+
+def _face_crop_file(face_id, photo_id):
+    # Deterministic name: the crop of a face is found from (face, representative photo) without a listing
+    return os.path.join(config.THUMBNAIL_DIR, "faces", shard(face_id), f"{face_id}_{photo_id}.jpg")
+
+
+def get_thumbnail_path(photo_id, size=300, fmt="jpeg"):
     """Return path to cached thumbnail, or None if not cached yet."""
-    path = os.path.join(config.THUMBNAIL_DIR, str(size), f"{photo_id}.jpg")
+    path = _thumbnail_file(photo_id, size, fmt)
     if os.path.exists(path):
         return path
     return None
 
 
-def generate_thumbnail(filepath, photo_id, size=300):
-    """Generate a thumbnail and cache it to disk. Returns the path."""
-    fullpath = os.path.join(config.PHOTOS_ROOT, filepath)
-    if not os.path.exists(fullpath):
+def get_cached(photo_id, size=300, fmt="jpeg", version=None):
+    """Return the cached thumbnail from the configured store, or None.
+
+    A file path with the loose-file store, a memoryview over the segment with the pack store.
+    With a version (photo_service.media_version of the original), a thumbnail recorded as
+    rendered from another version is stale and counts as missing.
+    """
+    if version is not None and thumbnail_manifest.thumb_version(photo_id, size, fmt) not in (None, version):
         return None
+    if config.THUMBNAIL_STORE == "pack":
+        return thumbnail_pack.get(photo_id, size, fmt)
+    return get_thumbnail_path(photo_id, size, fmt)
 
-    cache_path = os.path.join(config.THUMBNAIL_DIR, str(size), f"{photo_id}.jpg")
 
-    # Check cache
-    if os.path.exists(cache_path):
-        return cache_path
+def _save_atomic(img, path, encoder="JPEG", **params):
+    """Write to a temp file then rename, so readers never see a half-written image.
 
+    Returns the size in bytes of the written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
     try:
-        img = Image.open(fullpath).convert("RGB")
+        img.save(tmp_path, encoder, **params)
+        nbytes = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return nbytes
 
-        # Resize maintaining aspect ratio
-        img.thumbnail((size, size), Image.LANCZOS)
 
-        # Save as JPEG
-        img.save(cache_path, "JPEG", quality=80, optimize=True)
-        return cache_path
-    except Exception as e:
-        print(f"Thumbnail error {filepath}: {e}")
-        return None
+def _padded_face_box(bbox, width, height):
+    """Face bbox with 30% padding, clamped to the image. All values in the same space."""
+    x1, y1, x2, y2 = bbox
+    w = x2 - x1
+    h = y2 - y1
+    pad = int(max(w, h) * 0.3)
+    return (
+        max(0, x1 - pad),
+        max(0, y1 - pad),
+        min(width, x2 + pad),
+        min(height, y2 + pad),
+    )
 
 
-def get_face_crop_path(face_id):
-    """Return path to any cached face crop for this face_id, or None."""
-    faces_dir = os.path.join(config.THUMBNAIL_DIR, "faces")
-    # Face crops are named {face_id}_{photo_id}.jpg
-    for fname in os.listdir(faces_dir):
-        if fname.startswith(f"{face_id}_") and fname.endswith(".jpg"):
-            return os.path.join(faces_dir, fname)
-    return None
+def _required_long_edge(full_size, sizes, faces):
+    """Smallest decoded long edge that still yields every derivative at full quality."""
+    full_long = max(full_size)
+    analysis_scale = min(1.0, ANALYSIS_MAX_DIM / full_long)
+    analysis_w = full_size[0] * analysis_scale
+    analysis_h = full_size[1] * analysis_scale
+    analysis_long = max(analysis_w, analysis_h)
+
+    needed = max(sizes) if sizes else 0
+    for _face_id, bbox in faces:
+        x1, y1, x2, y2 = _padded_face_box(bbox, analysis_w, analysis_h)
+        crop_long = max(x2 - x1, y2 - y1)
+        if crop_long <= 0:
+            continue
+        needed = max(needed, math.ceil(FACE_CROP_SIZE * analysis_long / crop_long))
+    return min(full_long, needed)
+
+
+def _use_mpf_preview(img, box):
+    """Switch an MPO (camera JPEG with an MPF block) to its large preview frame if it covers box.
+
+    Only frames tagged as "Large Thumbnail" with the same mode and aspect ratio
+    qualify, so depth or gain maps stored in the same container are ignored.
+    Returns True when a preview frame was selected.
+    """
+    if img.format != "MPO" or getattr(img, "n_frames", 1) < 2:
+        return False
+    width, height = img.size
+    mode = img.mode
+    entries = getattr(img, "mpinfo", {}).get(0xB002, [])
+    best = None
+    for frame in range(1, img.n_frames):
+        if frame >= len(entries):
+            break
+        mp_type = str(entries[frame].get("Attribute", {}).get("MPType", ""))
+        if "Large Thumbnail" not in mp_type:
+            continue
+        img.seek(frame)
+        w, h = img.size
+        if img.mode != mode or w < box[0] or h < box[1] or w >= width:
+            continue
+        if abs(w * height - h * width) > 2 * max(width, height):
+            continue
+        if best is None or w * h < best[1]:
+            best = (frame, w * h)
+    img.seek(best[0] if best else 0)
+    return best is not None
+
 
+def _open_for(fullpath, sizes, faces, fast=True):
+    """Open a photo and decode it once, at the smallest resolution the derivatives need.
 
-def generate_face_crop(photo_filepath, face_id, photo_id, bbox, size=150):
-    """Generate a face crop thumbnail. bbox = [x1, y1, x2, y2]."""
-    cache_path = os.path.join(config.THUMBNAIL_DIR, "faces", f"{face_id}_{photo_id}.jpg")
-    if os.path.exists(cache_path):
-        return cache_path
+    Returns (image, full_size, decode) where decode is how the pixels were obtained:
+    "preview" (embedded preview: HEIC thumbnail item or JPEG MPF large thumbnail),
+    "reduced" (JPEG DCT scaling to 1/2, 1/4 or 1/8) or "full". fast=False forces a
+    full decode (used by the benchmark as the baseline).
+    """
+    img = Image.open(fullpath)
+    full_size = img.size
+    decode = "full"
+    needed = _required_long_edge(full_size, sizes, faces)
+    if fast and needed and needed < max(full_size):
+        ratio = needed / max(full_size)
+        box = (math.ceil(full_size[0] * ratio), math.ceil(full_size[1] * ratio))
+        preview = _use_mpf_preview(img, box)
+        # JPEG/MPO: DCT scaling; HEIC (pillow-heif >= 1.8): picks the smallest embedded thumbnail >= box
+        img.draft("RGB", box)
+        if preview or (img.size != full_size and img.format in ("HEIF", "HEIC")):
+            decode = "preview"
+        elif img.size != full_size:
+            decode = "reduced"  # JPEG and MPO (camera JPEGs with an MPF preview) scale in the DCT
+    return img.convert("RGB"), full_size, decode
 
-    fullpath = os.path.join(config.PHOTOS_ROOT, photo_filepath)
+
+def _store_thumb(img, photo_id, size, fmt):
+    """Encode into the configured store. Returns (path or None for the pack store, bytes)."""
+    _, encoder, params, _ = FORMATS[fmt]
+    if config.THUMBNAIL_STORE == "pack":
+        buf = io.BytesIO()
+        img.save(buf, encoder, **params)
+        data = buf.getvalue()
+        thumbnail_pack.put(photo_id, size, fmt, data)
+        return None, len(data)
+    cache_path = _thumbnail_file(photo_id, size, fmt)
+    return cache_path, _save_atomic(img, cache_path, encoder, **params)
+
+
+def compute_placeholder(img):
+    """Average colours of a PLACEHOLDER_GRID x PLACEHOLDER_GRID grid, as a hex string (96 chars).
+
+    Small enough to ship inline with every search result; the grid draws it
+    stretched behind the tile until the thumbnail arrives.
+    """
+    small = img.copy()
+    small.thumbnail((64, 64), Image.BOX)
+    return small.resize((PLACEHOLDER_GRID, PLACEHOLDER_GRID), Image.BOX).tobytes().hex()
+
+
+def render_photo(filepath, photo_id, thumbs=(), faces=(), fast=True, placeholder=False, version=None):
+    """Decode a photo once and write every requested derivative.
+
+    thumbs: (size, format) pairs to render, e.g. [(300, "jpeg"), (300, "webp"), (1200, "jpeg")].
+    faces: list of (face_id, bbox) crops to cut from the same decode, bbox in analysis space.
+    placeholder: also compute the colour-grid placeholder (see compute_placeholder).
+    version: media version of the original, recorded with the thumbnails (see get_cached).
+    Returns {"thumbs": {(size, format): path}, "faces": {face_id: path}, "decode": str or None,
+    "placeholder": str or None}; thumbnail paths are None with the pack store.
+    Failed outputs are left out.
+    """
+    result = {"thumbs": {}, "faces": {}, "decode": None, "placeholder": None}
+    fullpath = os.path.join(config.PHOTOS_ROOT, filepath)
     if not os.path.exists(fullpath):
-        return None
+        return result
+
+    formats_by_size = {}
+    for size, fmt in thumbs:
+        formats_by_size.setdefault(size, []).append(fmt)
+    sizes = sorted(formats_by_size, reverse=True)
+    faces = list(faces)
+    if not sizes and not faces and not placeholder:
+        return result
 
     try:
-        img = Image.open(fullpath).convert("RGB")
-
-        # Add padding around face bbox
-        x1, y1, x2, y2 = bbox
-        w = x2 - x1
-        h = y2 - y1
-        pad = int(max(w, h) * 0.3)
-        x1 = max(0, x1 - pad)
-        y1 = max(0, y1 - pad)
-        x2 = min(img.width, x2 + pad)
-        y2 = min(img.height, y2 + pad)
-
-        crop = img.crop((x1, y1, x2, y2))
-        crop.thumbnail((size, size), Image.LANCZOS)
-        crop.save(cache_path, "JPEG", quality=85)
-        return cache_path
+        # A placeholder alone only needs a grid-sized decode
+        img, full_size, decode = _open_for(fullpath, sizes or [THUMBNAIL_SIZES[0]], faces, fast=fast)
     except Exception as e:
-        print(f"Face crop error: {e}")
-        return None
+        print(f"Thumbnail error {filepath}: {e}")
+        return result
+    result["decode"] = decode
+    ext = os.path.splitext(filepath)[1].upper()
+
+    # Face crops first: they read from the decoded image before it gets shrunk
+    analysis_scale = min(1.0, ANALYSIS_MAX_DIM / max(full_size))
+    to_decoded = img.width / (full_size[0] * analysis_scale)
+    for face_id, bbox in faces:
+        try:
+            scaled = [c * to_decoded for c in bbox]
+            box = _padded_face_box(scaled, img.width, img.height)
+            crop = img.crop(tuple(int(round(c)) for c in box))
+            crop.thumbnail((FACE_CROP_SIZE, FACE_CROP_SIZE), Image.LANCZOS)
+            cache_path = _face_crop_file(face_id, photo_id)
+            nbytes = _save_atomic(crop, cache_path, quality=85)
+            thumbnail_manifest.record_face_crop(face_id, photo_id, nbytes)
+            result["faces"][face_id] = cache_path
+        except Exception as e:
+            print(f"Face crop error: {e}")
+
+    # Largest size first, each one resized from the previous step
+    for size in sizes:
+        try:
+            img.thumbnail((size, size), Image.LANCZOS)
+        except Exception as e:
+            # Truncated or corrupt data surfaces here with draft decoding: keep what was written
+            print(f"Thumbnail error {filepath} ({size}px): {e}")
+            return result
+        for fmt in formats_by_size[size]:
+            try:
+                cache_path, nbytes = _store_thumb(img, photo_id, size, fmt)
+                thumbnail_manifest.record_thumb(photo_id, size, fmt, nbytes, ext, decode, version)
+                result["thumbs"][(size, fmt)] = cache_path
+            except Exception as e:
+                print(f"Thumbnail error {filepath} ({fmt}): {e}")
+
+    if placeholder:
+        try:
+            result["placeholder"] = compute_placeholder(img)
+        except Exception as e:
+            print(f"Placeholder error {filepath}: {e}")
+    return result
+
+
+def generate_thumbnail(filepath, photo_id, size=300, fmt="jpeg", version=None):
+    """Generate a thumbnail and cache it. Returns it as get_cached() does.
+
+    With a version, a thumbnail rendered from another version of the original is replaced.
+    """
+    cached = get_cached(photo_id, size, fmt, version)
+    if cached is not None:
+        return cached
+    render_photo(filepath, photo_id, thumbs=[(size, fmt)], version=version)
+    return get_cached(photo_id, size, fmt, version)
+
+
+def delete_thumbnail(photo_id, size, fmt):
+    """Remove a cached thumbnail from the store and the manifest."""
+    if config.THUMBNAIL_STORE == "pack":
+        thumbnail_pack.delete(photo_id, size, fmt)
+    else:
+        try:
+            os.remove(_thumbnail_file(photo_id, size, fmt))
+        except FileNotFoundError:
+            pass
+    thumbnail_manifest.forget_thumb(photo_id, size, fmt)
+
+
+def delete_face_crop(face_id, photo_id):
+    """Remove a cached face crop and its manifest row."""
+    try:
+        os.remove(_face_crop_file(face_id, photo_id))
+    except FileNotFoundError:
+        pass
+    thumbnail_manifest.forget_face_crop(face_id, photo_id)
+
+
+def get_face_crop_path(face_id, photo_id):
+    """Return path to the cached crop of face_id taken from photo_id, or None."""
+    path = _face_crop_file(face_id, photo_id)
+    if os.path.exists(path):
+        return path
+    return None
+
+
+def generate_face_crop(photo_filepath, face_id, photo_id, bbox):
+    """Generate a face crop thumbnail. bbox = [x1, y1, x2, y2] in analysis space."""
+    cached = get_face_crop_path(face_id, photo_id)
+    if cached:
+        return cached
+    return render_photo(photo_filepath, photo_id, faces=[(face_id, bbox)])["faces"].get(face_id)
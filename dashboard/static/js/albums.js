@@ -3,6 +3,7 @@
     let currentPage = 1;
     let currentAlbum = null;
     let albumPhotosPage = 1;
+    let albumPhotosCursors = {};  // page -> cursor (keyset pagination)
 
     async function init() {
         await loadAlbums();
@@ -135,10 +136,14 @@
     async function loadAlbumPhotos() {
         if (!currentAlbum) return;
 
+        if (albumPhotosPage === 1) albumPhotosCursors = {};
+        const cursor = albumPhotosCursors[albumPhotosPage];
         const data = await fetchJSON(
             `/api/albums/${currentAlbum.id}/photos?page=${albumPhotosPage}&per_page=60`
+            + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '')
         );
         if (!data) return;
+        if (data.next_cursor) albumPhotosCursors[albumPhotosPage + 1] = data.next_cursor;
 
         document.getElementById('album-detail-count').textContent =
             `${data.total} photo${data.total !== 1 ? 's' : ''}`;
@@ -151,7 +156,7 @@
 
         grid.innerHTML = data.photos.map(p => `
             <div class="photo-card album-photo-card" data-photo-id="${p.id}">
-                <img src="${p.thumb_url}" alt="${p.filename}">
+                <img src="${p.thumb_url}" alt="${p.filename}" style="${placeholderStyle(p.placeholder)}">
                 <div class="photo-card-info">
                     <div class="photo-card-name">${p.filename}</div>
                     <div class="photo-card-date">${formatDate(p.date_taken)}</div>
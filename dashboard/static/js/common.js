@@ -45,3 +45,37 @@ function debounce(fn, ms) {
         timer = setTimeout(() => fn.apply(this, args), ms);
     };
 }
+
+// Thumbnails and face crops answer 503 while the server's render queue is full:
+// retry them a few times with a growing delay instead of leaving a broken tile.
+document.addEventListener('error', (e) => {
+    const img = e.target;
+    if (img.tagName !== 'IMG' || !/\/(thumb|crop)(\?|$)/.test(img.src)) return;
+    const attempt = Number(img.dataset.retry || 0) + 1;
+    if (attempt > 4) return;
+    img.dataset.retry = attempt;
+    setTimeout(() => {
+        const url = new URL(img.src);
+        url.searchParams.set('retry', attempt);
+        img.style.display = '';
+        img.src = url;
+    }, 1500 * attempt);
+}, true);
+
+// Tile placeholder: 4x4 colour grid (96 hex chars, from photos.placeholder) drawn
+// stretched as the <img> background until the thumbnail arrives.
+function placeholderStyle(hex) {
+    if (!hex || hex.length !== 96) return '';
+    const canvas = document.createElement('canvas');
+    canvas.width = canvas.height = 4;
+    const ctx = canvas.getContext('2d');
+    const pixels = ctx.createImageData(4, 4);
+    for (let i = 0; i < 16; i++) {
+        for (let c = 0; c < 3; c++) {
+            pixels.data[i * 4 + c] = parseInt(hex.substr((i * 3 + c) * 2, 2), 16);
+        }
+        pixels.data[i * 4 + 3] = 255;
+    }
+    ctx.putImageData(pixels, 0, 0);
+    return `background-image:url(${canvas.toDataURL()});background-size:100% 100%`;
+}
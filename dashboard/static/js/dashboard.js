@@ -4,6 +4,7 @@ const REFRESH_DOCKER = 15000;
 const REFRESH_PHOTOS = 300000;
 const REFRESH_PG = 60000;
 const REFRESH_ANALYSIS = 30000;
+const REFRESH_THUMBNAILS = 60000;
 
 function diskColor(percent) {
     if (percent > 90) return 'var(--accent-red)';
@@ -265,6 +266,40 @@ async function refreshAnalysis() {
     }
 }
 
+// --- THUMBNAIL CACHE ---
+async function refreshThumbnails() {
+    const data = await fetchJSON('/api/thumbnails');
+    if (!data) return;
+
+    const errEl = document.getElementById('thumbcache-error');
+    if (data.error) {
+        errEl.textContent = data.error;
+        errEl.style.display = 'block';
+        return;
+    }
+    errEl.style.display = 'none';
+
+    const rows = data.classes.map(c => {
+        const label = c.name === 'faces' ? 'Visages' : `${c.name}px`;
+        const budget = c.budget_bytes ? ` / ${humanBytes(c.budget_bytes)}` : '';
+        const ratio = c.hit_ratio === null ? '--' : `${(c.hit_ratio * 100).toFixed(1)}%`;
+        return `<tr><td>${label}</td><td>${c.count.toLocaleString('fr-FR')}</td>` +
+               `<td>${humanBytes(c.bytes)}${budget}</td><td>${ratio}</td></tr>`;
+    }).join('');
+    document.getElementById('thumbcache-table').innerHTML =
+        `<tr><th>Classe</th><th>Fichiers</th><th>Espace</th><th>Hit ratio</th></tr>${rows}`;
+
+    const gc = data.gc_last_run
+        ? `Dernier GC : ${new Date(data.gc_last_run * 1000).toLocaleString('fr-FR')} ` +
+          `(${data.gc_last_removed} orphelins, ${humanBytes(data.gc_last_evicted_bytes)} évincés)`
+        : 'Aucun GC exécuté';
+    document.getElementById('thumbcache-info').innerHTML = `
+        <div class="metric-row"><span>Total</span><strong>${humanBytes(data.total_bytes)}</strong></div>
+        <div class="metric-row"><span>Libre sur le disque</span><strong>${humanBytes(data.disk_free)}</strong></div>
+        <div>${gc}</div>
+    `;
+}
+
 // --- INIT ---
 async function init() {
     refreshSystem();
@@ -272,12 +307,14 @@ async function init() {
     refreshPhotos();
     refreshPostgres();
     refreshAnalysis();
+    refreshThumbnails();
 
     setInterval(refreshSystem, REFRESH_SYSTEM);
     setInterval(refreshDocker, REFRESH_DOCKER);
     setInterval(refreshPhotos, REFRESH_PHOTOS);
     setInterval(refreshPostgres, REFRESH_PG);
     setInterval(refreshAnalysis, REFRESH_ANALYSIS);
+    setInterval(refreshThumbnails, REFRESH_THUMBNAILS);
 }
 
 document.addEventListener('DOMContentLoaded', init);
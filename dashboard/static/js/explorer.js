@@ -3,9 +3,11 @@ let map, markerCluster;
 let currentPhotos = [];
 let currentPage = 1;
 let totalPages = 0;
+let pageCursors = {};  // page -> cursor of the explorer search (keyset pagination, from the previous page)
 let currentLightboxIndex = -1;
 
 let isClipSearch = false;
+let similarPhotoId = null;  // set while the grid shows "photos similaires" results
 let zonesVisible = true;
 
 // --- BBOX OVERLAY ---
@@ -157,15 +159,15 @@ async function init() {
     await search();
     await loadGeoPhotos();
 
-    document.getElementById('btn-search').addEventListener('click', () => { isClipSearch = false; currentPage = 1; search(); loadGeoPhotos(); });
+    document.getElementById('btn-search').addEventListener('click', () => { isClipSearch = false; similarPhotoId = null; currentPage = 1; search(); loadGeoPhotos(); });
     document.getElementById('filter-search').addEventListener('keydown', e => {
-        if (e.key === 'Enter') { isClipSearch = false; currentPage = 1; search(); loadGeoPhotos(); }
+        if (e.key === 'Enter') { isClipSearch = false; similarPhotoId = null; currentPage = 1; search(); loadGeoPhotos(); }
     });
 
     // CLIP search
-    document.getElementById('btn-clip').addEventListener('click', clipSearch);
+    document.getElementById('btn-clip').addEventListener('click', () => { similarPhotoId = null; currentPage = 1; clipSearch(); });
     document.getElementById('clip-search').addEventListener('keydown', e => {
-        if (e.key === 'Enter') clipSearch();
+        if (e.key === 'Enter') { similarPhotoId = null; currentPage = 1; clipSearch(); }
     });
 
     // Lightbox controls
@@ -296,6 +298,8 @@ async function search() {
     const params = buildFilterParams();
     params.page = currentPage;
     params.per_page = 60;
+    if (currentPage === 1) pageCursors = {};
+    else if (pageCursors[currentPage]) params.cursor = pageCursors[currentPage];
 
     const qs = new URLSearchParams(params).toString();
     const data = await fetchJSON(`/api/explorer/photos?${qs}`);
@@ -303,9 +307,11 @@ async function search() {
 
     currentPhotos = data.photos;
     totalPages = data.pages;
+    if (data.next_cursor) pageCursors[currentPage + 1] = data.next_cursor;
 
+    // Planner estimate for broad filters: the exact count follows on the next pages
     document.getElementById('result-count').textContent =
-        `${data.total.toLocaleString('fr-FR')} photos`;
+        `${data.approximate ? '~' : ''}${data.total.toLocaleString('fr-FR')} photos`;
 
     renderGrid();
     renderPagination(data.page, data.pages, data.total);
@@ -319,20 +325,53 @@ async function clipSearch() {
     document.getElementById('result-count').textContent = 'Recherche CLIP...';
     document.getElementById('photo-grid').innerHTML = '<div class="empty-state">Recherche en cours (encodage CLIP)...</div>';
 
-    const data = await fetchJSON(`/api/explorer/search/clip?q=${encodeURIComponent(q)}&limit=60`);
+    // Same filters as the regular search; the filename field is "filename" here (q is the CLIP text)
+    const params = buildFilterParams();
+    if (params.q) { params.filename = params.q; delete params.q; }
+    params.q = q;
+    params.page = currentPage;
+    params.per_page = 60;
+    const data = await fetchJSON(`/api/explorer/search/clip?${new URLSearchParams(params)}`);
     if (!data) {
         document.getElementById('result-count').textContent = 'Erreur';
         return;
     }
 
     currentPhotos = data.photos;
-    totalPages = 1;
+    // Without a total (approximate index), offer one more page as long as pages are full
+    totalPages = data.pages ?? (data.has_more ? data.page + 1 : data.page);
 
-    document.getElementById('result-count').textContent =
-        `CLIP: ${data.total} résultats pour "${data.query}"`;
+    document.getElementById('result-count').textContent = data.total !== null
+        ? `CLIP: ${data.total.toLocaleString('fr-FR')} résultats pour "${data.query}"`
+        : `CLIP: résultats pour "${data.query}"`;
 
     renderGrid();
-    document.getElementById('pagination').innerHTML = '';
+    renderPagination(data.page, totalPages, data.total);
+}
+
+async function similarSearch(photoId) {
+    similarPhotoId = photoId;
+    isClipSearch = true;
+    document.getElementById('result-count').textContent = 'Recherche de photos similaires...';
+
+    const params = buildFilterParams();
+    if (params.q) { params.filename = params.q; delete params.q; }
+    params.page = currentPage;
+    params.per_page = 60;
+    const data = await fetchJSON(`/api/explorer/photo/${photoId}/similar?${new URLSearchParams(params)}`);
+    if (!data) {
+        document.getElementById('result-count').textContent = 'Erreur (photo sans embedding CLIP ?)';
+        return;
+    }
+
+    currentPhotos = data.photos;
+    totalPages = data.pages ?? (data.has_more ? data.page + 1 : data.page);
+    document.getElementById('result-count').textContent = data.total !== null
+        ? `${data.total.toLocaleString('fr-FR')} photos similaires`
+        : 'Photos similaires';
+
+    renderGrid();
+    renderPagination(data.page, totalPages, data.total);
 }
 
 function renderGrid() {
@@ -345,7 +384,7 @@ function renderGrid() {
 
     grid.innerHTML = currentPhotos.map((p, i) => `
         <div class="photo-card" data-index="${i}" onclick="openLightbox(${i})">
-            <img data-src="${p.thumb_url}" alt="${p.filename}" class="lazy-img">
+            <img data-src="${p.thumb_url}" alt="${p.filename}" class="lazy-img" style="${placeholderStyle(p.placeholder)}">
             <div class="photo-card-info">
                 <div class="photo-card-name">${p.filename}</div>
                 <div class="photo-card-date">${formatDate(p.date_taken)}</div>
@@ -404,7 +443,9 @@ function renderPagination(page, pages, total) {
 
 function goToPage(page) {
     currentPage = page;
-    search();
+    if (similarPhotoId) similarSearch(similarPhotoId);
+    else if (isClipSearch) clipSearch();
+    else search();
     window.scrollTo({ top: 0, behavior: 'smooth' });
 }
 
@@ -445,7 +486,7 @@ function showLightboxPhoto(photo) {
 
     // Bind onload BEFORE setting src (avoid race with cached images)
     img.onload = () => renderOverlayBoxes(photo);
-    img.src = `/api/explorer/photo/${photo.id}/thumb?size=1200`;
+    img.src = `/api/explorer/photo/${photo.id}/thumb?size=1200${photo.version ? `&v=${photo.version}` : ""}`;
     img.alt = photo.filename;
 
     let metaHtml = `<h3>${photo.filename}</h3>`;
@@ -463,6 +504,8 @@ function showLightboxPhoto(photo) {
         metaHtml += `<div class="lb-meta-row"><span>Altitude</span><strong>${Math.round(photo.altitude)} m</strong></div>`;
     }
 
+    metaHtml += `<button class="btn-small btn-secondary" id="btn-similar">Photos similaires</button>`;
+
     // Zones toggle
     metaHtml += '<div class="lb-section-header lb-zones-toggle">';
     metaHtml += '<label class="zones-toggle-label">';
@@ -554,6 +597,12 @@ function showLightboxPhoto(photo) {
     bindFaceEvents(photo);
     loadPhotoAlbums(photo);
 
+    document.getElementById('btn-similar').addEventListener('click', () => {
+        closeLightbox();
+        currentPage = 1;
+        similarSearch(photo.id);
+    });
+
     // Zones toggle
     const cbZones = document.getElementById('cb-zones-visible');
     if (cbZones) {
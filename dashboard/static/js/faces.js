@@ -10,6 +10,7 @@
     let selected = new Set();  // face IDs selected for merge
     let viewingFaceId = null;  // when browsing a face's photos
     let facePhotosPage = 1;
+    let facePhotosCursors = {};  // page -> cursor (keyset pagination)
 
     const grid = document.getElementById('faces-grid');
     const totalEl = document.getElementById('faces-total');
@@ -203,9 +204,13 @@
 
     async function loadFacePhotos() {
         try {
+            if (facePhotosPage === 1) facePhotosCursors = {};
+            const cursor = facePhotosCursors[facePhotosPage];
             const data = await fetchJSON(
                 `/api/faces/${viewingFaceId}/photos?page=${facePhotosPage}&per_page=50`
+                + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '')
             );
+            if (data.next_cursor) facePhotosCursors[facePhotosPage + 1] = data.next_cursor;
             photosCount.textContent = `${data.total} photo${data.total !== 1 ? 's' : ''}`;
             const totalPg = Math.ceil(data.total / data.per_page);
 
@@ -214,7 +219,7 @@
             } else {
                 photosGrid.innerHTML = data.photos.map(p => `
                     <div class="photo-card">
-                        <img src="${p.thumb_url}" alt="${p.filename}" loading="lazy">
+                        <img src="${p.thumb_url}" alt="${p.filename}" loading="lazy" style="${placeholderStyle(p.placeholder)}">
                         <div class="photo-card-info">
                             <div class="photo-card-name">${p.filename}</div>
                             <div class="photo-card-date">${p.date_taken ? formatDate(p.date_taken) : ''}</div>
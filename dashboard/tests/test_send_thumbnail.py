@@ -0,0 +1,50 @@
+"""Pack-store thumbnails must reach the WSGI server as bytes (PEP 3333), as gunicorn requires."""
+
+import os
+import sys
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("PIL")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as dashboard  # noqa: E402
+
+
+def _strict_run(wsgi_app, environ):
+    """Run a WSGI app like gunicorn's writer: every chunk must be bytes."""
+    status = []
+    body = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(status_line)
+
+        def write(data):
+            if type(data) is not bytes:
+                raise TypeError(f"{data!r} is not a byte")
+            body.append(data)
+        return write
+
+    result = wsgi_app(environ, start_response)
+    try:
+        for chunk in result:
+            if type(chunk) is not bytes:
+                raise TypeError(f"{chunk!r} is not a byte")
+            body.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return status[0], b"".join(body)
+
+
+def test_memoryview_thumbnail_is_sent_as_bytes():
+    data = b"RIFF\x00\x00\x00\x00WEBPVP8 " + bytes(range(64))
+    backing = bytearray(b"xx" + data + b"yy")
+    view = memoryview(backing)[2:2 + len(data)]
+    with dashboard.app.test_request_context("/api/explorer/photo/1/thumb"):
+        response = dashboard._send_thumbnail(view, "image/webp", "1-300-webp-v")
+        environ = dashboard.request.environ
+    status, body = _strict_run(response, environ)
+    assert status.startswith("200")
+    assert body == data
+    assert response.headers["Content-Length"] == str(len(data))
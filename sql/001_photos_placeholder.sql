@@ -0,0 +1,3 @@
+-- Inline placeholder shown in the explorer grids while a thumbnail loads:
+-- 4x4 RGB colour grid as 96 hex characters, filled by dashboard/generate_thumbnails.py
+ALTER TABLE photos ADD COLUMN IF NOT EXISTS placeholder TEXT;
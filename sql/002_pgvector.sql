@@ -0,0 +1,19 @@
+-- Optional pgvector storage of the CLIP and face embeddings (EMBEDDING_STORAGE=pgvector):
+-- similarity search and face matching then rank rows inside PostgreSQL instead of in Python.
+-- The bytea columns stay the source of the in-memory index. Once this file has been applied,
+-- copy the existing rows with dashboard/migrate_pgvector.py; the analysis scripts keep both columns filled.
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- ViT-B-32 and buffalo_l both give 512 floats
+ALTER TABLE photos ADD COLUMN IF NOT EXISTS clip_vector vector(512);
+ALTER TABLE faces ADD COLUMN IF NOT EXISTS embedding_vector vector(512);
+
+-- HNSW (pgvector >= 0.5.0), cosine distance (<=>) like the normalised dot product of the in-memory path.
+-- On a large library the copy runs faster with these two statements applied after migrate_pgvector.py.
+CREATE INDEX IF NOT EXISTS photos_clip_vector_hnsw ON photos USING hnsw (clip_vector vector_cosine_ops);
+CREATE INDEX IF NOT EXISTS faces_embedding_vector_hnsw ON faces USING hnsw (embedding_vector vector_cosine_ops);
+
+-- Older pgvector: IVFFlat instead, created after migrate_pgvector.py (lists ~ rows / 1000, searched
+-- with CLIP_ANN_NPROBE probes):
+-- CREATE INDEX IF NOT EXISTS photos_clip_vector_ivfflat ON photos USING ivfflat (clip_vector vector_cosine_ops) WITH (lists = 100);
+-- CREATE INDEX IF NOT EXISTS faces_embedding_vector_ivfflat ON faces USING ivfflat (embedding_vector vector_cosine_ops) WITH (lists = 20);
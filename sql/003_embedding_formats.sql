@@ -0,0 +1,14 @@
+-- Compact embedding encodings (dashboard/services/embedding_codec.py): one row per format tried by
+-- dashboard/migrate_embeddings.py; the active row of a kind is what the analysis scripts write.
+-- Without this table everything stays raw float32.
+CREATE TABLE IF NOT EXISTS embedding_formats (
+    id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,          -- 'clip' (photos.clip_embedding) or 'face' (faces.embedding)
+    codec TEXT NOT NULL,         -- 'float32', 'float16' or 'int8'
+    dims INTEGER,                -- PCA output size, NULL = full-size vectors
+    components BYTEA,            -- PCA matrix, float32 dims x input size, row-major
+    recall REAL,                 -- recall@50 against float32 measured before the migration
+    active BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE UNIQUE INDEX IF NOT EXISTS embedding_formats_active ON embedding_formats (kind) WHERE active;
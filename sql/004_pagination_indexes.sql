@@ -0,0 +1,12 @@
+-- Keyset pagination of the photo grids (dashboard/services/pagination.py): one (sort column, id)
+-- index per sort of the explorer, so a page starts at its cursor instead of skipping OFFSET rows.
+-- Plain ascending indexes: descending pages read them backwards, NULL values as a separate range.
+-- Check with dashboard/bench_explorer_pagination.py before and after.
+CREATE INDEX IF NOT EXISTS photos_date_taken_id ON photos (date_taken, id);
+CREATE INDEX IF NOT EXISTS photos_filename_id ON photos (filename, id);
+CREATE INDEX IF NOT EXISTS photos_filesize_id ON photos (filesize, id);
+-- sort=id uses the primary key
+
+-- Album pages (last added first) and the photos of a face
+CREATE INDEX IF NOT EXISTS album_photos_album_added ON album_photos (album_id, added_at, photo_id);
+CREATE INDEX IF NOT EXISTS photo_faces_face_photo ON photo_faces (face_id, photo_id);
@@ -0,0 +1,178 @@
+-- Explorer filter facets (dashboard/services/filter_facets.py): the counts behind
+-- /api/explorer/filters, kept up to date by triggers instead of aggregated over photos and
+-- photo_tags on every page load. Every write path (analysis scripts, dashboard services, manual
+-- SQL) goes through them. Needs PostgreSQL >= 10 (transition tables).
+--   facet        source  value
+--   total        ''      ''            all photos
+--   geolocated   ''      ''            photos with a latitude
+--   with_faces   ''      ''            face-analysed photos with at least one photo_faces row
+--   camera       ''      camera_model
+--   year         ''      year of date_taken
+--   tag          source  tag           photo_tags rows
+-- Rows drop to count 0 rather than being deleted. version comes from a sequence: its maximum
+-- changes with every update and is the ETag of the endpoint.
+-- Counters of the same facet row serialise concurrent writers until they commit.
+-- SELECT filter_facets_rebuild() recomputes everything (it also fills the table below); run it
+-- after deleting photos whose photo_faces rows go with them, which with_faces cannot follow.
+CREATE TABLE IF NOT EXISTS filter_facets (
+    facet TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    value TEXT NOT NULL DEFAULT '',
+    count BIGINT NOT NULL DEFAULT 0,
+    version BIGINT NOT NULL,
+    PRIMARY KEY (facet, source, value)
+);
+CREATE SEQUENCE IF NOT EXISTS filter_facets_version;
+
+-- Facet rows a photo counts in
+CREATE OR REPLACE FUNCTION filter_facets_of(geolocated BOOLEAN, camera TEXT, year TEXT, with_faces BOOLEAN)
+RETURNS TABLE (facet TEXT, source TEXT, value TEXT) LANGUAGE sql IMMUTABLE AS $$
+    SELECT 'total', '', ''
+    UNION ALL SELECT 'geolocated', '', '' WHERE geolocated
+    UNION ALL SELECT 'camera', '', camera WHERE camera IS NOT NULL
+    UNION ALL SELECT 'year', '', year WHERE year IS NOT NULL
+    UNION ALL SELECT 'with_faces', '', '' WHERE with_faces
+$$;
+
+-- Add deltas (parallel arrays) to the facet rows
+CREATE OR REPLACE FUNCTION filter_facets_add(facets TEXT[], sources TEXT[], vals TEXT[], deltas BIGINT[])
+RETURNS void LANGUAGE sql AS $$
+    INSERT INTO filter_facets AS ff (facet, source, value, count, version)
+    SELECT d.facet, d.source, d.value, sum(d.delta), nextval('filter_facets_version')
+    FROM unnest(facets, sources, vals, deltas) AS d(facet, source, value, delta)
+    GROUP BY d.facet, d.source, d.value
+    HAVING sum(d.delta) <> 0
+    ON CONFLICT (facet, source, value)
+    DO UPDATE SET count = ff.count + EXCLUDED.count, version = EXCLUDED.version
+$$;
+
+-- photos: inserted / deleted rows per statement, facet columns changed per row
+CREATE OR REPLACE FUNCTION filter_facets_photos() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM filter_facets_add(array_agg(f.facet), array_agg(f.source), array_agg(f.value), array_agg(1::BIGINT))
+        FROM new_rows r, filter_facets_of(
+            r.latitude IS NOT NULL, r.camera_model::TEXT, EXTRACT(YEAR FROM r.date_taken::timestamp)::INT::TEXT,
+            r.face_analyzed AND EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = r.id)) f
+        HAVING count(*) > 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM filter_facets_add(array_agg(f.facet), array_agg(f.source), array_agg(f.value), array_agg(-1::BIGINT))
+        FROM old_rows r, filter_facets_of(
+            r.latitude IS NOT NULL, r.camera_model::TEXT, EXTRACT(YEAR FROM r.date_taken::timestamp)::INT::TEXT,
+            r.face_analyzed AND EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = r.id)) f
+        HAVING count(*) > 0;
+    ELSE
+        PERFORM filter_facets_add(array_agg(f.facet), array_agg(f.source), array_agg(f.value), array_agg(r.delta))
+        FROM (VALUES
+            (-1::BIGINT, OLD.latitude IS NOT NULL, OLD.camera_model::TEXT,
+             EXTRACT(YEAR FROM OLD.date_taken::timestamp)::INT::TEXT, OLD.face_analyzed),
+            (1::BIGINT, NEW.latitude IS NOT NULL, NEW.camera_model::TEXT,
+             EXTRACT(YEAR FROM NEW.date_taken::timestamp)::INT::TEXT, NEW.face_analyzed)
+        ) AS r(delta, geolocated, camera, year, face_analyzed),
+        filter_facets_of(r.geolocated, r.camera, r.year,
+                         r.face_analyzed AND EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = NEW.id)) f;
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- photo_tags: one tag row per (source, tag)
+CREATE OR REPLACE FUNCTION filter_facets_photo_tags() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM filter_facets_add(array_agg('tag'::TEXT), array_agg(r.source::TEXT), array_agg(r.tag::TEXT), array_agg(1::BIGINT))
+        FROM new_rows r HAVING count(*) > 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM filter_facets_add(array_agg('tag'::TEXT), array_agg(r.source::TEXT), array_agg(r.tag::TEXT), array_agg(-1::BIGINT))
+        FROM old_rows r HAVING count(*) > 0;
+    ELSE
+        PERFORM filter_facets_add(ARRAY['tag', 'tag'], ARRAY[OLD.source::TEXT, NEW.source::TEXT],
+                                  ARRAY[OLD.tag::TEXT, NEW.tag::TEXT], ARRAY[-1, 1]::BIGINT[]);
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- photo_faces: a face-analysed photo enters with_faces with its first row and leaves with its last
+CREATE OR REPLACE FUNCTION filter_facets_photo_faces() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM filter_facets_add(array_agg('with_faces'::TEXT), array_agg(''::TEXT), array_agg(''::TEXT), array_agg(1::BIGINT))
+        FROM photos p
+        WHERE p.id IN (SELECT photo_id FROM new_rows) AND p.face_analyzed
+          AND NOT EXISTS (SELECT 1 FROM photo_faces pf
+                          WHERE pf.photo_id = p.id AND pf.id NOT IN (SELECT id FROM new_rows))
+        HAVING count(*) > 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM filter_facets_add(array_agg('with_faces'::TEXT), array_agg(''::TEXT), array_agg(''::TEXT), array_agg(-1::BIGINT))
+        FROM photos p
+        WHERE p.id IN (SELECT photo_id FROM old_rows) AND p.face_analyzed
+          AND NOT EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = p.id)
+        HAVING count(*) > 0;
+    ELSE
+        -- A row moved to another photo: the old one may have lost its last face, the new one gained its first
+        PERFORM filter_facets_add(array_agg('with_faces'::TEXT), array_agg(''::TEXT), array_agg(''::TEXT), array_agg(d.delta))
+        FROM (
+            SELECT -1::BIGINT FROM photos p
+            WHERE p.id = OLD.photo_id AND p.face_analyzed
+              AND NOT EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = p.id)
+            UNION ALL
+            SELECT 1::BIGINT FROM photos p
+            WHERE p.id = NEW.photo_id AND p.face_analyzed
+              AND NOT EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = p.id AND pf.id <> NEW.id)
+        ) AS d(delta)
+        HAVING count(*) > 0;
+    END IF;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS filter_facets_insert ON photos;
+DROP TRIGGER IF EXISTS filter_facets_delete ON photos;
+DROP TRIGGER IF EXISTS filter_facets_update ON photos;
+CREATE TRIGGER filter_facets_insert AFTER INSERT ON photos
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE filter_facets_photos();
+CREATE TRIGGER filter_facets_delete AFTER DELETE ON photos
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE filter_facets_photos();
+-- Row level with WHEN: the frequent updates of other columns (analysis flags, embeddings) skip it
+CREATE TRIGGER filter_facets_update AFTER UPDATE OF latitude, camera_model, date_taken, face_analyzed ON photos
+    FOR EACH ROW WHEN ((OLD.latitude IS NULL) <> (NEW.latitude IS NULL)
+                       OR OLD.camera_model IS DISTINCT FROM NEW.camera_model
+                       OR OLD.date_taken IS DISTINCT FROM NEW.date_taken
+                       OR OLD.face_analyzed IS DISTINCT FROM NEW.face_analyzed)
+    EXECUTE PROCEDURE filter_facets_photos();
+
+DROP TRIGGER IF EXISTS filter_facets_insert ON photo_tags;
+DROP TRIGGER IF EXISTS filter_facets_delete ON photo_tags;
+DROP TRIGGER IF EXISTS filter_facets_update ON photo_tags;
+CREATE TRIGGER filter_facets_insert AFTER INSERT ON photo_tags
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE filter_facets_photo_tags();
+CREATE TRIGGER filter_facets_delete AFTER DELETE ON photo_tags
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE filter_facets_photo_tags();
+CREATE TRIGGER filter_facets_update AFTER UPDATE OF tag, source ON photo_tags
+    FOR EACH ROW WHEN (OLD.tag IS DISTINCT FROM NEW.tag OR OLD.source IS DISTINCT FROM NEW.source)
+    EXECUTE PROCEDURE filter_facets_photo_tags();
+
+DROP TRIGGER IF EXISTS filter_facets_insert ON photo_faces;
+DROP TRIGGER IF EXISTS filter_facets_delete ON photo_faces;
+DROP TRIGGER IF EXISTS filter_facets_update ON photo_faces;
+CREATE TRIGGER filter_facets_insert AFTER INSERT ON photo_faces
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE filter_facets_photo_faces();
+CREATE TRIGGER filter_facets_delete AFTER DELETE ON photo_faces
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE filter_facets_photo_faces();
+CREATE TRIGGER filter_facets_update AFTER UPDATE OF photo_id ON photo_faces
+    FOR EACH ROW WHEN (OLD.photo_id IS DISTINCT FROM NEW.photo_id)
+    EXECUTE PROCEDURE filter_facets_photo_faces();
+
+-- Recompute every facet from the tables (first fill, or after triggers were disabled)
+CREATE OR REPLACE FUNCTION filter_facets_rebuild() RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    LOCK TABLE photos, photo_tags, photo_faces IN SHARE MODE;
+    UPDATE filter_facets SET count = 0, version = nextval('filter_facets_version') WHERE count <> 0;
+    PERFORM filter_facets_add(array_agg(f.facet), array_agg(f.source), array_agg(f.value), array_agg(1::BIGINT))
+    FROM photos r, filter_facets_of(
+        r.latitude IS NOT NULL, r.camera_model::TEXT, EXTRACT(YEAR FROM r.date_taken::timestamp)::INT::TEXT,
+        r.face_analyzed AND EXISTS (SELECT 1 FROM photo_faces pf WHERE pf.photo_id = r.id)) f
+    HAVING count(*) > 0;
+    PERFORM filter_facets_add(array_agg('tag'::TEXT), array_agg(r.source::TEXT), array_agg(r.tag::TEXT), array_agg(1::BIGINT))
+    FROM photo_tags r HAVING count(*) > 0;
+END $$;
+
+SELECT filter_facets_rebuild();